@@ -0,0 +1,142 @@
+"""
+Recall / latency / memory benchmark for the index types in index_factory.py.
+
+Ground truth is an exact flat inner-product search over the same vectors.
+Vectors come either from an existing flat faiss_index.idx (--index) or from
+a synthetic clustered set that mimics normalized sentence embeddings.
+
+    python benchmarks/ann_benchmark.py --synthetic 200000
+    python benchmarks/ann_benchmark.py --index faiss_index.idx --configs flat "ivf_flat:nprobe=32" hnsw
+"""
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_utils import write_results
+from index_factory import IndexFeeder, apply_search_params, index_memory_bytes, parse_index_spec
+
+DEFAULT_CONFIGS = [
+    'flat',
+    'ivf_flat:nprobe=8',
+    'ivf_flat:nprobe=32',
+    'ivf_pq:nprobe=16',
+    'opq_ivf_pq:nprobe=16',
+    'hnsw:ef_search=32',
+    'hnsw:ef_search=128',
+]
+
+
+def normalize(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype('float32')
+
+
+def synthetic_vectors(n, dimension, seed, clusters=256):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype('float32')
+    assignment = rng.integers(0, clusters, n)
+    return normalize(centers[assignment] + 0.6 * rng.standard_normal((n, dimension)).astype('float32'))
+
+
+def vectors_from_index(path):
+    index = faiss.read_index(path)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if not isinstance(index, faiss.IndexFlat):
+        raise SystemExit(f"{path} is not a flat index; its vectors can't be recovered exactly. Use --synthetic.")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def make_queries(vectors, n, seed):
+    # Perturbed copies of corpus vectors: realistic neighbourhoods, no exact hits
+    rng = np.random.default_rng(seed + 1)
+    picks = vectors[rng.integers(0, len(vectors), n)]
+    return normalize(picks + 0.1 * rng.standard_normal(picks.shape).astype('float32'))
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000.0)
+
+
+def run_config(spec, vectors, queries, ground_truth, k):
+    config = parse_index_spec(spec)
+    ids = np.arange(len(vectors), dtype='int64')
+
+    started = time.perf_counter()
+    feeder = IndexFeeder(config, vectors.shape[1])
+    for start in range(0, len(vectors), 10000):
+        feeder.add(vectors[start:start + 10000], ids[start:start + 10000])
+    index = feeder.finish()
+    apply_search_params(index, feeder.config)
+    build_seconds = time.perf_counter() - started
+
+    latencies = []
+    found = np.empty((len(queries), k), dtype='int64')
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        _, result = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - t0)
+        found[i] = result[0]
+
+    t0 = time.perf_counter()
+    index.search(queries, k)
+    batch_seconds = time.perf_counter() - t0
+
+    recall = np.mean([len(set(found[i]) & set(ground_truth[i])) / k for i in range(len(queries))])
+    return {
+        'config': spec,
+        'type': feeder.config['type'],
+        'vectors': len(vectors),
+        'build_seconds': build_seconds,
+        f'recall@{k}': float(recall),
+        'p50_ms': percentile_ms(latencies, 50),
+        'p99_ms': percentile_ms(latencies, 99),
+        'batch_qps': len(queries) / batch_seconds,
+        'memory_mb': index_memory_bytes(index) / (1024 * 1024),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ANN index types against exact search")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--index', help="read vectors from an existing flat FAISS index")
+    source.add_argument('--synthetic', type=int, default=100000, help="number of synthetic vectors")
+    parser.add_argument('--dim', type=int, default=384, help="synthetic vector dimension")
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=None, help="faiss OpenMP threads")
+    parser.add_argument('--configs', nargs='+', default=DEFAULT_CONFIGS,
+                        help="index specs, e.g. flat 'ivf_pq:nlist=4096,pq_m=48,nprobe=32' 'hnsw:ef_search=64'")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    vectors = vectors_from_index(args.index) if args.index else synthetic_vectors(args.synthetic, args.dim, args.seed)
+    queries = make_queries(vectors, args.queries, args.seed)
+
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    _, ground_truth = exact.search(queries, args.k)
+
+    results = []
+    print(f"{len(vectors)} vectors, {len(queries)} queries, k={args.k}")
+    print(f"{'config':<32} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'batch qps':>10} {'MB':>8} {'build s':>8}")
+    for spec in args.configs:
+        result = run_config(spec, vectors, queries, ground_truth, args.k)
+        results.append(result)
+        print(f"{spec:<32} {result[f'recall@{args.k}']:>7.3f} {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f} "
+              f"{result['batch_qps']:>10.0f} {result['memory_mb']:>8.1f} {result['build_seconds']:>8.1f}")
+
+    write_results(args.json, 'ann', args, results)
+
+
+if __name__ == "__main__":
+    main()
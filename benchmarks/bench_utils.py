@@ -0,0 +1,103 @@
+"""
+Shared helpers for the benchmark scripts: latency summaries, peak memory
+and the run metadata written alongside results so that JSON files from
+different commits can be compared (see compare.py).
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def latency_summary(samples):
+    # samples in seconds -> milliseconds
+    if not samples:
+        return {'count': 0, 'mean_ms': None, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        'count': len(samples),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+
+def read_status_kb(field, pid='self'):
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM, so each phase gets its own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(pid='self'):
+    """Peak resident memory since the last reset_peak_rss() (or process start)."""
+    kb = read_status_kb('VmHWM', pid)
+    if kb is None and pid == 'self':
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB on Linux, lifetime peak
+    return kb / 1024.0 if kb is not None else None
+
+
+class Phase:
+    """Times a block and records its peak memory: with Phase() as p: ...; p.seconds, p.peak_rss_mb"""
+
+    def __enter__(self):
+        reset_peak_rss()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        self.peak_rss_mb = peak_rss_mb()
+        return False
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_metadata(benchmark, args):
+    return {
+        'benchmark': benchmark,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': vars(args),
+    }
+
+
+def write_results(path, benchmark, args, results):
+    report = {'meta': run_metadata(benchmark, args), 'results': results}
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {path}")
+    return report
@@ -0,0 +1,68 @@
+"""
+Compares two benchmark JSON files (e.g. from two commits) metric by metric.
+
+    python benchmarks/compare.py before.json after.json
+    python benchmarks/compare.py before.json after.json --filter p99 --threshold 5
+"""
+import argparse
+import json
+
+
+def item_key(n, item):
+    # Per-size, per-config and per-backend results are keyed by name rather than position
+    if isinstance(item, dict):
+        if 'corpus_mb' in item:
+            return f"{item['corpus_mb']}mb"
+        for field in ('config', 'backend'):
+            if field in item:
+                return str(item[field])
+    return str(n)
+
+
+def flatten(value, path=''):
+    # {'retrieve': {'hybrid': {'p50_ms': 1.2}}} -> {'retrieve.hybrid.p50_ms': 1.2}
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = ((item_key(n, item), item) for n, item in enumerate(value))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {path: float(value)}
+    else:
+        return {}
+    flat = {}
+    for key, item in items:
+        flat.update(flatten(item, f"{path}.{key}" if path else str(key)))
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--filter', default=None, help="only metrics whose name contains this")
+    parser.add_argument('--threshold', type=float, default=0.0, help="only show changes of at least this many percent")
+    args = parser.parse_args()
+
+    reports = []
+    for path in (args.before, args.after):
+        with open(path, 'r', encoding='utf-8') as f:
+            reports.append(json.load(f))
+    before, after = (report['meta'] for report in reports)
+    print(f"before: {before['benchmark']} @ {(before['commit'] or 'unknown')[:12]}  {before['timestamp']}")
+    print(f"after:  {after['benchmark']} @ {(after['commit'] or 'unknown')[:12]}  {after['timestamp']}")
+
+    old, new = (flatten(report['results']) for report in reports)
+    width = max([len(name) for name in old] + [6])
+    print(f"{'metric':<{width}} {'before':>12} {'after':>12} {'change':>9}")
+    for name in sorted(old.keys() & new.keys()):
+        if args.filter and args.filter not in name:
+            continue
+        a, b = old[name], new[name]
+        change = (b - a) / abs(a) * 100.0 if a else (0.0 if b == a else float('inf'))
+        if abs(change) < args.threshold:
+            continue
+        print(f"{name:<{width}} {a:>12.4g} {b:>12.4g} {change:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
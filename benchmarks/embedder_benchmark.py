@@ -0,0 +1,151 @@
+"""
+Latency / throughput / agreement benchmark for the embedding backends in
+embedders.py, measured against the reference PyTorch backend.
+
+Passages come from the indexed corpus (passage store) and are embedded once
+with the reference backend into an exact index, as the production index
+would be. Each backend then embeds the queries; top-k agreement is the
+overlap of its results with the reference backend's results.
+
+    python benchmarks/embedder_benchmark.py
+    python benchmarks/embedder_benchmark.py --backends torch int8 onnx_int8 --threads 4 --json embedders.json
+"""
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_utils import write_results
+from embedders import EMBEDDING_BACKENDS, load_embedder
+from passage_store import PassageStore, store_exists
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+QUESTIONS = [
+    "What does the Bhagavad Gita say about karma?",
+    "Explain the concept of dharma in the Vedas.",
+    "Summarize the story of Rama and Sita in the Ramayana.",
+    "Who was Hiranyakashipu?",
+    "What is the Gayatri mantra?",
+    "Why did Arjuna refuse to fight at Kurukshetra?",
+    "What are the four Vedas?",
+    "How is Brahman described in the Upanishads?",
+    "What happened during the churning of the ocean?",
+    "Who killed Ravana and why?",
+    "What is moksha?",
+    "Describe the ten avatars of Vishnu.",
+    "What is the role of yajna in Vedic ritual?",
+    "Who was Prahlada?",
+    "What does the Rigveda say about creation?",
+    "What is the meaning of Om?",
+]
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_passages(prefix, limit, seed):
+    if not store_exists(prefix):
+        raise SystemExit(f"No passage store at {prefix}; index the corpus first (python scripture_retriever.py)")
+    store = PassageStore.open(prefix)
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(store), size=min(limit, len(store)), replace=False))
+    passages = [store.get(int(store.ids[row]))[0] for row in rows]
+    store.close()
+    return passages
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000.0)
+
+
+def run_backend(backend, threads, queries, batch_size, passage_index, reference, k):
+    started = time.perf_counter()
+    embedder = load_embedder(MODEL_NAME, backend, threads)
+    load_seconds = time.perf_counter() - started
+    embedder.encode(queries[:1])  # first call initializes kernels
+
+    latencies = []
+    for query in queries:
+        t0 = time.perf_counter()
+        embedder.encode([query])
+        latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    vectors = normalize(embedder.encode(queries, batch_size=batch_size))
+    batch_seconds = time.perf_counter() - t0
+
+    _, found = passage_index.search(vectors, k)
+    result = {
+        'backend': backend,
+        'load_seconds': load_seconds,
+        'p50_ms': percentile_ms(latencies, 50),
+        'p99_ms': percentile_ms(latencies, 99),
+        'queries_per_second': len(queries) / batch_seconds,
+        'cosine_to_reference': None,
+        f'top{k}_agreement': None,
+    }
+    if reference is not None:
+        ref_vectors, ref_found = reference
+        result['cosine_to_reference'] = float(np.mean(np.sum(vectors * ref_vectors, axis=1)))
+        result[f'top{k}_agreement'] = float(np.mean(
+            [len(set(a) & set(b)) / k for a, b in zip(found, ref_found)]
+        ))
+    return result, (vectors, found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends against the PyTorch reference")
+    parser.add_argument('--backends', nargs='+', default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument('--threads', type=int, default=None, help="threads per backend (default: library default)")
+    parser.add_argument('--passages', type=int, default=5000, help="passages sampled from the store")
+    parser.add_argument('--store', default=os.path.join(ROOT, 'passages'), help="passage store prefix")
+    parser.add_argument('--queries', type=int, default=256, help="number of queries (questions are repeated with variations)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    passages = load_passages(args.store, args.passages, args.seed)
+    # Variations keep the embedding cache-free paths honest without needing a query log
+    queries = [f"{QUESTIONS[i % len(QUESTIONS)]} ({i // len(QUESTIONS)})" if i >= len(QUESTIONS)
+               else QUESTIONS[i] for i in range(args.queries)]
+
+    print(f"Embedding {len(passages)} passages with the torch reference backend...")
+    reference_embedder = load_embedder(MODEL_NAME, 'torch', args.threads)
+    passage_vectors = normalize(reference_embedder.encode(passages, batch_size=64))
+    passage_index = faiss.IndexFlatIP(passage_vectors.shape[1])
+    passage_index.add(passage_vectors)
+    del reference_embedder
+
+    backends = ['torch'] + [b for b in args.backends if b != 'torch']
+    results = []
+    reference = None
+    print(f"{len(queries)} queries, k={args.k}, threads={args.threads or 'default'}")
+    print(f"{'backend':<10} {'load s':>7} {'p50 ms':>8} {'p99 ms':>8} {'q/s':>8} {'cosine':>7} {'top-k':>6}")
+    for backend in backends:
+        result, output = run_backend(backend, args.threads, queries, args.batch_size, passage_index, reference, args.k)
+        if backend == 'torch':
+            reference = output
+            result['cosine_to_reference'] = 1.0
+            result[f'top{args.k}_agreement'] = 1.0
+        if backend in args.backends:
+            results.append(result)
+            print(f"{backend:<10} {result['load_seconds']:>7.1f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                  f"{result['queries_per_second']:>8.0f} {result['cosine_to_reference']:>7.4f} "
+                  f"{result[f'top{args.k}_agreement']:>6.3f}")
+
+    write_results(args.json, 'embedder', args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+End-to-end load driver for the FastAPI app, fully offline.
+
+Builds an index over a synthetic corpus (or reuses --data-dir), starts a
+local Bing stand-in and the server (main.py) with the simulated Gemini
+model, then drives /api/chat or /api/chat/stream at a fixed concurrency.
+Both stand-ins have configurable latency and 429 rates. Reports
+throughput, latency percentiles (time to first token for the stream),
+per-stage server timings from the Server-Timing header / done event,
+status counts and the server's peak RSS.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --endpoint stream --concurrency 32 --requests 1000 \\
+        --gemini-latency-ms 400 --gemini-429-rate 0.05 --bing-429-rate 0.1 --json load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import ROOT, latency_summary, peak_rss_mb, write_results
+from synthetic_corpus import NAMES, TERMS, generate_corpus
+
+TEMPLATES = [
+    "What does the scripture say about {term}?",
+    "Who was {name}?",
+    "Explain {term} in the story of {name}.",
+    "Why did {name} practice {term}?",
+    "What is the meaning of {term}?",
+]
+
+
+def make_questions(count, repeat_ratio, seed):
+    # A repeat_ratio share of requests re-asks an earlier question (answer cache hits)
+    rng = random.Random(seed)
+    questions = []
+    for i in range(count):
+        if questions and rng.random() < repeat_ratio:
+            questions.append(rng.choice(questions))
+        else:
+            question = rng.choice(TEMPLATES).format(term=rng.choice(TERMS), name=rng.choice(NAMES))
+            questions.append(f"{question} ({i})")
+    return questions
+
+
+class BingStub(ThreadingHTTPServer):
+    """Serves Bing-shaped result pages after `latency` seconds; 429s with probability rate_limit_rate."""
+    daemon_threads = True
+
+    def __init__(self, latency, rate_limit_rate, results=5, seed=0):
+        super().__init__(('127.0.0.1', 0), BingHandler)
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.results = results
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/search"
+
+
+class BingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stub = self.server
+        query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+        with stub.lock:
+            stub.requests += 1
+            limited = stub.rng.random() < stub.rate_limit_rate
+            stub.rate_limited += limited
+        time.sleep(stub.latency)
+        if limited:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.end_headers()
+            return
+        items = ''.join(
+            f'<li class="b_algo"><h2><a href="https://example.org/{n}">Result {n} for {query}</a></h2>'
+            f'<p>Simulated snippet {n} about {query}, with some surrounding words to parse.</p></li>'
+            for n in range(stub.results)
+        )
+        body = f'<html><head><script>var x = 1;</script></head><body><ol id="b_results">{items}</ol></body></html>'
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def build_index(data_dir, args):
+    generate_corpus(os.path.join(data_dir, 'corpus'), args.corpus_mb, args.files, args.seed)
+    subprocess.run([sys.executable, os.path.join(ROOT, 'scripture_retriever.py'), '--full', '--workers', '1',
+                    '--data-dir', data_dir], check=True, stdout=subprocess.DEVNULL)
+
+
+def start_server(port, data_dir, bing_url, args, log):
+    env = dict(os.environ)
+    env.update({
+        'GEMINI_MODEL': 'fake',
+        'FAKE_GEMINI_LATENCY_MS': str(args.gemini_latency_ms),
+        'FAKE_GEMINI_429_RATE': str(args.gemini_429_rate),
+        'FAKE_GEMINI_FAIL_RATE': str(args.gemini_fail_rate),
+        'GEMINI_RPM': str(args.gemini_rpm),
+        'GEMINI_BURST': str(max(1, args.concurrency)),
+        'WEB_SEARCH_URL': bing_url,
+        'DATA_DIR': data_dir,
+        'WARMUP': 'retriever',
+        'HF_HUB_OFFLINE': env.get('HF_HUB_OFFLINE', '1'),
+        'TRANSFORMERS_OFFLINE': env.get('TRANSFORMERS_OFFLINE', '1'),
+    })
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'main.py'), '--host', '127.0.0.1', '--port', str(port)],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(client, base_url, server, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"Server exited with code {server.returncode}; see the server log")
+        try:
+            if (await client.get(f"{base_url}/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.25)
+    raise SystemExit(f"Server not ready after {timeout}s")
+
+
+def parse_server_timing(header):
+    timings = {}
+    for part in (header or '').split(','):
+        name, _, duration = part.strip().partition(';dur=')
+        if name and duration:
+            timings[name] = float(duration)
+    return timings
+
+
+async def send_chat(client, base_url, question):
+    started = time.perf_counter()
+    response = await client.post(f"{base_url}/api/chat", json={'message': question})
+    elapsed = time.perf_counter() - started
+    return {'status': response.status_code, 'seconds': elapsed, 'first_token': None,
+            'timings': parse_server_timing(response.headers.get('server-timing'))}
+
+
+async def send_stream(client, base_url, question):
+    started = time.perf_counter()
+    first_token = None
+    status = None
+    timings = {}
+    async with client.stream('POST', f"{base_url}/api/chat/stream", json={'message': question}) as response:
+        status = response.status_code
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith('event: '):
+                event = line[7:]
+            elif line.startswith('data: '):
+                if event == 'token' and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event == 'done':
+                    timings = json.loads(line[6:]).get('timings', {})
+                elif event == 'error':
+                    status = 'error'
+    return {'status': status, 'seconds': time.perf_counter() - started, 'first_token': first_token,
+            'timings': timings}
+
+
+async def drive(base_url, questions, args, server):
+    send = send_stream if args.endpoint == 'stream' else send_chat
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.request_timeout) as client:
+        await wait_ready(client, base_url, server, args.ready_timeout)
+        for question in questions[:args.warmup]:
+            await send(client, base_url, f"warm-up {question}")
+
+        queue = asyncio.Queue()
+        for question in questions:
+            queue.put_nowait(question)
+        samples = []
+
+        async def worker():
+            while not queue.empty():
+                question = queue.get_nowait()
+                try:
+                    samples.append(await send(client, base_url, question))
+                except httpx.HTTPError as e:
+                    samples.append({'status': type(e).__name__, 'seconds': None, 'first_token': None, 'timings': {}})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - started
+        health = (await client.get(f"{base_url}/healthz")).json()
+    return samples, wall, health
+
+
+def summarize(samples, wall):
+    statuses = {}
+    for s in samples:
+        statuses[str(s['status'])] = statuses.get(str(s['status']), 0) + 1
+    ok = [s for s in samples if s['status'] == 200]
+    stages = sorted({stage for s in ok for stage in s['timings']})
+    return {
+        'requests': len(samples),
+        'wall_seconds': wall,
+        'throughput_rps': len(samples) / wall,
+        'ok_rps': len(ok) / wall,
+        'statuses': statuses,
+        'error_rate': 1.0 - len(ok) / len(samples) if samples else 0.0,
+        'latency': latency_summary([s['seconds'] for s in ok]),
+        'first_token': latency_summary([s['first_token'] for s in ok if s['first_token'] is not None]),
+        # Server-side stage durations (ms) of successful requests
+        'server_stages': {stage: latency_summary([s['timings'][stage] / 1000.0 for s in ok if stage in s['timings']])
+                          for stage in stages},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end load test of the chat API")
+    parser.add_argument('--endpoint', choices=['chat', 'stream'], default='chat')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=5, help="unrecorded requests before the run")
+    parser.add_argument('--repeat-ratio', type=float, default=0.2, help="share of repeated questions")
+    parser.add_argument('--gemini-latency-ms', type=float, default=300)
+    parser.add_argument('--gemini-429-rate', type=float, default=0.0)
+    parser.add_argument('--gemini-fail-rate', type=float, default=0.0)
+    parser.add_argument('--gemini-rpm', type=float, default=100000, help="client-side quota in the server")
+    parser.add_argument('--bing-latency-ms', type=float, default=150)
+    parser.add_argument('--bing-429-rate', type=float, default=0.0)
+    parser.add_argument('--corpus-mb', type=float, default=1.0)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--data-dir', default=None, help="reuse an indexed data directory instead of building one")
+    parser.add_argument('--request-timeout', type=float, default=60)
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    parser.add_argument('--server-log', default=None, help="write server output here (default: discarded)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir
+    temporary = data_dir is None
+    if temporary:
+        data_dir = tempfile.mkdtemp(prefix='vedaai-load-')
+        print(f"Building a {args.corpus_mb} MB synthetic index in {data_dir}...")
+        build_index(data_dir, args)
+
+    bing = BingStub(args.bing_latency_ms / 1000.0, args.bing_429_rate, seed=args.seed)
+    threading.Thread(target=bing.serve_forever, daemon=True).start()
+    port = free_port()
+    log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+    server = start_server(port, data_dir, bing.url, args, log)
+    try:
+        questions = make_questions(args.requests, args.repeat_ratio, args.seed)
+        print(f"Sending {args.requests} {args.endpoint} requests at concurrency {args.concurrency}...")
+        samples, wall, health = asyncio.run(drive(f"http://127.0.0.1:{port}", questions, args, server))
+        result = summarize(samples, wall)
+        result['server_peak_rss_mb'] = peak_rss_mb(server.pid)
+        result['driver_peak_rss_mb'] = peak_rss_mb()
+        result['gemini'] = health.get('gemini')
+        result['bing'] = {'requests': bing.requests, 'rate_limited': bing.rate_limited}
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        bing.shutdown()
+        if log is not subprocess.DEVNULL:
+            log.close()
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    latency = result['latency']
+    print(f"{result['throughput_rps']:.1f} req/s, statuses {result['statuses']}")
+    if latency['count']:
+        print(f"latency p50 {latency['p50_ms']:.1f} ms, p95 {latency['p95_ms']:.1f} ms, p99 {latency['p99_ms']:.1f} ms")
+    if result['first_token']['count']:
+        print(f"first token p50 {result['first_token']['p50_ms']:.1f} ms, p99 {result['first_token']['p99_ms']:.1f} ms")
+    for stage, stats in result['server_stages'].items():
+        print(f"  {stage:<16} p50 {stats['p50_ms']:>8.2f} ms   p99 {stats['p99_ms']:>8.2f} ms")
+    print(f"server peak RSS {result['server_peak_rss_mb']} MB")
+
+    write_results(args.json, f'load_{args.endpoint}', args, result)
+
+
+if __name__ == "__main__":
+    main()
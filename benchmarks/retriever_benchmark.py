@@ -0,0 +1,181 @@
+"""
+Micro-benchmarks for ScriptureRetriever at several corpus sizes:
+chunk_text, index_corpus (full build and an incremental update),
+load_index and retrieve in each retrieval mode.
+
+Each size gets a fresh synthetic corpus (synthetic_corpus.py) and index in
+a temporary data directory, so nothing touches the real index. Runs
+offline: the embedding model must already be in the local Hugging Face
+cache (set HF_HUB_OFFLINE=0 to allow a download). Peak memory is the
+process's peak RSS during each phase (Linux; embedding worker processes
+are not included, hence --workers 1 by default).
+
+    python benchmarks/retriever_benchmark.py
+    python benchmarks/retriever_benchmark.py --sizes 1 10 50 --index-type hnsw --json retriever.json
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_utils import Phase, latency_summary, write_results
+from synthetic_corpus import generate_corpus
+from scripture_retriever import RETRIEVAL_MODES, ScriptureRetriever, chunk_text
+from index_factory import parse_index_spec
+
+QUESTIONS = [
+    "What does the Bhagavad Gita say about karma?",
+    "Explain the concept of dharma in the Vedas.",
+    "Who was Hiranyakashipu?",
+    "What is the Gayatri mantra?",
+    "Why did Arjuna refuse to fight?",
+    "How is brahman described by the rishi?",
+    "What is moksha?",
+    "Who was Prahlada?",
+    "What is the role of yajna in Vedic ritual?",
+    "What is the meaning of om?",
+]
+
+
+def make_queries(count):
+    # Numbered variations keep every query a cache miss
+    return [f"{QUESTIONS[i % len(QUESTIONS)]} ({i // len(QUESTIONS)})" if i >= len(QUESTIONS)
+            else QUESTIONS[i] for i in range(count)]
+
+
+def bench_chunk_text(corpus_dir, repeats):
+    texts = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, filename), 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    total_bytes = sum(len(text.encode('utf-8')) for text in texts)
+    runs = []
+    with Phase() as phase:
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            chunks = sum(len(chunk_text(text)) for text in texts)
+            runs.append(time.perf_counter() - t0)
+    best = min(runs)
+    return {
+        'seconds': best,
+        'chunks': chunks,
+        'mb_per_second': total_bytes / best / 1e6,
+        'chunks_per_second': chunks / best,
+        'peak_rss_mb': phase.peak_rss_mb,
+    }
+
+
+def bench_retrieve(retriever, queries, top_k):
+    results = {}
+    for mode in RETRIEVAL_MODES:
+        retriever.retrieval_cache.clear()
+        retriever.embedding_cache.clear()
+        retriever.retrieve(queries[0], top_k, mode)  # warm-up
+        latencies = []
+        hits = 0
+        with Phase() as phase:
+            for query in queries:
+                t0 = time.perf_counter()
+                passages = retriever.retrieve(query, top_k, mode)
+                latencies.append(time.perf_counter() - t0)
+                hits += bool(passages)
+        results[mode] = dict(latency_summary(latencies), queries_per_second=len(queries) / phase.seconds,
+                             hit_rate=hits / len(queries), peak_rss_mb=phase.peak_rss_mb)
+
+        # The same queries through the bulk path
+        retriever.retrieval_cache.clear()
+        retriever.embedding_cache.clear()
+        with Phase() as phase:
+            retriever.retrieve_batch(queries, top_k, mode)
+        results[mode]['batch_seconds'] = phase.seconds
+        results[mode]['batch_queries_per_second'] = len(queries) / phase.seconds
+    return results
+
+
+def bench_size(size_mb, args):
+    data_dir = tempfile.mkdtemp(prefix=f'vedaai-bench-{size_mb}mb-', dir=args.work_dir)
+    try:
+        corpus_dir = os.path.join(data_dir, 'corpus')
+        paths = generate_corpus(corpus_dir, size_mb, args.files, args.seed)
+        result = {'corpus_mb': size_mb, 'files': len(paths)}
+        result['chunk_text'] = bench_chunk_text(corpus_dir, args.repeats)
+
+        with Phase() as phase:
+            retriever = ScriptureRetriever(index_config=parse_index_spec(args.index_type),
+                                           embedding_backend=args.embedding_backend, data_dir=data_dir)
+        result['model_load'] = {'seconds': phase.seconds, 'peak_rss_mb': phase.peak_rss_mb}
+
+        with Phase() as phase:
+            retriever.index_corpus(full_rebuild=True, workers=args.workers, batch_size=args.batch_size)
+        chunks = retriever.index.ntotal
+        result['index_corpus'] = {
+            'seconds': phase.seconds,
+            'chunks': chunks,
+            'chunks_per_second': chunks / phase.seconds,
+            'mb_per_second': size_mb * 1024 * 1024 / phase.seconds / 1e6,
+            'peak_rss_mb': phase.peak_rss_mb,
+        }
+
+        # Incremental update: one file changes
+        with open(paths[0], 'a', encoding='utf-8') as f:
+            f.write("\n\n9.1 An appended verse about dharma and karma, sung by the rishi Narada.\n")
+        with Phase() as phase:
+            retriever.index_corpus(workers=args.workers, batch_size=args.batch_size)
+        result['index_corpus_incremental'] = {'seconds': phase.seconds, 'peak_rss_mb': phase.peak_rss_mb}
+
+        with Phase() as phase:
+            retriever.load_index()
+        result['load_index'] = {'seconds': phase.seconds, 'peak_rss_mb': phase.peak_rss_mb}
+
+        result['retrieve'] = bench_retrieve(retriever, make_queries(args.queries), args.top_k)
+        retriever.passages.close()
+        retriever.lexical.close()
+        return result
+    finally:
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunking, indexing, loading and retrieval")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[0.5, 2, 8], help="corpus sizes in MB")
+    parser.add_argument('--files', type=int, default=4, help="files per corpus")
+    parser.add_argument('--index-type', default='flat')
+    parser.add_argument('--embedding-backend', default='torch')
+    parser.add_argument('--workers', type=int, default=1, help="embedding processes for index_corpus")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=3, help="chunk_text repetitions (best is reported)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help="parent directory for temporary data (default: system temp)")
+    parser.add_argument('--keep', action='store_true', help="keep the generated corpora and indexes")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size_mb in args.sizes:
+        print(f"\n=== {size_mb} MB corpus ===")
+        results.append(bench_size(size_mb, args))
+
+    print(f"\n{'MB':>6} {'chunks':>8} {'chunk MB/s':>10} {'index s':>8} {'incr s':>7} {'load s':>7} "
+          f"{'mode':>8} {'p50 ms':>7} {'p99 ms':>7} {'q/s':>7} {'batch q/s':>9} {'peak MB':>8}")
+    for r in results:
+        for mode, stats in r['retrieve'].items():
+            print(f"{r['corpus_mb']:>6} {r['index_corpus']['chunks']:>8} {r['chunk_text']['mb_per_second']:>10.1f} "
+                  f"{r['index_corpus']['seconds']:>8.1f} {r['index_corpus_incremental']['seconds']:>7.2f} "
+                  f"{r['load_index']['seconds']:>7.2f} {mode:>8} {stats['p50_ms']:>7.2f} {stats['p99_ms']:>7.2f} "
+                  f"{stats['queries_per_second']:>7.0f} {stats['batch_queries_per_second']:>9.0f} "
+                  f"{r['index_corpus']['peak_rss_mb'] or 0:>8.0f}")
+
+    write_results(args.json, 'retriever', args, results)
+
+
+if __name__ == "__main__":
+    main()
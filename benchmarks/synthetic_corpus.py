@@ -0,0 +1,93 @@
+"""
+Deterministic synthetic scripture corpus for benchmarks.
+
+Text follows the layout of the real corpus files: page markers, numbered
+verses, and paragraphs separated by blank lines. Words are drawn from a
+Zipf-distributed vocabulary of English and transliterated Sanskrit terms,
+so term statistics (and BM25 posting lengths) look like real text. The
+same seed and size always give the same files.
+
+    python benchmarks/synthetic_corpus.py --out /tmp/bench/corpus --mb 5 --files 4
+"""
+import argparse
+import os
+
+import numpy as np
+
+NAMES = [
+    'Arjuna', 'Krishna', 'Rama', 'Sita', 'Lakshmana', 'Hanuman', 'Ravana', 'Vishnu', 'Shiva', 'Brahma',
+    'Indra', 'Agni', 'Varuna', 'Surya', 'Soma', 'Prahlada', 'Hiranyakashipu', 'Narasimha', 'Yudhishthira',
+    'Bhishma', 'Drona', 'Karna', 'Draupadi', 'Vasishtha', 'Vishvamitra', 'Narada', 'Markandeya', 'Dhruva',
+]
+TERMS = [
+    'dharma', 'karma', 'moksha', 'atman', 'brahman', 'yajna', 'yoga', 'bhakti', 'jnana', 'maya', 'samsara',
+    'ahimsa', 'satya', 'tapas', 'mantra', 'veda', 'rishi', 'deva', 'asura', 'loka', 'prana', 'guna', 'sattva',
+    'rajas', 'tamas', 'ananda', 'shanti', 'om', 'gayatri', 'kshetra', 'avatara', 'purusha', 'prakriti',
+]
+WORDS = [
+    'the', 'and', 'of', 'to', 'in', 'is', 'he', 'who', 'that', 'with', 'his', 'by', 'all', 'was', 'from',
+    'for', 'as', 'which', 'king', 'sage', 'sacrifice', 'fire', 'water', 'earth', 'sky', 'river', 'mountain',
+    'war', 'truth', 'peace', 'devotion', 'duty', 'son', 'father', 'mother', 'gods', 'demons', 'battle',
+    'wisdom', 'heaven', 'forest', 'ocean', 'chariot', 'bow', 'arrow', 'hymn', 'praise', 'light', 'darkness',
+    'eternal', 'self', 'mind', 'body', 'soul', 'action', 'fruit', 'knowledge', 'world', 'creation', 'time',
+]
+VOCABULARY = WORDS + TERMS + NAMES
+
+# Zipf-like frequencies over the vocabulary, common words first
+WEIGHTS = 1.0 / np.arange(1, len(VOCABULARY) + 1) ** 1.1
+WEIGHTS /= WEIGHTS.sum()
+
+
+def generate_text(rng, target_bytes):
+    parts = []
+    size = 0
+    page = 1
+    chapter = 1
+    verse = 1
+    while size < target_bytes:
+        if verse % 20 == 1:
+            parts.append(f"--- Page {page} ---\n")
+            page += 1
+        lines = []
+        for _ in range(int(rng.integers(1, 5))):
+            words = [VOCABULARY[i] for i in rng.choice(len(VOCABULARY), size=int(rng.integers(8, 24)), p=WEIGHTS)]
+            line = ' '.join(words)
+            lines.append(line[0].upper() + line[1:] + '.')
+        paragraph = f"{chapter}.{verse} " + '\n'.join(lines) + '\n\n'
+        parts.append(paragraph)
+        size += len(paragraph)
+        verse += 1
+        if verse > 60:
+            chapter += 1
+            verse = 1
+    return ''.join(parts)
+
+
+def generate_corpus(out_dir, total_mb=1.0, files=4, seed=0):
+    """Writes `files` text files totalling about total_mb MB; returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    per_file = int(total_mb * 1024 * 1024 / files)
+    paths = []
+    for n in range(files):
+        path = os.path.join(out_dir, f"Synthetic{n + 1:02d}_text.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(generate_text(rng, per_file))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic scripture corpus")
+    parser.add_argument('--out', required=True, help="corpus directory to write")
+    parser.add_argument('--mb', type=float, default=1.0, help="total corpus size in MB")
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_corpus(args.out, args.mb, args.files, args.seed)
+    print(f"Wrote {len(paths)} files ({args.mb} MB) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    # "What is Dharma?" and "what is dharma" should share cache entries
+    query = re.sub(r'\s+', ' ', query.lower())
+    return query.strip(' ?!.')
+
+
+def estimate_size(value):
+    # Rough byte size of a cached value, used for the size bound
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and total bytes, with optional TTL."""
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None, sizeof=estimate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.total_bytes = 0
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.total_bytes > self.max_bytes
+            ):
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.stats.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def info(self):
+        with self.lock:
+            info = self.stats.as_dict()
+            info.update({
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            })
+            return info
+
+
+class SemanticCache:
+    """
+    Answer cache keyed on normalized query embeddings. A lookup hits when a
+    stored embedding has cosine similarity >= threshold with the query, so
+    near-duplicate questions share one answer.
+    """
+
+    def __init__(self, dimension, max_entries=1024, threshold=0.95, ttl=None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.vectors = np.zeros((max_entries, dimension), dtype='float32')
+        self.slots = OrderedDict()  # slot -> (value, expires_at), in LRU order
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+
+    def get(self, embedding, default=None):
+        embedding = np.asarray(embedding, dtype='float32').reshape(-1)
+        with self.lock:
+            if not self.slots:
+                self.stats.misses += 1
+                return default
+            occupied = np.fromiter(self.slots.keys(), dtype='int64', count=len(self.slots))
+            similarities = self.vectors[occupied] @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.stats.misses += 1
+                return default
+            slot = int(occupied[best])
+            value, expires_at = self.slots[slot]
+            if expires_at is not None and expires_at < time.monotonic():
+                self._release(slot)
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return default
+            self.slots.move_to_end(slot)
+            self.stats.hits += 1
+            return value
+
+    def set(self, embedding, value):
+        embedding = np.asarray(embedding, dtype='float32').reshape(-1)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            if not self.free_slots:
+                oldest = next(iter(self.slots))
+                self._release(oldest)
+                self.stats.evictions += 1
+            slot = self.free_slots.pop()
+            self.vectors[slot] = embedding
+            self.slots[slot] = (value, expires_at)
+
+    def _release(self, slot):
+        del self.slots[slot]
+        self.free_slots.append(slot)
+
+    def clear(self):
+        with self.lock:
+            self.slots.clear()
+            self.free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def info(self):
+        with self.lock:
+            info = self.stats.as_dict()
+            info.update({
+                'entries': len(self.slots),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+            })
+            return info
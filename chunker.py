@@ -0,0 +1,238 @@
+"""
+Streaming, verse-aware chunker for the scripture corpus.
+
+Boundaries are found on the raw lines, before any whitespace is collapsed:
+blank lines end a paragraph, a leading verse number ("2.47", "12.") or a
+heading ("Shloka 5") starts a new verse, and a closing danda marker
+("॥ 47 ॥", "|| 47 ||") ends one. Verses and paragraphs are then packed into
+chunks of at most max_tokens, cutting between verses where possible and
+between lines or sentences otherwise, and each chunk starts with up to
+overlap_tokens of the previous one. Every chunk keeps its verse range, page
+and character offsets into the source file.
+
+Everything is a generator over lines, so a file is never held in memory.
+
+    for chunk in chunk_file('corpus/BhagavadGita_text.txt'):
+        chunk['text'], chunk['verse'], chunk['page'], chunk['start'], chunk['end']
+"""
+import re
+
+from tokens import estimate_tokens
+
+# all-MiniLM-L6-v2 reads at most 256 word pieces. Transliterated Sanskrit
+# splits into more pieces than the ~4 characters per token estimate, so
+# chunks stay well below that.
+CHUNK_TOKENS = 160
+CHUNK_OVERLAP = 32
+MAX_UNIT_CHARS = 1 << 16     # a verse/paragraph longer than this is flushed in parts
+MAX_LINE_CHARS = 1 << 16     # lines are read in pieces of at most this many characters
+
+PAGE_MARKER_RE = re.compile(r'---\s*Page\s+(\d+)\s*---')
+# "2.47 ...", "1:1:3 ...", "12. ...", "१.१ ..." (\d matches Devanagari digits too)
+LEADING_VERSE_RE = re.compile(r'^\s*(\d{1,4}(?:[.:]\d{1,4}){1,3}|\d{1,4}(?=[.)]))[.:)]?\s+(?=\S)')
+HEADING_VERSE_RE = re.compile(
+    r'^\s*(?:verse|sloka|shloka|śloka|mantra|sutra|sūtra)\s+(\d{1,4}(?:[.:]\d{1,4}){0,3})\b', re.IGNORECASE)
+TRAILING_VERSE_RE = re.compile(r'(?:॥|\|\||।।)\s*(\d{1,4}(?:[.:]\d{1,4}){0,3})\s*(?:॥|\|\||।।)\s*$')
+# Sentence ends, but not the "12." of a verse number or the first danda of "॥ 47 ॥"
+SENTENCE_END_RE = re.compile(r'(?<!\d)[.!?;](?=\s)|[।॥](?=\s+[^\d\s])')
+WORD_RE = re.compile(r'\S+')
+DEVANAGARI_DIGITS = str.maketrans('०१२३४५६७८९', '0123456789')
+
+
+def verse_label(match):
+    return match.group(1).translate(DEVANAGARI_DIGITS) if match else None
+
+
+def iter_units(lines, max_unit_chars=MAX_UNIT_CHARS):
+    """
+    Groups raw lines into verses/paragraphs. Yields
+    {'verse', 'page', 'lines': [(line, offset), ...]} where offset is the
+    line's character offset in the input. Page markers are blanked out in
+    place so offsets still point into the original text.
+    """
+    page = None
+    offset = 0
+    unit = None
+    continued_verse = None
+    for line in lines:
+        line_offset = offset
+        offset += len(line)
+        markers = list(PAGE_MARKER_RE.finditer(line))
+        if markers:
+            page = int(markers[-1].group(1))
+            line = PAGE_MARKER_RE.sub(lambda m: ' ' * len(m.group()), line)
+        if not line.strip():
+            # A page marker on its own line is not a paragraph break
+            if not markers and unit is not None:
+                yield unit
+                unit = None
+                continued_verse = None
+            continue
+        label = verse_label(LEADING_VERSE_RE.match(line) or HEADING_VERSE_RE.match(line))
+        if label is not None and unit is not None:
+            yield unit
+            unit = None
+        if unit is None:
+            unit = {'verse': label or continued_verse, 'page': page, 'lines': [], 'size': 0}
+            continued_verse = None
+        unit['lines'].append((line, line_offset))
+        unit['size'] += len(line)
+        closing = TRAILING_VERSE_RE.search(line)
+        if closing:
+            unit['verse'] = unit['verse'] or verse_label(closing)
+            yield unit
+            unit = None
+        elif unit['size'] >= max_unit_chars:
+            # Keeps memory bounded for text without blank lines; the rest of
+            # the paragraph continues under the same verse
+            continued_verse = unit['verse']
+            yield unit
+            unit = None
+    if unit is not None:
+        yield unit
+
+
+def split_line(line, offset, max_tokens, count_tokens):
+    # (text, start, end) per sentence of the line, with whitespace collapsed;
+    # sentences over max_tokens are cut into windows of words
+    begin = 0
+    for end in [m.end() for m in SENTENCE_END_RE.finditer(line)] + [len(line)]:
+        sentence, base = line[begin:end], offset + begin
+        begin = end
+        text = ' '.join(sentence.split())
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        if tokens <= max_tokens:
+            yield text, base + len(sentence) - len(sentence.lstrip()), base + len(sentence.rstrip())
+            continue
+        max_chars = max(1, max_tokens * len(text) // tokens)
+        # (start, end) of each word; a run without spaces longer than a whole
+        # window is hard-cut by characters
+        pieces = [(cut, min(cut + max_chars, word.end()))
+                  for word in WORD_RE.finditer(sentence)
+                  for cut in range(word.start(), word.end(), max_chars)]
+        window = []
+        size = 0
+        for start, end in pieces:
+            if window and size + 1 + end - start > max_chars:
+                yield ' '.join(sentence[a:b] for a, b in window), base + window[0][0], base + window[-1][1]
+                window, size = [], -1
+            window.append((start, end))
+            size += 1 + end - start
+        if window:
+            yield ' '.join(sentence[a:b] for a, b in window), base + window[0][0], base + window[-1][1]
+
+
+def iter_segments(lines, max_tokens, count_tokens):
+    # Sentence-sized pieces tagged with their unit; the packing below never
+    # has to look inside them
+    for number, unit in enumerate(iter_units(lines)):
+        first = True
+        for line, offset in unit['lines']:
+            for text, start, end in split_line(line, offset, max_tokens, count_tokens):
+                yield {'text': text, 'raw': line[start - offset:end - offset], 'start': start, 'end': end,
+                       'tokens': count_tokens(text),
+                       'unit': number, 'unit_start': first, 'verse': unit['verse'], 'page': unit['page']}
+                first = False
+
+
+def make_chunk(segments):
+    parts = [segments[0]['text']]
+    for previous, segment in zip(segments, segments[1:]):
+        parts.append(('\n' if segment['unit'] != previous['unit'] else ' ') + segment['text'])
+    verses = [s['verse'] for s in segments if s['verse'] is not None]
+    verse = None
+    if verses:
+        verse = verses[0] if verses[0] == verses[-1] else f"{verses[0]}-{verses[-1]}"
+    return {
+        'text': ''.join(parts),
+        'verse': verse,
+        'page': segments[0]['page'],
+        'start': segments[0]['start'],
+        'end': segments[-1]['end'],
+    }
+
+
+def word_tail(segment, budget, count_tokens):
+    # The last words of a segment worth at most budget tokens, leaving at
+    # least one word out; None if not even one word fits
+    words = list(WORD_RE.finditer(segment['raw']))
+    max_chars = budget * len(segment['text']) // segment['tokens']
+    first = len(words)
+    size = -1
+    while first > 1 and size + 1 + len(words[first - 1].group()) <= max_chars:
+        first -= 1
+        size += 1 + len(words[first].group())
+    if first == len(words):
+        return None
+    text = ' '.join(w.group() for w in words[first:])
+    offset = words[first].start()
+    return dict(segment, text=text, raw=segment['raw'][offset:], start=segment['start'] + offset,
+                tokens=count_tokens(text), unit_start=False)
+
+
+def overlap_tail(segments, overlap_tokens, count_tokens):
+    # The end of a chunk worth at most overlap_tokens, never the whole
+    # chunk: whole trailing segments, then the last words of the segment
+    # that doesn't fit
+    tail = []
+    tokens = 0
+    for n in range(len(segments) - 1, -1, -1):
+        segment = segments[n]
+        if n > 0 and tokens + segment['tokens'] <= overlap_tokens:
+            tail.insert(0, segment)
+            tokens += segment['tokens']
+            continue
+        if tokens < overlap_tokens:
+            partial = word_tail(segment, overlap_tokens - tokens, count_tokens)
+            if partial is not None:
+                tail.insert(0, partial)
+        break
+    return tail
+
+
+def iter_chunks(lines, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP, count_tokens=estimate_tokens):
+    """
+    Yields {'text', 'verse', 'page', 'start', 'end'} chunks of at most
+    max_tokens (as counted by count_tokens) from an iterable of lines.
+    verse is a label or 'first-last' range, page is None without page
+    markers, and start/end are character offsets into the input.
+    """
+    pending = []
+    carried = 0   # leading segments of pending repeated from the previous chunk
+    # Segments leave room for the overlap, so even a chunk made of one long
+    # sentence can start with the end of the previous one
+    segment_tokens = max(max_tokens - overlap_tokens, max_tokens // 2, 1)
+    for segment in iter_segments(lines, segment_tokens, count_tokens):
+        while pending and sum(s['tokens'] for s in pending) + segment['tokens'] > max_tokens:
+            if carried == len(pending):
+                # Only overlap left and the next segment doesn't fit with it
+                pending, carried = [], 0
+                break
+            # Cut before the last verse/paragraph that started in this chunk,
+            # unless that would leave less than half a chunk
+            cut = len(pending)
+            tokens = 0
+            for i, s in enumerate(pending):
+                if i > carried and s['unit_start'] and tokens >= max_tokens // 2:
+                    cut = i
+                tokens += s['tokens']
+            chunk = pending[:cut]
+            yield make_chunk(chunk)
+            overlap = overlap_tail(chunk, overlap_tokens, count_tokens)
+            pending = overlap + pending[cut:]
+            carried = len(overlap)
+            while carried and sum(s['tokens'] for s in pending) + segment['tokens'] > max_tokens:
+                pending.pop(0)
+                carried -= 1
+        pending.append(segment)
+    if len(pending) > carried:
+        yield make_chunk(pending)
+
+
+def chunk_file(path, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP, count_tokens=estimate_tokens):
+    # newline='' keeps \r\n as two characters, so offsets match the file
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        lines = iter(lambda: f.readline(MAX_LINE_CHARS), '')
+        yield from iter_chunks(lines, max_tokens, overlap_tokens, count_tokens)
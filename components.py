@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+
+
+class LazyComponent:
+    """
+    A heavy resource (model, index) that is built by loader() on first use
+    or by a background warm-up, whichever comes first. Concurrent callers
+    wait for the one load in progress. A failed load is remembered and
+    get() returns None, matching how a missing component was handled before.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.value = None
+        self.state = 'not_loaded'  # not_loaded -> loading -> loaded | failed
+        self.error = None
+        self.load_seconds = None
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.state == 'loaded'
+
+    def get(self):
+        if self.state in ('loaded', 'failed'):
+            return self.value
+        with self.lock:
+            if self.state in ('not_loaded', 'loading'):
+                self.state = 'loading'
+                started = time.monotonic()
+                try:
+                    self.value = self.loader()
+                    self.state = 'loaded'
+                    print(f"Loaded {self.name} in {time.monotonic() - started:.1f}s")
+                except Exception as e:
+                    self.error = str(e)
+                    self.state = 'failed'
+                    print(f"Failed to load {self.name}: {e}")
+                self.load_seconds = time.monotonic() - started
+        return self.value
+
+    async def get_async(self):
+        # Loading blocks, so it runs off the event loop
+        if self.state in ('loaded', 'failed'):
+            return self.value
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get)
+
+    def info(self):
+        return {
+            'state': self.state,
+            'load_seconds': self.load_seconds,
+            'error': self.error,
+        }
@@ -0,0 +1,147 @@
+import re
+import math
+from collections import Counter
+
+from lexical_index import TOKEN_RE, fold_term, tokenize
+from tokens import estimate_tokens
+
+# Sentence ends, including the danda / double danda of Sanskrit verse
+SENTENCE_END_RE = re.compile(r'(?<=[.!?;।॥])\s+')
+
+DUPLICATE_SIMILARITY = 0.9   # passages this similar to one already chosen are dropped
+MMR_LAMBDA = 0.7             # relevance vs. novelty when ordering passages
+MIN_PASSAGE_TOKENS = 40      # don't bother packing a passage into less than this
+
+
+def term_vector(text):
+    return Counter(tokenize(text))
+
+
+def cosine(a, b):
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[term] for term, count in a.items() if term in b)
+    return dot / math.sqrt(sum(v * v for v in a.values()) * sum(v * v for v in b.values()))
+
+
+def mmr_order(passages):
+    """
+    Orders passages by maximal marginal relevance and drops near-duplicates.
+    Relevance is the retriever's rank (so it works for dense, lexical and
+    hybrid scores alike); redundancy is term-vector cosine between
+    passages. Returns (ordered passages, number of duplicates dropped).
+    """
+    vectors = [term_vector(p['text']) for p in passages]
+    relevance = [1.0 - i / max(len(passages), 1) for i in range(len(passages))]
+    remaining = list(range(len(passages)))
+    chosen = []
+    dropped = 0
+    while remaining:
+        best, best_score = None, None
+        for i in list(remaining):
+            redundancy = max((cosine(vectors[i], vectors[j]) for j in chosen), default=0.0)
+            if redundancy >= DUPLICATE_SIMILARITY:
+                remaining.remove(i)
+                dropped += 1
+                continue
+            score = MMR_LAMBDA * relevance[i] - (1 - MMR_LAMBDA) * redundancy
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        chosen.append(best)
+        remaining.remove(best)
+    return [passages[i] for i in chosen], dropped
+
+
+def first_match_offset(text, query_terms):
+    for match in TOKEN_RE.finditer(text.lower()):
+        if fold_term(match.group()) in query_terms:
+            return match.start()
+    return 0
+
+
+def trim_passage(text, query_terms, max_tokens):
+    """
+    Cuts a passage down to about max_tokens around its best match for the
+    query: the sentence sharing most query terms, grown with neighbouring
+    sentences while they fit. Returns (text, trimmed).
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    sentences = [s for s in SENTENCE_END_RE.split(text) if s.strip()]
+    overlap = [len(query_terms & set(tokenize(s))) for s in sentences]
+    center = max(range(len(sentences)), key=lambda i: (overlap[i], -i))
+    start = end = center
+    used = estimate_tokens(sentences[center])
+    grew = True
+    while grew:
+        grew = False
+        for neighbour in (end + 1, start - 1):
+            if 0 <= neighbour < len(sentences) and not start <= neighbour <= end:
+                cost = estimate_tokens(sentences[neighbour]) + 1
+                if used + cost <= max_tokens:
+                    used += cost
+                    start, end = min(start, neighbour), max(end, neighbour)
+                    grew = True
+    span = ' '.join(sentences[start:end + 1])
+    if estimate_tokens(span) > max_tokens:
+        # One very long sentence: take a character window around the first match
+        max_chars = max_tokens * 4
+        offset = first_match_offset(span, query_terms)
+        lo = max(0, min(offset - max_chars // 3, len(span) - max_chars))
+        window = span[lo:lo + max_chars]
+        if lo > 0:
+            window = window.split(' ', 1)[-1]
+        if lo + max_chars < len(span):
+            window = window.rsplit(' ', 1)[0]
+        return ('… ' if lo > 0 else '') + window + (' …' if lo + max_chars < len(span) else ''), True
+    return ('… ' if start > 0 else '') + span + (' …' if end < len(sentences) - 1 else ''), True
+
+
+def pack_context(query, passages, web_results, budget=1500, max_passage_tokens=300, max_web_tokens=300):
+    """
+    Assembles the prompt context within `budget` (estimated) tokens. Web
+    snippets get up to max_web_tokens; scripture passages get the rest,
+    de-duplicated, MMR-ordered and trimmed to the span around the query.
+    Returns (scripture_context, web_context, report).
+    """
+    query_terms = set(tokenize(query))
+
+    web_blocks = []
+    web_tokens = 0
+    for r in web_results:
+        block = f"Web: {r['title']} - {r['snippet']}"
+        cost = estimate_tokens(block)
+        if web_tokens + cost > min(max_web_tokens, budget):
+            break
+        web_blocks.append(block)
+        web_tokens += cost
+
+    ordered, duplicates = mmr_order(passages)
+    scripture_blocks = []
+    scripture_tokens = 0
+    trimmed = 0
+    for p in ordered:
+        header = f"From {p['source']}, verse {p['verse']}:\n" if p.get('verse') else f"From {p['source']}:\n"
+        room = min(max_passage_tokens, budget - web_tokens - scripture_tokens - estimate_tokens(header))
+        if room < MIN_PASSAGE_TOKENS:
+            break
+        text, was_trimmed = trim_passage(p['text'], query_terms, room)
+        block = header + text
+        scripture_blocks.append(block)
+        scripture_tokens += estimate_tokens(block)
+        trimmed += was_trimmed
+
+    report = {
+        'budget': budget,
+        'tokens': scripture_tokens + web_tokens,
+        'scripture_tokens': scripture_tokens,
+        'web_tokens': web_tokens,
+        'candidates': len(passages),
+        'duplicates_dropped': duplicates,
+        'passages': len(scripture_blocks),
+        'trimmed': trimmed,
+        'web_results': len(web_blocks),
+    }
+    return "\n\n".join(scripture_blocks), "\n\n".join(web_blocks), report
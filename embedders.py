@@ -0,0 +1,155 @@
+import os
+import json
+
+import numpy as np
+
+# Embedding backends. All of them produce vectors in the same space as the
+# reference PyTorch model (up to quantization error), so an index built with
+# one can be queried with another; ScriptureRetriever verifies this on load.
+#   torch      SentenceTransformer on PyTorch (the original behaviour)
+#   int8       the same model with its Linear layers dynamically quantized to int8
+#   onnx       the transformer exported to ONNX and run by ONNX Runtime
+#   onnx_int8  the ONNX export with int8 dynamically quantized weights
+EMBEDDING_BACKENDS = ('torch', 'int8', 'onnx', 'onnx_int8')
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+
+def set_torch_threads(threads):
+    if not threads:
+        return
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def load_sentence_transformer(model_name, threads=None, quantize=False):
+    set_torch_threads(threads)
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name, device='cpu')
+    if quantize:
+        import torch
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def onnx_model_dir(model_name, models_dir=MODELS_DIR):
+    return os.path.join(models_dir, model_name.replace('/', '__') + '-onnx')
+
+
+def export_onnx(model_name, model_dir):
+    # Exports the transformer body; pooling is redone in numpy by OnnxEmbedder
+    import torch
+    model = load_sentence_transformer(model_name)
+    transformer = model[0]
+    pooling = model[1].get_pooling_mode_str() if len(model) > 1 else 'mean'
+    if pooling not in ('mean', 'cls'):
+        raise ValueError(f"{model_name} uses {pooling} pooling, which the ONNX backend does not support")
+
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer = transformer.tokenizer
+    sample = tokenizer(['export'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer.auto_model.eval(), tuple(sample[name] for name in input_names),
+            os.path.join(model_dir, 'model.onnx'), input_names=input_names,
+            output_names=['last_hidden_state'], dynamic_axes=dynamic_axes, opset_version=14,
+        )
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, 'embedder.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'model': model_name,
+            'dimension': model.get_sentence_embedding_dimension(),
+            'max_length': model.max_seq_length,
+            'pooling': pooling,
+        }, f, indent=2)
+    print(f"Exported {model_name} to {model_dir}")
+
+
+def quantize_onnx(model_dir):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(os.path.join(model_dir, 'model.onnx'), os.path.join(model_dir, 'model_int8.onnx'),
+                     weight_type=QuantType.QInt8)
+
+
+class OnnxEmbedder:
+    """
+    SentenceTransformer-compatible encode() over an ONNX Runtime session:
+    tokenize, run the exported transformer, pool in numpy.
+    """
+
+    def __init__(self, model_dir, model_file='model.onnx', threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, 'embedder.json'), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def get_sentence_embedding_dimension(self):
+        return self.config['dimension']
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size)[0]
+        sentences = list(sentences)
+        pooled = []
+        for start in range(0, len(sentences), batch_size):
+            batch = self.tokenizer(sentences[start:start + batch_size], padding=True, truncation=True,
+                                   max_length=self.config['max_length'], return_tensors='np')
+            feeds = {name: value.astype('int64') for name, value in batch.items() if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            if self.config['pooling'] == 'cls':
+                pooled.append(hidden[:, 0])
+            else:
+                mask = batch['attention_mask'][:, :, None].astype('float32')
+                pooled.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+        if not pooled:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype='float32')
+        return np.vstack(pooled).astype('float32')
+
+
+def load_embedder(model_name, backend='torch', threads=None, models_dir=MODELS_DIR):
+    """
+    Returns an object with SentenceTransformer's encode() and
+    get_sentence_embedding_dimension(). ONNX models are exported (and
+    quantized) into models_dir the first time they are needed.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {', '.join(EMBEDDING_BACKENDS)}")
+    if backend in ('torch', 'int8'):
+        return load_sentence_transformer(model_name, threads, quantize=backend == 'int8')
+
+    model_dir = onnx_model_dir(model_name, models_dir)
+    if not os.path.exists(os.path.join(model_dir, 'model.onnx')):
+        export_onnx(model_name, model_dir)
+    model_file = 'model.onnx'
+    if backend == 'onnx_int8':
+        model_file = 'model_int8.onnx'
+        if not os.path.exists(os.path.join(model_dir, model_file)):
+            quantize_onnx(model_dir)
+    return OnnxEmbedder(model_dir, model_file, threads)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX ahead of time")
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    args = parser.parse_args()
+
+    model_dir = onnx_model_dir(args.model, args.models_dir)
+    export_onnx(args.model, model_dir)
+    quantize_onnx(model_dir)
@@ -0,0 +1,219 @@
+import math
+import queue
+import asyncio
+import threading
+import time
+
+DONE = object()
+
+
+class FallbackOverloaded(Exception):
+    """The request queue is full; retry_after is a hint in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Fallback generator is overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class FallbackRequest:
+    def __init__(self, prompt, loop):
+        self.prompt = prompt
+        self.loop = loop
+        self.chunks = asyncio.Queue()
+        self.cancelled = False
+
+    def emit(self, item):
+        # Called from the worker thread: text, DONE or an exception
+        self.loop.call_soon_threadsafe(self.chunks.put_nowait, item)
+
+
+def emit_safely(request, item):
+    # A request whose event loop is gone (closed, or the client left) is
+    # dropped; the rest of the batch and the worker carry on
+    try:
+        request.emit(item)
+        return True
+    except Exception as e:
+        request.cancelled = True
+        print(f"Dropping fallback request: {e}")
+        return False
+
+
+class BatchStreamer:
+    """
+    Streamer for model.generate over a batch: receives one token per row
+    per step and forwards each row's newly decoded text to its request.
+    """
+
+    def __init__(self, tokenizer, requests, eos_token_id):
+        self.tokenizer = tokenizer
+        self.requests = requests
+        self.eos_token_id = eos_token_id
+        self.tokens = [[] for _ in requests]
+        self.sent = [''] * len(requests)
+        self.finished = [False] * len(requests)
+        self.prompt_seen = False
+
+    def put(self, value):
+        if not self.prompt_seen:
+            # generate() first passes in the (padded) prompt ids
+            self.prompt_seen = True
+            return
+        for row, token in enumerate(value.reshape(-1).tolist()):
+            if self.finished[row]:
+                continue
+            if token == self.eos_token_id:
+                self.finished[row] = True
+                continue
+            self.tokens[row].append(token)
+            text = self.tokenizer.decode(self.tokens[row], skip_special_tokens=True)
+            if text.endswith('�'):
+                # Incomplete multi-byte character; wait for the next token
+                continue
+            if len(text) > len(self.sent[row]):
+                if not emit_safely(self.requests[row], text[len(self.sent[row]):]):
+                    self.finished[row] = True
+                self.sent[row] = text
+
+    def end(self):
+        pass
+
+
+class FallbackGenerator:
+    """
+    Runs the fallback model on its own thread so generation never blocks
+    the API. Requests wait in a bounded queue (a full queue is refused
+    with a retry hint rather than piling up) and are generated in batches
+    of up to max_batch_size left-padded prompts. Prompts are cut from the
+    left to fit the model's context, keeping the question at the end.
+    """
+
+    def __init__(self, model, tokenizer, max_queue=32, max_batch_size=8, max_wait_ms=50.0,
+                 max_new_tokens=80, temperature=0.7):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+
+        # Decoder-only batching: pad on the left so every row ends at the prompt
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = 'left'
+        tokenizer.truncation_side = 'left'
+        config = model.config
+        context = getattr(config, 'max_position_embeddings', None) or getattr(config, 'n_positions', 1024)
+        self.max_prompt_tokens = max(1, context - max_new_tokens)
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_seconds = None  # moving average, for Retry-After
+        self.batches = 0
+        self.generated = 0
+        self.shed = 0
+        self.worker = threading.Thread(target=self._run, name="fallback-generator", daemon=True)
+        self.worker.start()
+
+    def retry_after(self):
+        per_batch = self.batch_seconds or 5.0
+        waiting_batches = self.queue.qsize() / self.max_batch_size + 1
+        return max(1, math.ceil(waiting_batches * per_batch))
+
+    async def stream(self, prompt):
+        request = FallbackRequest(prompt, asyncio.get_running_loop())
+        try:
+            self.queue.put_nowait(request)
+        except queue.Full:
+            self.shed += 1
+            raise FallbackOverloaded(self.retry_after())
+        try:
+            while True:
+                item = await request.chunks.get()
+                if item is DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            request.cancelled = True
+
+    async def generate(self, prompt):
+        return "".join([text async for text in self.stream(prompt)]).strip()
+
+    def close(self):
+        self.queue.put(None)
+        self.worker.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self.queue.get_nowait() if remaining <= 0 else self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            batch.append(request)
+        # Clients that disconnected while queued don't take a batch slot
+        return [request for request in batch if not request.cancelled]
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            try:
+                batch = self._collect(first)
+                self._run_batch(batch)
+            except Exception as e:
+                # This is the only worker; it must outlive any one batch
+                print(f"Fallback generator error: {e}")
+                for request in batch:
+                    emit_safely(request, e)
+
+    def _run_batch(self, batch):
+        if not batch:
+            return
+        started = time.monotonic()
+        try:
+            self.generate_batch(batch)
+        except Exception as e:
+            outcome = e
+        else:
+            outcome = DONE
+        for request in batch:
+            emit_safely(request, outcome)
+        elapsed = time.monotonic() - started
+        self.batch_seconds = elapsed if self.batch_seconds is None else 0.8 * self.batch_seconds + 0.2 * elapsed
+        self.batches += 1
+        self.generated += len(batch)
+
+    def generate_batch(self, batch):
+        import torch
+
+        inputs = self.tokenizer(
+            [request.prompt for request in batch], return_tensors='pt', padding=True,
+            truncation=True, max_length=self.max_prompt_tokens,
+        )
+        streamer = BatchStreamer(self.tokenizer, batch, self.tokenizer.eos_token_id)
+        with torch.no_grad():
+            self.model.generate(
+                **inputs, streamer=streamer, max_new_tokens=self.max_new_tokens, do_sample=True,
+                temperature=self.temperature, pad_token_id=self.tokenizer.pad_token_id,
+            )
+
+    def info(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_limit': self.queue.maxsize,
+            'batches': self.batches,
+            'generated': self.generated,
+            'mean_batch_size': self.generated / self.batches if self.batches else 0.0,
+            'batch_seconds': self.batch_seconds,
+            'shed': self.shed,
+            'max_prompt_tokens': self.max_prompt_tokens,
+        }
@@ -0,0 +1,146 @@
+import os
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from chunker import CHUNK_OVERLAP, CHUNK_TOKENS, chunk_file
+
+# Per-process embedder, loaded once by the pool initializer
+_worker_embedder = None
+
+
+def init_worker(model_name, threads, backend):
+    global _worker_embedder
+    from embedders import load_embedder
+    # One process per core scales better than N processes fighting over N*N threads
+    _worker_embedder = load_embedder(model_name, backend, threads)
+
+
+def embed_texts(texts, embedder, batch_size):
+    embeddings = embedder.encode(texts, batch_size=batch_size)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype('float32')
+
+
+def worker_embed_texts(texts, batch_size):
+    return embed_texts(texts, _worker_embedder, batch_size)
+
+
+class BuildProgress:
+    def __init__(self, report_every=5.0):
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.report_every = report_every
+        self.chunks = 0
+        self.bytes = 0
+        self.pieces = 0
+
+    def update(self, nbytes, nchunks):
+        self.pieces += 1
+        self.bytes += nbytes
+        self.chunks += nchunks
+        now = time.monotonic()
+        if now - self.last_report >= self.report_every:
+            self.last_report = now
+            print(self.describe())
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'chunks': self.chunks,
+            'bytes': self.bytes,
+            'pieces': self.pieces,
+            'seconds': elapsed,
+            'chunks_per_second': self.chunks / elapsed,
+            'mb_per_second': self.bytes / elapsed / (1024 * 1024),
+        }
+
+    def describe(self):
+        s = self.stats()
+        return (f"Embedded {s['chunks']} chunks from {s['bytes'] / (1024 * 1024):.1f} MB "
+                f"in {s['seconds']:.1f}s ({s['chunks_per_second']:.1f} chunks/s, {s['mb_per_second']:.2f} MB/s)")
+
+
+class IndexBuilder:
+    """
+    Streams corpus files through the chunker (chunker.py) and fans embedding
+    out over a process pool, chunks_per_task chunks at a time. Results come
+    back in submission order, with at most max_pending tasks in flight, so
+    memory stays flat regardless of corpus size and chunk ids can be
+    assigned contiguously per file.
+    """
+
+    def __init__(self, model_name, embedder=None, workers=None, chunks_per_task=256,
+                 batch_size=64, max_pending=None, threads_per_worker=1, backend='torch',
+                 chunk_tokens=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP):
+        self.model_name = model_name
+        self.backend = backend
+        self.embedder = embedder
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.chunks_per_task = chunks_per_task
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.max_pending = max_pending or 2 * max(self.workers, 1)
+        self.threads_per_worker = threads_per_worker
+        self.progress = None
+
+    def iter_tasks(self, files):
+        # Chunking is cheap next to embedding, so it runs here and only chunk
+        # text is shipped to the workers. Always yields at least one task per
+        # file, even for an empty file.
+        for filename, file_path, source_name in files:
+            chunks = []
+            yielded = False
+            for chunk in chunk_file(file_path, self.chunk_tokens, self.chunk_overlap):
+                chunks.append(chunk)
+                if len(chunks) >= self.chunks_per_task:
+                    yield filename, source_name, chunks
+                    chunks = []
+                    yielded = True
+            if chunks or not yielded:
+                yield filename, source_name, chunks
+
+    def embed_files(self, files):
+        """
+        files: iterable of (filename, file_path, source_name).
+        Yields (filename, source_name, chunks, embeddings) per task, in file
+        order; every file yields at least once. chunks are chunker dicts
+        (text, verse, page, start, end); embeddings is None when there are none.
+        """
+        self.progress = BuildProgress()
+        if self.workers <= 1:
+            if self.embedder is None:
+                from embedders import load_embedder
+                self.embedder = load_embedder(self.model_name, self.backend)
+            for filename, source_name, chunks in self.iter_tasks(files):
+                texts = [chunk['text'] for chunk in chunks]
+                embeddings = embed_texts(texts, self.embedder, self.batch_size) if texts else None
+                self.progress.update(sum(len(text.encode('utf-8')) for text in texts), len(chunks))
+                yield filename, source_name, chunks, embeddings
+        else:
+            # spawn, not fork: the parent already holds torch thread pools
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context,
+                initializer=init_worker, initargs=(self.model_name, self.threads_per_worker, self.backend)
+            ) as pool:
+                pending = deque()
+                for filename, source_name, chunks in self.iter_tasks(files):
+                    texts = [chunk['text'] for chunk in chunks]
+                    future = pool.submit(worker_embed_texts, texts, self.batch_size) if texts else None
+                    pending.append((filename, source_name, chunks, future))
+                    if len(pending) >= self.max_pending:
+                        yield self.finish(pending.popleft())
+                while pending:
+                    yield self.finish(pending.popleft())
+        print(self.progress.describe())
+
+    def finish(self, item):
+        filename, source_name, chunks, future = item
+        embeddings = future.result() if future is not None else None
+        self.progress.update(sum(len(chunk['text'].encode('utf-8')) for chunk in chunks), len(chunks))
+        return filename, source_name, chunks, embeddings
@@ -0,0 +1,150 @@
+import json
+
+import faiss
+import numpy as np
+
+# Supported index types:
+#   flat        exact inner-product scan (the original behaviour)
+#   ivf_flat    inverted lists over full vectors; nprobe trades recall for speed
+#   ivf_pq      inverted lists over product-quantized codes; far smaller in RAM
+#   opq_ivf_pq  ivf_pq with a learned rotation in front, better recall per byte
+#   hnsw        graph index; fast and accurate, but vectors cannot be removed
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'opq_ivf_pq', 'hnsw')
+
+DEFAULT_INDEX_CONFIG = {
+    'type': 'flat',
+    'nlist': 1024,          # IVF cells (capped by the amount of training data)
+    'pq_m': 48,             # PQ sub-quantizers; must divide the embedding dimension
+    'pq_nbits': 8,
+    'hnsw_m': 32,
+    'ef_construction': 200,
+    'nprobe': 16,           # search-time, IVF types
+    'ef_search': 64,        # search-time, HNSW
+    'train_size': 50000,    # vectors buffered for training before the first add
+}
+
+# Smallest number of training vectors per IVF cell faiss accepts without warning
+MIN_POINTS_PER_CENTROID = 39
+
+
+def make_index_config(config=None, **overrides):
+    merged = dict(DEFAULT_INDEX_CONFIG)
+    merged.update(config or {})
+    merged.update({k: v for k, v in overrides.items() if v is not None})
+    if merged['type'] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{merged['type']}', expected one of {', '.join(INDEX_TYPES)}")
+    return merged
+
+
+def parse_index_spec(spec):
+    # "ivf_pq:nlist=256,pq_m=32" -> {'type': 'ivf_pq', 'nlist': 256, 'pq_m': 32}
+    index_type, _, params = spec.partition(':')
+    config = {'type': index_type}
+    for item in filter(None, params.split(',')):
+        key, _, value = item.partition('=')
+        config[key.strip()] = int(value) if value.strip().isdigit() else value.strip()
+    return make_index_config(config)
+
+
+def needs_training(config):
+    return config['type'] in ('ivf_flat', 'ivf_pq', 'opq_ivf_pq')
+
+
+def supports_removal(config):
+    return config['type'] != 'hnsw'
+
+
+def factory_string(config, nlist):
+    index_type = config['type']
+    if index_type == 'flat':
+        return 'IDMap,Flat'
+    if index_type == 'hnsw':
+        return f"IDMap,HNSW{config['hnsw_m']}"
+    if index_type == 'ivf_flat':
+        return f"IVF{nlist},Flat"
+    pq = f"PQ{config['pq_m']}x{config['pq_nbits']}"
+    if index_type == 'ivf_pq':
+        return f"IVF{nlist},{pq}"
+    return f"OPQ{config['pq_m']},IVF{nlist},{pq}"
+
+
+def create_index(config, dimension, n_train=None):
+    # IVF types size nlist to the training set so small corpora still train
+    nlist = config['nlist']
+    if n_train is not None:
+        nlist = max(1, min(nlist, n_train // MIN_POINTS_PER_CENTROID))
+    index = faiss.index_factory(dimension, factory_string(config, nlist), faiss.METRIC_INNER_PRODUCT)
+    if config['type'] == 'hnsw':
+        faiss.downcast_index(index.index).hnsw.efConstruction = config['ef_construction']
+    return index
+
+
+def apply_search_params(index, config):
+    params = faiss.ParameterSpace()
+    if needs_training(config):
+        params.set_index_parameter(index, 'nprobe', int(config['nprobe']))
+    elif config['type'] == 'hnsw':
+        params.set_index_parameter(index, 'efSearch', int(config['ef_search']))
+
+
+def index_memory_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def read_index_meta(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class IndexFeeder:
+    """
+    Adds (vectors, ids) batches to an index, training it first when the
+    index type needs it. Until the index is trained, batches are buffered
+    (up to config['train_size'] vectors) and used as the training set.
+    """
+
+    def __init__(self, config, dimension, index=None):
+        self.config = config
+        self.dimension = dimension
+        self.index = index
+        self.buffer_vectors = []
+        self.buffer_ids = []
+        self.buffered = 0
+        if self.index is None and not needs_training(config):
+            self.index = create_index(config, dimension)
+
+    def ready(self):
+        return self.index is not None and self.index.is_trained
+
+    def add(self, vectors, ids):
+        if self.ready():
+            self.index.add_with_ids(vectors, ids)
+            return
+        self.buffer_vectors.append(vectors)
+        self.buffer_ids.append(ids)
+        self.buffered += len(ids)
+        if self.buffered >= self.config['train_size']:
+            self.train_and_flush()
+
+    def train_and_flush(self):
+        vectors = np.vstack(self.buffer_vectors)
+        ids = np.concatenate(self.buffer_ids)
+        config = self.config
+        if config['type'] in ('ivf_pq', 'opq_ivf_pq') and len(vectors) < (1 << config['pq_nbits']):
+            print(f"Only {len(vectors)} vectors, too few to train {config['type']}; using a flat index.")
+            config = make_index_config(config, type='flat')
+            self.config = config
+        self.index = create_index(config, self.dimension, n_train=len(vectors))
+        if not self.index.is_trained:
+            print(f"Training {config['type']} index on {len(vectors)} vectors...")
+            self.index.train(vectors)
+        self.index.add_with_ids(vectors, ids)
+        self.buffer_vectors, self.buffer_ids, self.buffered = [], [], 0
+
+    def finish(self):
+        if self.buffered:
+            self.train_and_flush()
+        if self.index is None:
+            self.index = create_index(self.config, self.dimension)
+        apply_search_params(self.index, self.config)
+        return self.index
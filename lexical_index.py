@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import math
+import unicodedata
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from passage_store import load_array
+
+# On-disk layout for a lexical index with prefix P (all .npy memory-mapped):
+#   P.vocab.json     term list; term i owns postings[offsets[i]:offsets[i + 1]]
+#   P.offsets.npy    int64, len(vocab) + 1
+#   P.postings.npy   int64 chunk ids, ascending within each term
+#   P.tfs.npy        uint16 term frequency per posting
+#   P.doc_ids.npy    int64 chunk ids, ascending
+#   P.doc_lens.npy   int32 token count per chunk
+#   P.stats.json     document count, average length and BM25 parameters
+SUFFIXES = ('.vocab.json', '.offsets.npy', '.postings.npy', '.tfs.npy', '.doc_ids.npy', '.doc_lens.npy', '.stats.json')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = frozenset("""
+a an and are as at be by did do does for from how in is it its of on or say says
+tell that the their them they this to was were what when where which who whom why
+with about according explain me describe
+""".split())
+
+TOKEN_RE = re.compile(r'[\w\u0900-\u097F]+')
+DEVANAGARI_RE = re.compile(r'[\u0900-\u097F]')
+
+
+def fold_term(term):
+    # Fold romanized Sanskrit spellings together: strip diacritics from Latin
+    # script (ś -> s, ṇ -> n), then collapse common transliteration variants
+    # so that "Hiraṇyakaśipu", "Hiranyakashipu" and "hiranyakasipu" match.
+    # Devanagari keeps its vowel signs.
+    if not term.isascii() and not DEVANAGARI_RE.search(term):
+        term = ''.join(c for c in unicodedata.normalize('NFKD', term) if not unicodedata.combining(c))
+    return term.replace('sh', 's').replace('aa', 'a').replace('ee', 'i').replace('ii', 'i').replace('uu', 'u')
+
+
+def tokenize(text):
+    return [fold_term(t) for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def lexical_index_exists(prefix):
+    return all(os.path.exists(prefix + suffix) for suffix in SUFFIXES)
+
+
+def in_ranges(ids, ranges):
+    mask = np.zeros(len(ids), dtype=bool)
+    for start, end in ranges:
+        mask |= (ids >= start) & (ids < end)
+    return mask
+
+
+class LexicalIndex:
+    def __init__(self, vocab, offsets, postings, tfs, doc_ids, doc_lens, stats):
+        self.terms = vocab
+        self.vocab = {term: i for i, term in enumerate(vocab)}
+        self.offsets = offsets
+        self.postings = postings
+        self.tfs = tfs
+        self.doc_ids = doc_ids
+        self.doc_lens = doc_lens
+        self.stats = stats
+
+    @classmethod
+    def empty(cls):
+        return cls([], np.zeros(1, dtype='int64'), np.empty(0, dtype='int64'), np.empty(0, dtype='uint16'),
+                   np.empty(0, dtype='int64'), np.empty(0, dtype='int32'),
+                   {'documents': 0, 'avg_length': 0.0, 'k1': BM25_K1, 'b': BM25_B})
+
+    @classmethod
+    def open(cls, prefix):
+        def load(suffix):
+            return load_array(prefix + suffix)
+        with open(prefix + '.vocab.json', 'r', encoding='utf-8') as f:
+            vocab = json.load(f)
+        with open(prefix + '.stats.json', 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        return cls(vocab, load('.offsets.npy'), load('.postings.npy'), load('.tfs.npy'),
+                   load('.doc_ids.npy'), load('.doc_lens.npy'), stats)
+
+    def close(self):
+        # Drop references to the memory maps so the files can be replaced
+        empty = LexicalIndex.empty()
+        self.__dict__.update(empty.__dict__)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def search(self, query, top_k=10):
+        """
+        BM25 over the query's terms. Returns (chunk_ids, scores, coverage)
+        sorted by score, where coverage is the fraction of distinct query
+        terms that occur in each chunk.
+        """
+        terms = [t for t in dict.fromkeys(tokenize(query)) if t in self.vocab]
+        n_query_terms = len(set(tokenize(query)))
+        if not terms or not len(self.doc_ids):
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float32'), np.empty(0, dtype='float32')
+
+        n_docs = self.stats['documents']
+        avg_length = self.stats['avg_length'] or 1.0
+        k1, b = self.stats['k1'], self.stats['b']
+        all_ids, all_scores = [], []
+        for term in terms:
+            i = self.vocab[term]
+            ids = np.asarray(self.postings[self.offsets[i]:self.offsets[i + 1]])
+            tfs = np.asarray(self.tfs[self.offsets[i]:self.offsets[i + 1]], dtype='float32')
+            lengths = np.asarray(self.doc_lens[np.searchsorted(self.doc_ids, ids)], dtype='float32')
+            idf = math.log(1.0 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths / avg_length)))
+
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype('float32')
+        matched = np.bincount(inverse).astype('float32')
+        if len(ids) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            best = np.arange(len(ids))
+        best = best[np.argsort(-scores[best])]
+        return ids[best], scores[best], matched[best] / max(n_query_terms, 1)
+
+
+class LexicalIndexWriter:
+    """
+    Builds a lexical index from an optional base index (minus the chunk-id
+    ranges in removed) plus newly added chunks. New chunk ids must be larger
+    than every id in the base, which keeps postings sorted without a merge.
+    """
+
+    def __init__(self, base=None, removed=()):
+        self.terms = []
+        self.vocab = {}
+        self.parts = []  # (term_idx, doc_ids, tfs) numpy parts from the base index
+        self.base_docs = None
+        if base is not None and len(base):
+            self.terms = list(base.terms)
+            self.vocab = dict(base.vocab)
+            offsets = np.asarray(base.offsets)
+            postings = np.asarray(base.postings)
+            keep = ~in_ranges(postings, removed)
+            term_idx = np.repeat(np.arange(len(base.terms), dtype='int32'), np.diff(offsets))
+            self.parts.append((term_idx[keep], postings[keep], np.asarray(base.tfs)[keep]))
+            doc_ids = np.asarray(base.doc_ids)
+            keep_docs = ~in_ranges(doc_ids, removed)
+            self.base_docs = (doc_ids[keep_docs], np.asarray(base.doc_lens)[keep_docs])
+        self.term_col = array('i')
+        self.doc_col = array('q')
+        self.tf_col = array('H')
+        self.doc_ids = array('q')
+        self.doc_lens = array('i')
+
+    def add(self, chunk_id, text):
+        counts = Counter(tokenize(text))
+        self.doc_ids.append(chunk_id)
+        self.doc_lens.append(sum(counts.values()))
+        for term, tf in counts.items():
+            i = self.vocab.get(term)
+            if i is None:
+                i = self.vocab[term] = len(self.terms)
+                self.terms.append(term)
+            self.term_col.append(i)
+            self.doc_col.append(chunk_id)
+            self.tf_col.append(min(tf, 65535))
+
+    def commit(self, prefix):
+        parts = self.parts + [(
+            np.frombuffer(self.term_col, dtype='int32'),
+            np.frombuffer(self.doc_col, dtype='int64'),
+            np.frombuffer(self.tf_col, dtype='uint16'),
+        )]
+        term_idx = np.concatenate([p[0] for p in parts])
+        postings = np.concatenate([p[1] for p in parts])
+        tfs = np.concatenate([p[2] for p in parts])
+        order = np.lexsort((postings, term_idx))
+        offsets = np.zeros(len(self.terms) + 1, dtype='int64')
+        offsets[1:] = np.cumsum(np.bincount(term_idx, minlength=len(self.terms)))
+
+        new_docs = (np.frombuffer(self.doc_ids, dtype='int64'), np.frombuffer(self.doc_lens, dtype='int32'))
+        if self.base_docs is not None:
+            doc_ids = np.concatenate([self.base_docs[0], new_docs[0]])
+            doc_lens = np.concatenate([self.base_docs[1], new_docs[1]])
+        else:
+            doc_ids, doc_lens = new_docs
+        stats = {
+            'documents': int(len(doc_ids)),
+            'avg_length': float(doc_lens.mean()) if len(doc_lens) else 0.0,
+            'k1': BM25_K1,
+            'b': BM25_B,
+        }
+
+        tmp = prefix + '.tmp'
+        with open(tmp + '.vocab.json', 'w', encoding='utf-8') as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+        with open(tmp + '.stats.json', 'w', encoding='utf-8') as f:
+            json.dump(stats, f)
+        np.save(tmp + '.offsets.npy', offsets)
+        np.save(tmp + '.postings.npy', postings[order])
+        np.save(tmp + '.tfs.npy', tfs[order])
+        np.save(tmp + '.doc_ids.npy', doc_ids)
+        np.save(tmp + '.doc_lens.npy', doc_lens.astype('int32'))
+        for suffix in SUFFIXES:
+            os.replace(tmp + suffix, prefix + suffix)
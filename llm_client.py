@@ -0,0 +1,407 @@
+import re
+import time
+import random
+import asyncio
+
+from tokens import estimate_tokens
+
+try:
+    from google.api_core.exceptions import TooManyRequests
+except ImportError:
+    TooManyRequests = None
+
+DEFAULT_RATE_LIMIT_DELAY = 10.0
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling the model; callers should use the fallback generator."""
+
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+
+class RateLimitedError(LLMUnavailable):
+    pass
+
+
+def rate_limit_delay(error):
+    # Returns how long the server asked us to wait before retrying a
+    # rate-limited call, or None if the error is not a rate limit
+    error_msg = str(error)
+    rate_limited = TooManyRequests is not None and isinstance(error, TooManyRequests)
+    if rate_limited or "429" in error_msg or "quota exceeded" in error_msg.lower():
+        match = re.search(r'retry_delay {\s*seconds: (\d+(?:\.\d+)?)\s*}', error_msg)
+        return float(match.group(1)) if match else DEFAULT_RATE_LIMIT_DELAY
+    return None
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter: `rate` tokens per second, bursts of up to
+    `capacity`. acquire() reserves tokens and sleeps until they are earned,
+    so callers queue in arrival order instead of being rejected by the
+    server; if the wait would exceed max_wait it raises RateLimitedError
+    straight away. Used from the event loop thread only.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waits = 0
+        self.rejections = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self.refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    async def acquire(self, amount=1.0, max_wait=None):
+        amount = min(amount, self.capacity)
+        wait = self.wait_time(amount)
+        if max_wait is not None and wait > max_wait:
+            self.rejections += 1
+            raise RateLimitedError(f"Rate limiter queue is {wait:.1f}s deep")
+        self.tokens -= amount
+        if wait > 0:
+            self.waits += 1
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.release(amount)
+                raise
+
+    def release(self, amount=1.0):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def info(self):
+        self.refill()
+        return {'rate_per_second': self.rate, 'capacity': self.capacity, 'tokens': self.tokens,
+                'waits': self.waits, 'rejections': self.rejections}
+
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures. While open,
+    calls are refused for reset_timeout seconds; then one trial call is let
+    through (half_open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+        self.opens = 0
+
+    def rejecting(self):
+        # Open and still cooling down; unlike allow(), claims nothing
+        return self.state == 'open' and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        now = time.monotonic()
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = 'half_open'
+            self.trial_started = now
+            return True
+        # half_open: one trial at a time (a trial that never reported back
+        # within reset_timeout is written off)
+        if now - self.trial_started >= self.reset_timeout:
+            self.trial_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.opens += 1
+                print(f"Gemini circuit opened after {self.failures} failures; using the fallback for {self.reset_timeout}s")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+    def info(self):
+        return {'state': self.state, 'consecutive_failures': self.failures, 'opens': self.opens}
+
+
+class SharedStream:
+    """
+    Fans one streamed answer out to every request waiting on the same prompt.
+    Late subscribers replay the chunks they missed.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.producer = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, text):
+        async with self.changed:
+            self.chunks.append(text)
+            self.changed.notify_all()
+
+    async def finish(self, error=None):
+        async with self.changed:
+            self.finished = True
+            self.error = error
+            self.changed.notify_all()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: len(self.chunks) > position or self.finished)
+                    new_chunks = self.chunks[position:]
+                    finished, error = self.finished, self.error
+                for text in new_chunks:
+                    yield text
+                position += len(new_chunks)
+                if finished and position == len(self.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished and self.producer is not None:
+                # Everyone disconnected; stop paying for the answer
+                self.producer.cancel()
+
+
+class GeminiClient:
+    """
+    One shared model instance behind a request/token rate limiter, a
+    circuit breaker and single-flight coalescing: concurrent calls with the
+    same prompt share one upstream request. `model` is anything with
+    genai.GenerativeModel's generate_content_async(prompt, stream=...),
+    e.g. FakeGenerativeModel in tests.
+    """
+
+    def __init__(self, model, limiter=None, token_limiter=None, breaker=None, max_retries=3,
+                 max_retry_delay=2.0, max_queue_wait=5.0, timeout=30.0):
+        self.model = model
+        self.limiter = limiter
+        self.token_limiter = token_limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.max_queue_wait = max_queue_wait
+        self.timeout = timeout
+        self.inflight = {}
+        self.streams = {}
+        self.calls = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.coalesced = 0
+        self.short_circuited = 0
+
+    async def admit(self, prompt):
+        # Queue for quota first, then ask the breaker, so a half-open trial
+        # is only claimed by a call that will actually be made. A refused
+        # call gives its tokens back.
+        tokens = estimate_tokens(prompt)
+        if self.limiter is not None:
+            await self.limiter.acquire(1, self.max_queue_wait)
+        try:
+            if self.token_limiter is not None:
+                await self.token_limiter.acquire(tokens, self.max_queue_wait)
+        except BaseException:
+            if self.limiter is not None:
+                self.limiter.release(1)
+            raise
+        if not self.breaker.allow():
+            if self.limiter is not None:
+                self.limiter.release(1)
+            if self.token_limiter is not None:
+                self.token_limiter.release(min(tokens, self.token_limiter.capacity))
+            self.short_circuited += 1
+            raise CircuitOpenError("Gemini circuit is open")
+        self.calls += 1
+
+    def should_retry(self, error, attempt):
+        # Only short, server-requested backoffs are worth waiting for inside
+        # a request; anything longer goes to the fallback instead
+        delay = rate_limit_delay(error)
+        if delay is None or delay > self.max_retry_delay or attempt == self.max_retries - 1:
+            return None
+        return delay
+
+    def record_failure(self, error):
+        self.failures += 1
+        if rate_limit_delay(error) is not None:
+            self.rate_limited += 1
+        self.breaker.record_failure()
+
+    async def generate(self, prompt):
+        if self.breaker.rejecting():
+            self.short_circuited += 1
+            raise CircuitOpenError("Gemini circuit is open")
+        task = self.inflight.get(prompt)
+        if task is None:
+            task = asyncio.ensure_future(self.generate_once(prompt))
+            self.inflight[prompt] = task
+            task.add_done_callback(lambda t: self.finish_inflight(prompt, t))
+        else:
+            self.coalesced += 1
+        # Shielded: one caller timing out doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def finish_inflight(self, prompt, task):
+        self.inflight.pop(prompt, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here so an unawaited failure isn't logged as lost
+
+    async def generate_once(self, prompt):
+        for attempt in range(self.max_retries):
+            await self.admit(prompt)
+            try:
+                response = await asyncio.wait_for(self.model.generate_content_async(prompt), self.timeout)
+                text = response.text
+            except Exception as e:
+                self.record_failure(e)
+                delay = self.should_retry(e, attempt)
+                if delay is None:
+                    raise
+                print(f"Rate limit hit, retrying in {delay} seconds...")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return text
+
+    async def stream(self, prompt):
+        if self.breaker.rejecting():
+            self.short_circuited += 1
+            raise CircuitOpenError("Gemini circuit is open")
+        shared = self.streams.get(prompt)
+        if shared is None:
+            shared = self.streams[prompt] = SharedStream()
+            shared.producer = asyncio.ensure_future(self.stream_once(prompt, shared))
+            shared.producer.add_done_callback(lambda _: self.streams.pop(prompt, None))
+        else:
+            self.coalesced += 1
+        async for text in shared.subscribe():
+            yield text
+
+    async def stream_once(self, prompt, shared):
+        started = False
+        try:
+            for attempt in range(self.max_retries):
+                await self.admit(prompt)
+                try:
+                    response = await asyncio.wait_for(
+                        self.model.generate_content_async(prompt, stream=True), self.timeout
+                    )
+                    async for chunk in response:
+                        if chunk.text:
+                            started = True
+                            await shared.publish(chunk.text)
+                except Exception as e:
+                    self.record_failure(e)
+                    # Once tokens have reached the client the answer can't be restarted
+                    delay = None if started else self.should_retry(e, attempt)
+                    if delay is None:
+                        raise
+                    print(f"Rate limit hit, retrying in {delay} seconds...")
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                await shared.finish()
+                return
+        except Exception as e:
+            await shared.finish(e)
+        finally:
+            if not shared.finished:
+                # Cancelled: anyone who subscribed in the meantime must not hang
+                await shared.finish(LLMUnavailable("Gemini stream was cancelled"))
+
+    def info(self):
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'rate_limited': self.rate_limited,
+            'coalesced': self.coalesced,
+            'short_circuited': self.short_circuited,
+            'inflight': len(self.inflight) + len(self.streams),
+            'breaker': self.breaker.info(),
+            'requests_limiter': self.limiter.info() if self.limiter is not None else None,
+            'tokens_limiter': self.token_limiter.info() if self.token_limiter is not None else None,
+        }
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStream:
+    def __init__(self, chunks, delay):
+        self.chunks = chunks
+        self.delay = delay
+
+    async def __aiter__(self):
+        for text in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield FakeResponse(text)
+
+
+class FakeRateLimitError(Exception):
+    def __init__(self, retry_delay):
+        # Same shape as the API's quota errors, so rate_limit_delay() parses it
+        super().__init__(f"429 Quota exceeded (simulated). retry_delay {{ seconds: {retry_delay} }}")
+
+
+class FakeGenerativeModel:
+    """
+    Local stand-in for genai.GenerativeModel for tests and load runs: answers
+    after `latency` seconds (spread over `chunks` pieces when streaming),
+    fails with probability fail_rate and is rate limited (429) with
+    probability rate_limit_rate.
+    """
+
+    def __init__(self, latency=0.2, chunks=8, fail_rate=0.0, seed=None, rate_limit_rate=0.0, retry_delay=1):
+        self.latency = latency
+        self.chunks = chunks
+        self.fail_rate = fail_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_delay = retry_delay
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def answer(self, prompt):
+        question = prompt.strip().splitlines()[-1] if prompt.strip() else ''
+        return f"(simulated answer, {len(prompt)} prompt characters) {question}"
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        if self.rng.random() < self.rate_limit_rate:
+            raise FakeRateLimitError(self.retry_delay)
+        if self.rng.random() < self.fail_rate:
+            await asyncio.sleep(self.latency / 2)
+            raise RuntimeError("Simulated Gemini failure")
+        text = self.answer(prompt)
+        if not stream:
+            await asyncio.sleep(self.latency)
+            return FakeResponse(text)
+        size = max(1, -(-len(text) // self.chunks))
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        return FakeStream(pieces, self.latency / max(len(pieces), 1))
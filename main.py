@@ -1,351 +1,990 @@
-import uvicorn
-import os
-import asyncio
-import re
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import google.generativeai as genai
-from google.api_core.exceptions import TooManyRequests
-from scripture_retriever import ScriptureRetriever
-from dotenv import load_dotenv
-import requests
-from bs4 import BeautifulSoup
-from transformers import pipeline
-
-# Load environment variables
-load_dotenv()
-
-# Configure Gemini
-API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
-genai.configure(api_key=API_KEY)
-
-# Initialize Scripture Retriever
-try:
-    retriever = ScriptureRetriever()
-except Exception as e:
-    print(f"Failed to load ScriptureRetriever: {e}")
-    retriever = None
-
-# Initialize open-source LLM pipeline (using a small model for demonstration)
-try:
-    llm_pipeline = pipeline("text-generation", model="microsoft/DialoGPT-small", device=-1)  # Use CPU
-except Exception as e:
-    print(f"Failed to load open-source LLM: {e}")
-    llm_pipeline = None
-
-def search_web(query):
-    url = f"https://www.bing.com/search?q={query}"
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            results = []
-            for result in soup.find_all('li', class_='b_algo')[:5]:
-                title = result.find('h2').text if result.find('h2') else ''
-                link = result.find('a')['href'] if result.find('a') else ''
-                snippet = result.find('p').text if result.find('p') else ''
-                results.append({'title': title, 'link': link, 'snippet': snippet})
-            return results
-    except Exception as e:
-        print(f"Web search error: {e}")
-        return []
-
-
-
-# FastAPI app
-app = FastAPI(title="VedaAI - Sacred Texts Assistant", description="AI-powered queries on ancient Indian scriptures")
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.get("/")
-async def root():
-    return """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>VedaAI - Ancient Wisdom Meets Modern Intelligence</title>
-        <script src="https://cdn.tailwindcss.com"></script>
-        <style>
-            @import url('https://fonts.googleapis.com/css2?family=Playfair+Display:ital,wght@0,400..900;1,400..900&family=Space+Grotesk:wght@300..700&display=swap');
-            @keyframes shine {
-                0%, 100% { background-position: 200% 0; }
-                50% { background-position: -200% 0; }
-            }
-            .hero-heading { font-family: 'Space Grotesk', sans-serif; }
-            .sanskrit-text { font-family: 'Playfair Display', serif; font-style: italic; }
-            .feature-card:hover { transform: translateY(-8px) scale(1.02); box-shadow: 0 10px 40px rgba(168, 85, 247, 0.2); }
-            .input-glow:focus { box-shadow: 0 0 0 3px rgba(168, 85, 247, 0.5); outline: none; }
-            .typing-cursor::after { content: '|'; animation: blink-caret 1s step-end infinite; }
-            @keyframes blink-caret { from, to { color: transparent; } 50% { color: white; } }
-            body { font-family: 'Playfair Display', serif; background: #0d0a1b; color: #E2E8F0; overflow-x: hidden; position: relative; min-height: 100vh; }
-            .bg-animation { position: fixed; top: 0; left: 0; width: 100%; height: 100%; z-index: -1; background: radial-gradient(circle at center, #1a0f2e 0%, #0d0a1b 100%); overflow: hidden; }
-            .star { position: absolute; background-color: #8B5CF6; border-radius: 50%; animation: move-star 20s linear infinite; }
-            @keyframes move-star { 0% { transform: translate(0, 0); opacity: 0.5; } 50% { opacity: 1; } 100% { transform: translate(100vw, 100vh); opacity: 0; } }
-            .vedic-gradient { background: linear-gradient(135deg, #8B5CF6 0%, #EC4899 100%); }
-            .animate-slideIn { animation: slideIn 0.5s ease-out; }
-            @keyframes slideIn { from { opacity: 0; transform: translateY(20px); } to { opacity: 1; transform: translateY(0); } }
-            .chat-message { display: flex; margin: 10px 0; align-items: flex-end; }
-            .user-message { flex-direction: row-reverse; }
-            .message-bubble { max-width: 70%; padding: 12px 16px; border-radius: 18px; word-wrap: break-word; }
-            .user-bubble { background: linear-gradient(135deg, #8B5CF6, #EC4899); color: white; margin-left: auto; }
-            .ai-bubble { background: rgba(255, 255, 255, 0.1); color: #E2E8F0; backdrop-filter: blur(10px); border: 1px solid rgba(255, 255, 255, 0.2); }
-            .avatar { width: 40px; height: 40px; border-radius: 50%; display: flex; align-items: center; justify-content: center; margin: 0 8px; }
-            .user-avatar { background: linear-gradient(135deg, #8B5CF6, #EC4899); }
-            .ai-avatar { background: rgba(255, 255, 255, 0.1); color: #8B5CF6; }
-            #chat-container { height: 60vh; overflow-y: auto; padding: 20px; }
-            #input-container { display: flex; padding: 20px; background: rgba(0, 0, 0, 0.5); border-top: 1px solid rgba(255, 255, 255, 0.1); }
-            #message-input { flex: 1; padding: 12px 16px; border: none; border-radius: 25px; background: rgba(255, 255, 255, 0.1); color: white; outline: none; }
-            #send-button { margin-left: 10px; padding: 12px 20px; background: linear-gradient(135deg, #8B5CF6, #EC4899); border: none; border-radius: 25px; color: white; cursor: pointer; }
-            .welcome-message { text-align: center; padding: 20px; color: #A78BFA; font-style: italic; }
-        </style>
-    </head>
-    <body class="bg-animation">
-        <!-- Stars background -->
-        <div id="stars"></div>
-
-        <div class="container mx-auto px-4 py-8 max-w-4xl">
-            <!-- Header -->
-            <header class="text-center mb-12">
-                <h1 class="hero-heading text-5xl font-bold text-transparent bg-clip-text bg-gradient-to-r from-purple-400 to-pink-500 mb-4">
-                    VedaAI
-                </h1>
-                <p class="text-xl text-gray-300 max-w-2xl mx-auto">
-                    Ancient Wisdom Meets Modern Intelligence
-                </p>
-                <p class="sanskrit-text text-lg mt-4 opacity-80">
-                    "ॐ तत् सत्" - Om Tat Sat
-                </p>
-            </header>
-
-            <!-- Chat Container -->
-            <div id="chat-container" class="bg-black bg-opacity-20 rounded-2xl backdrop-blur-md border border-white border-opacity-10 mb-6">
-                <div class="welcome-message">
-                    <p>🕉 Welcome to VedaAI. Ask me about ancient Indian scriptures, Vedas, Puranas, or any question!</p>
-                </div>
-            </div>
-
-            <!-- Input Container -->
-            <div id="input-container">
-                <input type="text" id="message-input" class="input-glow" placeholder="Ask about Vedas, Puranas, or anything..." onkeypress="if(event.key==='Enter') sendMessage()">
-                <button id="send-button" onclick="sendMessage()">Send</button>
-            </div>
-        </div>
-
-        <script>
-            // Create stars
-            function createStars() {
-                const starsContainer = document.getElementById('stars');
-                for (let i = 0; i < 100; i++) {
-                    const star = document.createElement('div');
-                    star.className = 'star';
-                    star.style.left = Math.random() * 100 + '%';
-                    star.style.top = Math.random() * 100 + '%';
-                    star.style.width = Math.random() * 3 + 1 + 'px';
-                    star.style.height = star.style.width;
-                    star.style.animationDelay = Math.random() * 20 + 's';
-                    starsContainer.appendChild(star);
-                }
-            }
-            createStars();
-
-            const chatContainer = document.getElementById('chat-container');
-            const messageInput = document.getElementById('message-input');
-            const sendButton = document.getElementById('send-button');
-
-            async function sendMessage() {
-                const message = messageInput.value.trim();
-                if (!message) return;
-
-                // Add user message
-                addMessage(message, 'user');
-                messageInput.value = '';
-
-                // Add thinking indicator
-                const thinkingDiv = addMessage('Thinking...', 'ai');
-                sendButton.disabled = true;
-                sendButton.textContent = 'Sending...';
-
-                try {
-                    const response = await fetch('/api/chat', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({message: message})
-                    });
-                    const data = await response.json();
-                    // Remove thinking
-                    chatContainer.removeChild(thinkingDiv);
-                    addMessage(data.response, 'ai');
-                } catch (error) {
-                    chatContainer.removeChild(thinkingDiv);
-                    addMessage('Error: ' + error.message, 'ai');
-                } finally {
-                    sendButton.disabled = false;
-                    sendButton.textContent = 'Send';
-                }
-            }
-
-            function addMessage(text, sender) {
-                const messageDiv = document.createElement('div');
-                messageDiv.className = `chat-message ${sender === 'user' ? 'user-message' : ''} animate-slideIn`;
-                
-                const bubble = document.createElement('div');
-                bubble.className = `message-bubble ${sender === 'user' ? 'user-bubble' : 'ai-bubble'}`;
-                bubble.innerHTML = text.replace(/\n/g, '<br>');
-
-                const avatar = document.createElement('div');
-                avatar.className = `avatar ${sender === 'user' ? 'user-avatar' : 'ai-avatar'}`;
-                avatar.innerHTML = sender === 'user' ? '👤' : '🕉';
-
-                if (sender === 'user') {
-                    messageDiv.appendChild(bubble);
-                    messageDiv.appendChild(avatar);
-                } else {
-                    messageDiv.appendChild(avatar);
-                    messageDiv.appendChild(bubble);
-                }
-
-                // Remove welcome if first message
-                const welcome = chatContainer.querySelector('.welcome-message');
-                if (welcome) welcome.remove();
-
-                chatContainer.appendChild(messageDiv);
-                chatContainer.scrollTop = chatContainer.scrollHeight;
-
-                return messageDiv;
-            }
-
-            // Event listeners
-            sendButton.addEventListener('click', sendMessage);
-            messageInput.addEventListener('keypress', (e) => {
-                if (e.key === 'Enter') sendMessage();
-            });
-        </script>
-    </body>
-    </html>
-    """
-
-# Request model
-class ChatRequest(BaseModel):
-    message: str
-
-# Chat endpoint
-@app.post("/api/chat")
-async def chat_endpoint(request: ChatRequest):
-    user_message = request.message.strip()
-
-    try:
-        # Step 1: Retrieve relevant passages from the indexed corpus
-        relevant_passages = retriever.retrieve(user_message)
-        # Step 2: Search web for additional information
-        web_results = search_web(user_message)
-        # Prepare context from relevant passages and web results
-        context = ""
-        if relevant_passages:
-            context = "\n\n".join([
-                f"From {p['source']}:\n{p['text']}"
-                for p in relevant_passages
-            ])
-        web_context = "\n\n".join([
-            f"Web: {r['title']} - {r['snippet']}"
-            for r in web_results
-        ])
-        context += web_context
-
-        # Prepare prompt for Gemini
-        if relevant_passages:
-            # RAG mode: Scripture and web
-            prompt = f"""You are VedaAI, an expert AI trained on ancient Indian sacred texts and web knowledge. Your purpose is to answer questions based on the provided passages and web results, merging offline scripture data with online information for accurate, comprehensive responses.
-
-First, analyze the user's question and the provided "Relevant Passages and Web Results." Merge the information from scriptures and web to provide the best answer.
-
-- Generate a logical, accurate response citing sources from scriptures and web when possible.
-- If the question is about ancient Indian scriptures, prioritize scripture passages but enhance with web info.
-- For general questions, use web results and your knowledge.
-- Keep responses concise but informative (2-3 lines or more if needed).
-- Respond in English, incorporating Sanskrit or Hindi terms for religious concepts where appropriate. Provide natural, informative responses.
-
-Relevant Passages and Web Results:
-{context}
-
-Question: {user_message}
-
-Answer:"""
-        else:
-            # General mode: Use web and Gemini's knowledge
-            web_context = "\n\n".join([
-                f"Web: {r['title']} - {r['snippet']}"
-                for r in web_results
-            ])
-            prompt = f"""You are VedaAI, a helpful AI assistant. Answer the user's question using your knowledge and the provided web results. If the question is about ancient Indian scriptures, provide accurate information with citations if possible. Keep responses short and accurate.
-
-Respond in English, incorporating Sanskrit or Hindi terms for religious concepts where appropriate. Provide natural, informative responses.
-
-Web Results:
-{web_context}
-
-Question: {user_message}
-
-Answer:"""
-
-        # Try Gemini first, fallback to open-source LLM if available
-        try:
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    model = genai.GenerativeModel('gemini-2.0-flash')
-                    response = model.generate_content(prompt)
-                    return {"response": response.text}
-                except Exception as e:
-                    error_msg = str(e)
-                    if "429" in error_msg or "quota exceeded" in error_msg.lower():
-                        if attempt < max_retries - 1:
-                            match = re.search(r'retry_delay {\s*seconds: (\d+(?:\.\d+)?)\s*}', error_msg)
-                            if match:
-                                delay = float(match.group(1))
-                                print(f"Rate limit hit, retrying in {delay} seconds...")
-                                await asyncio.sleep(delay)
-                            else:
-                                print("Rate limit hit, retrying in 10 seconds...")
-                                await asyncio.sleep(10)
-                            continue
-                        else:
-                            raise
-                    else:
-                        raise
-        except Exception as e:
-            print(f"Gemini failed: {e}, trying open-source LLM...")
-            if llm_pipeline:
-                try:
-                    # Use open-source LLM as fallback
-                    full_prompt = f"Context: {context}\n\nQuestion: {user_message}\n\nAnswer:"
-                    generated = llm_pipeline(full_prompt, max_length=200, num_return_sequences=1, temperature=0.7)
-                    response_text = generated[0]['generated_text'].replace(full_prompt, "").strip()
-                    return {"response": response_text}
-                except Exception as e2:
-                    print(f"Open-source LLM also failed: {e2}")
-                    raise HTTPException(status_code=500, detail="Both Gemini and open-source LLM failed")
-            else:
-                raise HTTPException(status_code=500, detail="Gemini failed and no open-source LLM available")
-
-    except Exception as e:
-        import traceback
-        traceback_str = traceback.format_exc()
-        print("Exception traceback:\n", traceback_str)
-        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
-
-# Run the app
-if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+import uvicorn
+import os
+import asyncio
+import json
+import time
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from cache import LRUCache, SemanticCache
+from dotenv import load_dotenv
+from web_search import WebSearcher, BING_SEARCH_URL
+from components import LazyComponent
+from fallback_generator import FallbackGenerator, FallbackOverloaded
+from llm_client import CircuitBreaker, FakeGenerativeModel, GeminiClient, LLMUnavailable, TokenBucket
+from tokens import estimate_tokens
+from context_packer import pack_context
+from metrics import REGISTRY, Counter, Gauge, Histogram, request_timings, span, start_request_timings
+
+# Load environment variables
+load_dotenv()
+
+# Configure Gemini. GEMINI_MODEL=fake swaps in a local simulated model
+# (FAKE_GEMINI_LATENCY_MS, FAKE_GEMINI_FAIL_RATE, FAKE_GEMINI_429_RATE) for
+# tests and load runs.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+
+def make_gemini_model():
+    if GEMINI_MODEL == "fake":
+        return FakeGenerativeModel(
+            latency=float(os.getenv("FAKE_GEMINI_LATENCY_MS", "200")) / 1000.0,
+            fail_rate=float(os.getenv("FAKE_GEMINI_FAIL_RATE", "0")),
+            rate_limit_rate=float(os.getenv("FAKE_GEMINI_429_RATE", "0")),
+        )
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in environment variables")
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+# Quota: GEMINI_RPM requests and GEMINI_TPM prompt tokens per minute (0 = no
+# token limit). Requests queue for up to GEMINI_MAX_QUEUE_WAIT seconds, and
+# after GEMINI_BREAKER_FAILURES consecutive failures Gemini is skipped for
+# GEMINI_BREAKER_RESET seconds; both cases go straight to the fallback.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "5"))
+GEMINI_MAX_QUEUE_WAIT = float(os.getenv("GEMINI_MAX_QUEUE_WAIT", "5"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+
+gemini = GeminiClient(
+    make_gemini_model(),
+    limiter=TokenBucket(GEMINI_RPM / 60.0, GEMINI_BURST),
+    token_limiter=TokenBucket(GEMINI_TPM / 60.0, GEMINI_TPM) if GEMINI_TPM > 0 else None,
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("GEMINI_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET", "30")),
+    ),
+    max_queue_wait=GEMINI_MAX_QUEUE_WAIT,
+    timeout=GEMINI_TIMEOUT,
+)
+
+# Heavy components (embedding model + indexes, fallback LLM) are loaded on
+# first use or by the background warm-up, not at import, so the server
+# starts accepting connections immediately.
+def load_retriever():
+    # Concurrent queries are micro-batched into single encode/search calls
+    # unless QUERY_BATCHING is turned off
+    global semantic_cache
+    from scripture_retriever import ScriptureRetriever
+    retriever = ScriptureRetriever(
+        batch_queries=os.getenv("QUERY_BATCHING", "true").lower() in ("1", "true", "yes"),
+        max_batch_size=int(os.getenv("QUERY_BATCH_SIZE", "32")),
+        max_batch_wait_ms=float(os.getenv("QUERY_BATCH_WAIT_MS", "2")),
+        search_params={
+            "nprobe": int(os.getenv("FAISS_NPROBE")) if os.getenv("FAISS_NPROBE") else None,
+            "ef_search": int(os.getenv("FAISS_EF_SEARCH")) if os.getenv("FAISS_EF_SEARCH") else None,
+        },
+        retrieval_mode=os.getenv("RETRIEVAL_MODE", "hybrid"),
+        embedding_backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+        embedding_threads=int(os.getenv("EMBEDDING_THREADS")) if os.getenv("EMBEDDING_THREADS") else None,
+        data_dir=os.getenv("DATA_DIR") or None,
+    )
+    retriever.warm_up()
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache = SemanticCache(
+            retriever.dimension, max_entries=ANSWER_CACHE_SIZE,
+            threshold=SEMANTIC_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL
+        )
+    return retriever
+
+def load_fallback_llm():
+    # Open-source LLM (a small model for demonstration) on its own
+    # batching worker thread; see fallback_generator.py
+    from transformers import pipeline
+    llm_pipeline = pipeline("text-generation", model="microsoft/DialoGPT-small", device=-1)  # Use CPU
+    return FallbackGenerator(
+        llm_pipeline.model, llm_pipeline.tokenizer,
+        max_queue=int(os.getenv("FALLBACK_QUEUE_SIZE", "32")),
+        max_batch_size=int(os.getenv("FALLBACK_BATCH_SIZE", "8")),
+        max_wait_ms=float(os.getenv("FALLBACK_BATCH_WAIT_MS", "50")),
+        max_new_tokens=int(os.getenv("FALLBACK_MAX_NEW_TOKENS", "80")),
+    )
+
+retriever_component = LazyComponent("retriever", load_retriever)
+fallback_llm = LazyComponent("fallback LLM", load_fallback_llm)
+COMPONENTS = {"retriever": retriever_component, "fallback_llm": fallback_llm}
+
+# Components loaded in the background at startup; /readyz reports ready once
+# they are all loaded. The fallback LLM is only loaded if Gemini ever fails,
+# unless it is listed here (e.g. WARMUP=retriever,fallback_llm).
+WARMUP = [name.strip() for name in os.getenv("WARMUP", "retriever").split(",") if name.strip() in COMPONENTS]
+
+# Pipeline settings
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "5"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+WEB_SEARCH_TIMEOUT = float(os.getenv("WEB_SEARCH_TIMEOUT", "4"))
+
+# Bounded pool for CPU-bound work (embedding + FAISS search)
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+# Web search: pooled client with strict timeouts and a TTL result cache.
+# It is skipped when retrieval already found WEB_SKIP_MIN_PASSAGES passages
+# with relevance >= WEB_SKIP_RELEVANCE (0 disables skipping).
+WEB_SEARCH_URL = os.getenv("WEB_SEARCH_URL", BING_SEARCH_URL)
+WEB_CONNECT_TIMEOUT = float(os.getenv("WEB_CONNECT_TIMEOUT", "1"))
+WEB_READ_TIMEOUT = float(os.getenv("WEB_READ_TIMEOUT", "3"))
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", "900"))
+WEB_SKIP_RELEVANCE = float(os.getenv("WEB_SKIP_RELEVANCE", "0.6"))
+WEB_SKIP_MIN_PASSAGES = int(os.getenv("WEB_SKIP_MIN_PASSAGES", "2"))
+WEB_SEARCH_DEFER = float(os.getenv("WEB_SEARCH_DEFER_MS", "150")) / 1000.0
+
+web_searcher = WebSearcher(
+    base_url=WEB_SEARCH_URL,
+    connect_timeout=WEB_CONNECT_TIMEOUT,
+    read_timeout=WEB_READ_TIMEOUT,
+    cache_ttl=WEB_CACHE_TTL,
+)
+
+async def search_web(query):
+    with span("web_search"):
+        return await web_searcher.search(query)
+
+def scripture_is_sufficient(passages):
+    if WEB_SKIP_RELEVANCE <= 0:
+        return False
+    strong = [p for p in passages if p['relevance'] >= WEB_SKIP_RELEVANCE]
+    return len(strong) >= WEB_SKIP_MIN_PASSAGES
+
+async def search_web_if_needed(query, retrieval_task):
+    # Retrieval gets a short head start. If it comes back with strong
+    # passages the web search is never sent; if it is slower than that, the
+    # search runs concurrently. Whichever finishes first decides: web results
+    # that arrive before retrieval are used as they are, and the sufficiency
+    # check only skips the search when retrieval finishes first.
+    done, _ = await asyncio.wait([retrieval_task], timeout=WEB_SEARCH_DEFER)
+    if done and scripture_is_sufficient(retrieval_task.result()):
+        web_searcher.skipped += 1
+        return []
+    web_task = asyncio.ensure_future(search_web(query))
+    try:
+        # asyncio.wait never cancels retrieval, even if this stage times out
+        while not web_task.done():
+            done, _ = await asyncio.wait({retrieval_task, web_task}, return_when=asyncio.FIRST_COMPLETED)
+            if retrieval_task in done and not web_task.done():
+                if not retrieval_task.cancelled() and scripture_is_sufficient(retrieval_task.result()):
+                    web_searcher.skipped += 1
+                    return []
+                return await web_task
+        return web_task.result()
+    finally:
+        web_task.cancel()
+
+retrieval_inflight = 0
+
+async def retrieve_passages(query):
+    global retrieval_inflight
+    retriever = await retriever_component.get_async()
+    if retriever is None:
+        return []
+    loop = asyncio.get_running_loop()
+    retrieval_inflight += 1
+    try:
+        with span("retrieval"):
+            if retriever.batcher is not None:
+                # Awaited without holding a pool thread, so batches can grow
+                # past RETRIEVAL_WORKERS up to QUERY_BATCH_SIZE
+                passages = await asyncio.wrap_future(retriever.retrieve_future(query, RETRIEVAL_TOP_K))
+            else:
+                # Run in a copy of this context so the embed/search spans on
+                # the worker thread are reported with this request
+                passages = await loop.run_in_executor(
+                    retrieval_executor, contextvars.copy_context().run, retriever.retrieve, query, RETRIEVAL_TOP_K
+                )
+    finally:
+        retrieval_inflight -= 1
+    RETRIEVALS.inc(result="hit" if passages else "miss")
+    return passages
+
+async def run_stage(name, coro, timeout):
+    # A slow or failing stage degrades to "no results" instead of failing the request
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        print(f"{name} timed out after {timeout} seconds")
+    except Exception as e:
+        print(f"{name} error: {e}")
+    return []
+
+def start_context_tasks(query):
+    # Retrieval and web search run concurrently, each with its own timeout;
+    # the web stage may skip itself based on the retrieval result
+    retrieval_task = asyncio.ensure_future(run_stage("Retrieval", retrieve_passages(query), RETRIEVAL_TIMEOUT))
+    web_task = asyncio.ensure_future(
+        run_stage("Web search", search_web_if_needed(query, retrieval_task), WEB_SEARCH_TIMEOUT)
+    )
+    return retrieval_task, web_task
+
+async def gather_context(query):
+    return await asyncio.gather(*start_context_tasks(query))
+
+# Context assembly: retrieved passages are de-duplicated, trimmed to the span
+# around the query and packed with the web snippets into a token budget
+# (estimated at ~4 characters per token). Web snippets get at most
+# CONTEXT_WEB_TOKENS of it, each passage at most CONTEXT_PASSAGE_TOKENS.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_PASSAGE_TOKENS = int(os.getenv("CONTEXT_PASSAGE_TOKENS", "300"))
+CONTEXT_WEB_TOKENS = int(os.getenv("CONTEXT_WEB_TOKENS", "300"))
+
+# Answer caches: exact prompt -> answer, and optionally query embedding -> answer
+# so that near-duplicate questions skip retrieval, web search and the LLM
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+answer_cache = LRUCache(max_entries=ANSWER_CACHE_SIZE, max_bytes=16 * 1024 * 1024, ttl=ANSWER_CACHE_TTL)
+semantic_cache = None  # created with the retriever, which knows the embedding dimension
+answer_cache_version = 0
+
+def sync_answer_caches():
+    # Cached answers were grounded in the old index; drop them once it changes
+    global answer_cache_version
+    retriever = retriever_component.value
+    if retriever is not None and retriever.index_version != answer_cache_version:
+        answer_cache.clear()
+        if semantic_cache is not None:
+            semantic_cache.clear()
+        answer_cache_version = retriever.index_version
+
+async def lookup_cached_answer(query):
+    # Returns (query_embedding, cached_answer); both None when the semantic cache is off
+    sync_answer_caches()
+    if semantic_cache is None:
+        return None, None
+    loop = asyncio.get_running_loop()
+    with span("semantic_cache"):
+        try:
+            embedding = await loop.run_in_executor(retrieval_executor, retriever_component.value.embed_query, query)
+        except Exception as e:
+            print(f"Query embedding error: {e}")
+            return None, None
+        return embedding, semantic_cache.get(embedding)
+
+def remember_answer(prompt, query_embedding, answer):
+    answer_cache.set(prompt, answer)
+    if semantic_cache is not None and query_embedding is not None:
+        semantic_cache.set(query_embedding, answer)
+
+# Metrics, served in Prometheus text format at /metrics. Stage latencies are
+# recorded by metrics.span(); counters and gauges that the components
+# already keep are read when /metrics is scraped, so they cost nothing per
+# request. Each worker process has its own registry.
+REQUEST_SECONDS = Histogram("vedaai_request_seconds", "End-to-end chat request latency", ["endpoint"])
+ANSWERS = Counter("vedaai_answers_total", "Chat answers by source (cache, gemini or fallback)", ["source"])
+RETRIEVALS = Counter("vedaai_retrievals_total", "Retrievals that returned passages (hit) or none (miss)", ["result"])
+
+def caches():
+    caches = {"answer": answer_cache, "semantic": semantic_cache, "web_search": web_searcher.cache}
+    retriever = retriever_component.value
+    if retriever is not None:
+        caches.update(embedding=retriever.embedding_cache, retrieval=retriever.retrieval_cache)
+    return {name: cache for name, cache in caches.items() if cache is not None}
+
+def retriever_value(read):
+    retriever = retriever_component.value
+    return read(retriever) if retriever is not None else None
+
+def queue_depths():
+    depths = {}
+    retriever = retriever_component.value
+    if retriever is not None and retriever.batcher is not None:
+        depths["query_batcher"] = retriever.batcher.queue.qsize()
+    if fallback_llm.value is not None:
+        depths["fallback"] = fallback_llm.value.queue.qsize()
+    return depths
+
+Counter("vedaai_cache_hits_total", "Cache hits", ["cache"],
+        collect=lambda: {name: cache.info()["hits"] for name, cache in caches().items()})
+Counter("vedaai_cache_misses_total", "Cache misses", ["cache"],
+        collect=lambda: {name: cache.info()["misses"] for name, cache in caches().items()})
+Counter("vedaai_gemini_calls_total", "Gemini API calls", collect=lambda: gemini.calls)
+Counter("vedaai_gemini_failures_total", "Failed Gemini API calls", collect=lambda: gemini.failures)
+Counter("vedaai_gemini_rate_limited_total", "Gemini calls rejected with 429 / quota exceeded",
+        collect=lambda: gemini.rate_limited)
+Counter("vedaai_gemini_short_circuited_total", "Gemini calls refused by the open circuit breaker",
+        collect=lambda: gemini.short_circuited)
+Counter("vedaai_gemini_coalesced_total", "Requests that shared an in-flight Gemini call",
+        collect=lambda: gemini.coalesced)
+Counter("vedaai_fallback_shed_total", "Fallback requests refused because the queue was full",
+        collect=lambda: fallback_llm.value.shed if fallback_llm.value is not None else None)
+Counter("vedaai_web_search_skipped_total", "Web searches skipped because scripture was sufficient",
+        collect=lambda: web_searcher.skipped)
+Gauge("vedaai_index_vectors", "Vectors in the FAISS index", collect=lambda: retriever_value(lambda r: r.index.ntotal))
+Gauge("vedaai_lexical_index_chunks", "Chunks in the BM25 index", collect=lambda: retriever_value(lambda r: len(r.lexical)))
+Gauge("vedaai_queue_depth", "Requests waiting in a queue", ["queue"], collect=queue_depths)
+Gauge("vedaai_inflight", "Operations in progress", ["stage"], collect=lambda: {
+    "retrieval": retrieval_inflight,
+    "web_search": len(web_searcher.inflight),
+    "gemini": len(gemini.inflight) + len(gemini.streams),
+})
+Gauge("vedaai_component_loaded", "Whether a lazily loaded component is loaded", ["component"],
+      collect=lambda: {name: int(component.loaded) for name, component in COMPONENTS.items()})
+
+# FastAPI app
+app = FastAPI(title="VedaAI - Sacred Texts Assistant", description="AI-powered queries on ancient Indian scriptures")
+
+# Add CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Server-Timing"],
+)
+
+started_at = time.monotonic()
+warmup_task = None
+
+async def warm_up():
+    for name in WARMUP:
+        await COMPONENTS[name].get_async()
+
+@app.on_event("startup")
+async def startup():
+    global warmup_task
+    warmup_task = asyncio.ensure_future(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await web_searcher.close()
+    retrieval_executor.shutdown(wait=False)
+
+@app.get("/", response_class=HTMLResponse)
+async def root():
+    return """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>VedaAI - Ancient Wisdom Meets Modern Intelligence</title>
+        <script src="https://cdn.tailwindcss.com"></script>
+        <style>
+            @import url('https://fonts.googleapis.com/css2?family=Playfair+Display:ital,wght@0,400..900;1,400..900&family=Space+Grotesk:wght@300..700&display=swap');
+            @keyframes shine {
+                0%, 100% { background-position: 200% 0; }
+                50% { background-position: -200% 0; }
+            }
+            .hero-heading { font-family: 'Space Grotesk', sans-serif; }
+            .sanskrit-text { font-family: 'Playfair Display', serif; font-style: italic; }
+            .feature-card:hover { transform: translateY(-8px) scale(1.02); box-shadow: 0 10px 40px rgba(168, 85, 247, 0.2); }
+            .input-glow:focus { box-shadow: 0 0 0 3px rgba(168, 85, 247, 0.5); outline: none; }
+            .typing-cursor::after { content: '|'; animation: blink-caret 1s step-end infinite; }
+            @keyframes blink-caret { from, to { color: transparent; } 50% { color: white; } }
+            body { font-family: 'Playfair Display', serif; background: #0d0a1b; color: #E2E8F0; overflow-x: hidden; position: relative; min-height: 100vh; }
+            .bg-animation { position: fixed; top: 0; left: 0; width: 100%; height: 100%; z-index: -1; background: radial-gradient(circle at center, #1a0f2e 0%, #0d0a1b 100%); overflow: hidden; }
+            .star { position: absolute; background-color: #8B5CF6; border-radius: 50%; animation: move-star 20s linear infinite; }
+            @keyframes move-star { 0% { transform: translate(0, 0); opacity: 0.5; } 50% { opacity: 1; } 100% { transform: translate(100vw, 100vh); opacity: 0; } }
+            .vedic-gradient { background: linear-gradient(135deg, #8B5CF6 0%, #EC4899 100%); }
+            .animate-slideIn { animation: slideIn 0.5s ease-out; }
+            @keyframes slideIn { from { opacity: 0; transform: translateY(20px); } to { opacity: 1; transform: translateY(0); } }
+            .chat-message { display: flex; margin: 10px 0; align-items: flex-end; }
+            .user-message { flex-direction: row-reverse; }
+            .message-bubble { max-width: 70%; padding: 12px 16px; border-radius: 18px; word-wrap: break-word; }
+            .user-bubble { background: linear-gradient(135deg, #8B5CF6, #EC4899); color: white; margin-left: auto; }
+            .ai-bubble { background: rgba(255, 255, 255, 0.1); color: #E2E8F0; backdrop-filter: blur(10px); border: 1px solid rgba(255, 255, 255, 0.2); }
+            .avatar { width: 40px; height: 40px; border-radius: 50%; display: flex; align-items: center; justify-content: center; margin: 0 8px; }
+            .user-avatar { background: linear-gradient(135deg, #8B5CF6, #EC4899); }
+            .ai-avatar { background: rgba(255, 255, 255, 0.1); color: #8B5CF6; }
+            #chat-container { height: 60vh; overflow-y: auto; padding: 20px; }
+            #input-container { display: flex; padding: 20px; background: rgba(0, 0, 0, 0.5); border-top: 1px solid rgba(255, 255, 255, 0.1); }
+            #message-input { flex: 1; padding: 12px 16px; border: none; border-radius: 25px; background: rgba(255, 255, 255, 0.1); color: white; outline: none; }
+            #send-button { margin-left: 10px; padding: 12px 20px; background: linear-gradient(135deg, #8B5CF6, #EC4899); border: none; border-radius: 25px; color: white; cursor: pointer; }
+            .welcome-message { text-align: center; padding: 20px; color: #A78BFA; font-style: italic; }
+        </style>
+    </head>
+    <body class="bg-animation">
+        <!-- Stars background -->
+        <div id="stars"></div>
+
+        <div class="container mx-auto px-4 py-8 max-w-4xl">
+            <!-- Header -->
+            <header class="text-center mb-12">
+                <h1 class="hero-heading text-5xl font-bold text-transparent bg-clip-text bg-gradient-to-r from-purple-400 to-pink-500 mb-4">
+                    VedaAI
+                </h1>
+                <p class="text-xl text-gray-300 max-w-2xl mx-auto">
+                    Ancient Wisdom Meets Modern Intelligence
+                </p>
+                <p class="sanskrit-text text-lg mt-4 opacity-80">
+                    "ॐ तत् सत्" - Om Tat Sat
+                </p>
+            </header>
+
+            <!-- Chat Container -->
+            <div id="chat-container" class="bg-black bg-opacity-20 rounded-2xl backdrop-blur-md border border-white border-opacity-10 mb-6">
+                <div class="welcome-message">
+                    <p>🕉 Welcome to VedaAI. Ask me about ancient Indian scriptures, Vedas, Puranas, or any question!</p>
+                </div>
+            </div>
+
+            <!-- Input Container -->
+            <div id="input-container">
+                <input type="text" id="message-input" class="input-glow" placeholder="Ask about Vedas, Puranas, or anything..." onkeypress="if(event.key==='Enter') sendMessage()">
+                <button id="send-button" onclick="sendMessage()">Send</button>
+            </div>
+        </div>
+
+        <script>
+            // Create stars
+            function createStars() {
+                const starsContainer = document.getElementById('stars');
+                for (let i = 0; i < 100; i++) {
+                    const star = document.createElement('div');
+                    star.className = 'star';
+                    star.style.left = Math.random() * 100 + '%';
+                    star.style.top = Math.random() * 100 + '%';
+                    star.style.width = Math.random() * 3 + 1 + 'px';
+                    star.style.height = star.style.width;
+                    star.style.animationDelay = Math.random() * 20 + 's';
+                    starsContainer.appendChild(star);
+                }
+            }
+            createStars();
+
+            const chatContainer = document.getElementById('chat-container');
+            const messageInput = document.getElementById('message-input');
+            const sendButton = document.getElementById('send-button');
+
+            async function sendMessage() {
+                const message = messageInput.value.trim();
+                if (!message) return;
+
+                // Add user message
+                addMessage(message, 'user');
+                messageInput.value = '';
+
+                // Add thinking indicator
+                const thinkingDiv = addMessage('Thinking...', 'ai');
+                sendButton.disabled = true;
+                sendButton.textContent = 'Sending...';
+
+                try {
+                    const response = await fetch('/api/chat/stream', {
+                        method: 'POST',
+                        headers: {'Content-Type': 'application/json'},
+                        body: JSON.stringify({message: message})
+                    });
+                    if (!response.ok || !response.body) throw new Error('Request failed (' + response.status + ')');
+
+                    // Render server-sent events as they arrive
+                    const bubble = thinkingDiv.querySelector('.message-bubble');
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    let answer = '';
+                    let sources = [];
+                    const render = () => {
+                        const footer = sources.length ? '\\n\\n📜 ' + sources.join(', ') : '';
+                        setBubbleText(bubble, (answer || 'Thinking...') + footer);
+                        chatContainer.scrollTop = chatContainer.scrollHeight;
+                    };
+                    while (true) {
+                        const {done, value} = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, {stream: true});
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                            const event = parseEvent(buffer.slice(0, boundary));
+                            buffer = buffer.slice(boundary + 2);
+                            if (event.type === 'passages') {
+                                sources = sources.concat(event.data.map(p => p.source));
+                            } else if (event.type === 'sources') {
+                                sources = sources.concat(event.data.map(r => r.title).filter(t => t));
+                            } else if (event.type === 'token') {
+                                answer += event.data.text;
+                            } else if (event.type === 'error') {
+                                answer += (answer ? '\\n\\n' : '') + 'Error: ' + event.data.detail;
+                            }
+                            render();
+                        }
+                    }
+                } catch (error) {
+                    chatContainer.removeChild(thinkingDiv);
+                    addMessage('Error: ' + error.message, 'ai');
+                } finally {
+                    sendButton.disabled = false;
+                    sendButton.textContent = 'Send';
+                }
+            }
+
+            function parseEvent(block) {
+                let type = 'message';
+                let data = '';
+                for (const line of block.split('\\n')) {
+                    if (line.startsWith('event: ')) type = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                return {type: type, data: data ? JSON.parse(data) : null};
+            }
+
+            function setBubbleText(bubble, text) {
+                // Text nodes, never markup: answers, passage sources and web
+                // titles all come from outside
+                bubble.replaceChildren();
+                text.split('\\n').forEach((line, i) => {
+                    if (i) bubble.appendChild(document.createElement('br'));
+                    bubble.appendChild(document.createTextNode(line));
+                });
+            }
+
+            function addMessage(text, sender) {
+                const messageDiv = document.createElement('div');
+                messageDiv.className = `chat-message ${sender === 'user' ? 'user-message' : ''} animate-slideIn`;
+                
+                const bubble = document.createElement('div');
+                bubble.className = `message-bubble ${sender === 'user' ? 'user-bubble' : 'ai-bubble'}`;
+                setBubbleText(bubble, text);
+
+                const avatar = document.createElement('div');
+                avatar.className = `avatar ${sender === 'user' ? 'user-avatar' : 'ai-avatar'}`;
+                avatar.innerHTML = sender === 'user' ? '👤' : '🕉';
+
+                if (sender === 'user') {
+                    messageDiv.appendChild(bubble);
+                    messageDiv.appendChild(avatar);
+                } else {
+                    messageDiv.appendChild(avatar);
+                    messageDiv.appendChild(bubble);
+                }
+
+                // Remove welcome if first message
+                const welcome = chatContainer.querySelector('.welcome-message');
+                if (welcome) welcome.remove();
+
+                chatContainer.appendChild(messageDiv);
+                chatContainer.scrollTop = chatContainer.scrollHeight;
+
+                return messageDiv;
+            }
+
+            // Event listeners
+            sendButton.addEventListener('click', sendMessage);
+            messageInput.addEventListener('keypress', (e) => {
+                if (e.key === 'Enter') sendMessage();
+            });
+        </script>
+    </body>
+    </html>
+    """
+
+# Request model
+class ChatRequest(BaseModel):
+    message: str
+
+class RetrieveRequest(BaseModel):
+    queries: list[str]
+    top_k: int = 3
+    mode: str | None = None
+
+class ChatBatchRequest(BaseModel):
+    messages: list[str]
+    web_search: bool = False
+
+def build_prompt(user_message, relevant_passages, web_results):
+    # Pack passages and web results into the context budget
+    with span("context_pack"):
+        scripture_context, web_context, report = pack_context(
+            user_message, relevant_passages, web_results, budget=CONTEXT_TOKEN_BUDGET,
+            max_passage_tokens=CONTEXT_PASSAGE_TOKENS, max_web_tokens=CONTEXT_WEB_TOKENS,
+        )
+    context = "\n\n".join(part for part in (scripture_context, web_context) if part)
+
+    # Prepare prompt for Gemini
+    if relevant_passages:
+        # RAG mode: Scripture and web
+        prompt = f"""You are VedaAI, an expert AI trained on ancient Indian sacred texts and web knowledge. Your purpose is to answer questions based on the provided passages and web results, merging offline scripture data with online information for accurate, comprehensive responses.
+
+First, analyze the user's question and the provided "Relevant Passages and Web Results." Merge the information from scriptures and web to provide the best answer.
+
+- Generate a logical, accurate response citing sources from scriptures and web when possible.
+- If the question is about ancient Indian scriptures, prioritize scripture passages but enhance with web info.
+- For general questions, use web results and your knowledge.
+- Keep responses concise but informative (2-3 lines or more if needed).
+- Respond in English, incorporating Sanskrit or Hindi terms for religious concepts where appropriate. Provide natural, informative responses.
+
+Relevant Passages and Web Results:
+{context}
+
+Question: {user_message}
+
+Answer:"""
+    else:
+        # General mode: Use web and Gemini's knowledge
+        prompt = f"""You are VedaAI, a helpful AI assistant. Answer the user's question using your knowledge and the provided web results. If the question is about ancient Indian scriptures, provide accurate information with citations if possible. Keep responses short and accurate.
+
+Respond in English, incorporating Sanskrit or Hindi terms for religious concepts where appropriate. Provide natural, informative responses.
+
+Web Results:
+{web_context}
+
+Question: {user_message}
+
+Answer:"""
+
+    report['prompt_tokens'] = estimate_tokens(prompt)
+    return prompt, context, report
+
+def fallback_prompt(context, user_message):
+    return f"Context: {context}\n\nQuestion: {user_message}\n\nAnswer:"
+
+async def generate_with_fallback(full_prompt):
+    generator = await fallback_llm.get_async()
+    with span("fallback"):
+        return await generator.generate(full_prompt)
+
+async def stream_with_fallback(full_prompt):
+    generator = await fallback_llm.get_async()
+    with span("fallback"):
+        async for text in generator.stream(full_prompt):
+            yield text
+
+class AnswerFailed(Exception):
+    """No model could answer; status_code and retry_after are for the HTTP response."""
+
+    def __init__(self, status_code, detail, retry_after=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+async def answer_prompt(prompt, context, user_message, query_embedding=None, on_text=None):
+    """
+    The answer sequence shared by the chat endpoints: answer cache, Gemini,
+    then the fallback model. Returns (answer, source, timings) or raises
+    AnswerFailed. With on_text both models stream, and each piece of text
+    is passed to on_text as it arrives.
+    """
+    timings = request_timings.get()
+    cached_answer = answer_cache.get(prompt)
+    if cached_answer is not None:
+        ANSWERS.inc(source="cache")
+        if on_text is not None:
+            on_text(cached_answer)
+        return cached_answer, "cache", timings
+
+    started = False
+    try:
+        with span("gemini"):
+            if on_text is None:
+                answer = await gemini.generate(prompt)
+            else:
+                parts = []
+                async for text in gemini.stream(prompt):
+                    started = True
+                    parts.append(text)
+                    on_text(text)
+                answer = "".join(parts)
+        # Only Gemini answers are cached; fallback answers should not outlive an outage.
+        remember_answer(prompt, query_embedding, answer)
+        ANSWERS.inc(source="gemini")
+        return answer, "gemini", timings
+    except LLMUnavailable as e:
+        # Refused by the circuit breaker or rate limiter; Gemini was not called
+        print(f"Gemini unavailable: {e}, trying open-source LLM...")
+    except Exception as e:
+        if started:
+            # Part of the answer is already out; don't append a different one
+            print(f"Gemini stream failed: {e}")
+            raise AnswerFailed(502, "Gemini stream interrupted")
+        print(f"Gemini failed: {e}, trying open-source LLM...")
+
+    if await fallback_llm.get_async() is None:
+        raise AnswerFailed(500, "Gemini failed and no open-source LLM available")
+    try:
+        full_prompt = fallback_prompt(context, user_message)
+        if on_text is None:
+            answer = await generate_with_fallback(full_prompt)
+        else:
+            parts = []
+            async for text in stream_with_fallback(full_prompt):
+                parts.append(text)
+                on_text(text)
+            answer = "".join(parts).strip()
+    except FallbackOverloaded as e:
+        # Shed load instead of queueing without bound
+        raise AnswerFailed(503, "Gemini is unavailable and the fallback model is at capacity", e.retry_after)
+    except Exception as e:
+        print(f"Open-source LLM also failed: {e}")
+        raise AnswerFailed(500, "Both Gemini and open-source LLM failed")
+    ANSWERS.inc(source="fallback")
+    return answer, "fallback", timings
+
+# Chat endpoint
+@app.post("/api/chat")
+async def chat_endpoint(request: ChatRequest, response: Response):
+    user_message = request.message.strip()
+    timings = start_request_timings()
+
+    try:
+        query_embedding, cached_answer = await lookup_cached_answer(user_message)
+        if cached_answer is not None:
+            ANSWERS.inc(source="cache")
+            return {"response": cached_answer}
+
+        # Step 1 & 2: Retrieve relevant passages from the indexed corpus and
+        # search the web for additional information, in parallel
+        relevant_passages, web_results = await gather_context(user_message)
+        prompt, context, packed = build_prompt(user_message, relevant_passages, web_results)
+        try:
+            response_text, _, _ = await answer_prompt(prompt, context, user_message, query_embedding)
+        except AnswerFailed as e:
+            headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+        return {"response": response_text, "context": packed}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        traceback_str = traceback.format_exc()
+        print("Exception traceback:\n", traceback_str)
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    finally:
+        REQUEST_SECONDS.observe(timings.elapsed(), endpoint="chat")
+        response.headers["Server-Timing"] = timings.header()
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Streaming chat endpoint (server-sent events)
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    user_message = request.message.strip()
+
+    async def event_stream():
+        # Headers are already sent by the time the stages run, so the stage
+        # timings go into the final done event instead of Server-Timing
+        timings = start_request_timings()
+        try:
+            async for event in answer_events(timings):
+                yield event
+        finally:
+            REQUEST_SECONDS.observe(timings.elapsed(), endpoint="chat_stream")
+
+    async def answer_events(timings):
+        query_embedding, cached_answer = await lookup_cached_answer(user_message)
+        if cached_answer is not None:
+            ANSWERS.inc(source="cache")
+            yield sse_event("token", {"text": cached_answer})
+            yield sse_event("done", {"model": "cache", "timings": timings.as_dict()})
+            return
+
+        # Send passages and web sources as soon as each stage finishes
+        retrieval_task, web_task = start_context_tasks(user_message)
+        pending = {retrieval_task: "passages", web_task: "sources"}
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield sse_event(pending.pop(task), task.result())
+
+        relevant_passages, web_results = retrieval_task.result(), web_task.result()
+        prompt, context, packed = build_prompt(user_message, relevant_passages, web_results)
+        yield sse_event("context", packed)
+
+        # The answer runs as its own task and hands text over as it arrives
+        texts = asyncio.Queue()
+        answer_task = asyncio.ensure_future(
+            answer_prompt(prompt, context, user_message, query_embedding, on_text=texts.put_nowait)
+        )
+        answer_task.add_done_callback(lambda task: texts.put_nowait(None))
+        try:
+            while True:
+                text = await texts.get()
+                if text is None:
+                    break
+                yield sse_event("token", {"text": text})
+            _, source, _ = answer_task.result()
+        except AnswerFailed as e:
+            error = {"detail": e.detail}
+            if e.retry_after is not None:
+                error["retry_after"] = e.retry_after
+            yield sse_event("error", error)
+            return
+        finally:
+            answer_task.cancel()
+        yield sse_event("done", {"model": source, "timings": timings.as_dict()})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Batch APIs for evaluation sets and bulk lookups. Queries are retrieved
+# BATCH_CHUNK_SIZE at a time with ScriptureRetriever.retrieve_batch (one
+# encode call and one FAISS search per chunk), results are streamed back as
+# NDJSON, and each request answers its messages with a fixed pool of
+# BATCH_LLM_CONCURRENCY workers, so at most that many web searches and
+# LLM calls per request are in flight.
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "10000"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "256"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+async def batch_retriever(count):
+    if count > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per request")
+    retriever = await retriever_component.get_async()
+    if retriever is None:
+        raise HTTPException(status_code=503, detail="Retriever is not available")
+    return retriever
+
+async def retrieve_chunks(retriever, queries, top_k, mode=None):
+    # Yields (offset, passages per query) as each chunk is retrieved
+    loop = asyncio.get_running_loop()
+    for start in range(0, len(queries), BATCH_CHUNK_SIZE):
+        chunk = queries[start:start + BATCH_CHUNK_SIZE]
+        with span("retrieval_batch"):
+            found = await loop.run_in_executor(retrieval_executor, retriever.retrieve_batch, chunk, top_k, mode)
+        for passages in found:
+            RETRIEVALS.inc(result="hit" if passages else "miss")
+        yield start, found
+
+def ndjson_response(lines):
+    return StreamingResponse(lines, media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/retrieve")
+async def retrieve_endpoint(request: RetrieveRequest):
+    from scripture_retriever import RETRIEVAL_MODES
+    if request.mode is not None and request.mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(RETRIEVAL_MODES)}")
+    if not 1 <= request.top_k <= 100:
+        raise HTTPException(status_code=400, detail="top_k must be between 1 and 100")
+    retriever = await batch_retriever(len(request.queries))
+
+    async def lines():
+        async for start, found in retrieve_chunks(retriever, request.queries, request.top_k, request.mode):
+            for offset, passages in enumerate(found):
+                index = start + offset
+                yield json.dumps({"index": index, "query": request.queries[index], "passages": passages}) + "\n"
+
+    return ndjson_response(lines())
+
+async def answer_batch_message(message, passages, web_search):
+    start_request_timings()
+    web_results = []
+    if web_search and not scripture_is_sufficient(passages):
+        web_results = await run_stage("Web search", search_web(message), WEB_SEARCH_TIMEOUT)
+    prompt, context, packed = build_prompt(message, passages, web_results)
+    try:
+        response_text, source, timings = await answer_prompt(prompt, context, message)
+    except AnswerFailed as e:
+        error = {"error": e.detail}
+        if e.retry_after is not None:
+            error["retry_after"] = e.retry_after
+        return error
+    return {"response": response_text, "model": source, "context": packed, "timings": timings.as_dict()}
+
+@app.post("/api/chat/batch")
+async def chat_batch_endpoint(request: ChatBatchRequest):
+    messages = [message.strip() for message in request.messages]
+    retriever = await batch_retriever(len(messages))
+
+    async def lines():
+        # Retrieved messages go through a bounded queue to a fixed pool of
+        # workers, so web search and the LLM only ever see
+        # BATCH_LLM_CONCURRENCY of them at a time. Answers are written as they
+        # finish, so lines may come out of order.
+        work = asyncio.Queue(maxsize=2 * BATCH_LLM_CONCURRENCY)
+        results = asyncio.Queue()
+
+        async def worker():
+            while True:
+                item = await work.get()
+                if item is None:
+                    return
+                index, passages = item
+                try:
+                    line = await answer_batch_message(messages[index], passages, request.web_search)
+                except Exception as e:
+                    line = {"error": f"Error processing request: {str(e)}"}
+                results.put_nowait(dict({"index": index, "message": messages[index]}, **line))
+
+        async def produce():
+            scheduled = 0
+            try:
+                async for start, found in retrieve_chunks(retriever, messages, RETRIEVAL_TOP_K):
+                    for offset, passages in enumerate(found):
+                        await work.put((start + offset, passages))
+                    scheduled = start + len(found)
+            except Exception as e:
+                # Every message still gets its line
+                print(f"Batch retrieval error: {e}")
+                for index in range(scheduled, len(messages)):
+                    results.put_nowait({"index": index, "message": messages[index], "error": f"Retrieval failed: {e}"})
+            for _ in workers:
+                await work.put(None)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(max(1, min(BATCH_LLM_CONCURRENCY, len(messages))))]
+        producer = asyncio.ensure_future(produce())
+        try:
+            for _ in range(len(messages)):
+                yield json.dumps(await results.get()) + "\n"
+        finally:
+            # Stops the remaining work if the client disconnects
+            producer.cancel()
+            for task in workers:
+                task.cancel()
+
+    return ndjson_response(lines())
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    stats = {"answer": answer_cache.info()}
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.info()
+    if retriever_component.value is not None:
+        stats.update(retriever_component.value.cache_info())
+    stats["web_search"] = web_searcher.info()
+    return stats
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def component_info():
+    return {name: component.info() for name, component in COMPONENTS.items()}
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and serving, whatever is loaded
+    health = {"status": "ok", "uptime_seconds": time.monotonic() - started_at, "components": component_info()}
+    if retriever_component.value is not None:
+        # Includes whether the index needs rebuilding for the current embedder
+        health["index"] = retriever_component.value.index_info()
+    health["gemini"] = gemini.info()
+    if fallback_llm.value is not None:
+        health["fallback"] = fallback_llm.value.info()
+    return health
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: every warm-up component is loaded
+    ready = all(COMPONENTS[name].loaded for name in WARMUP)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "warmup": WARMUP, "components": component_info()},
+    )
+
+# Run the app. The default is the production mode: no reloader, optionally
+# several worker processes. Pass --reload while developing.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the VedaAI server")
+    parser.add_argument('--host', default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument('--port', type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument('--workers', type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument('--reload', action='store_true', help="restart on code changes (development only)")
+    args = parser.parse_args()
+    if args.reload:
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
+    else:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,192 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Latency buckets in seconds, from cache lookups to slow LLM answers
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4)
+        return ''.join(metric.render() for metric in self.metrics)
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """
+    A metric family with optional labels. Values are either recorded as they
+    happen (inc/set/observe, guarded by a lock since retrieval runs on worker
+    threads) or read at scrape time from `collect`, which returns a value or
+    a {label values tuple: value} dict. Reading existing counters at scrape
+    time keeps the request path free of metric updates.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), collect=None, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.values = {}
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        if self.collect is None:
+            with self.lock:
+                return list(self.values.items())
+        value = self.collect()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [(k if isinstance(k, tuple) else (k,), v) for k, v in value.items() if v is not None]
+        return [((), value)]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for key, value in self.samples():
+            lines.append(f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # per-bucket counts (last one is +Inf), sum, count
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][slot] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            states = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        for key, counts, total, count in states:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames + ('le',), key + (format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram('vedaai_stage_seconds', 'Time spent in each pipeline stage', ['stage'])
+
+
+class RequestTimings:
+    """Stage durations of one request, for the Server-Timing header."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))  # list.append is atomic; spans may come from worker threads
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        timings = {}
+        for stage, seconds in self.spans:
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000.0
+        timings['total'] = self.elapsed() * 1000.0
+        return {stage: round(ms, 2) for stage, ms in timings.items()}
+
+    def header(self):
+        return ', '.join(f'{stage};dur={ms}' for stage, ms in self.as_dict().items())
+
+
+request_timings = ContextVar('request_timings', default=None)
+
+
+def start_request_timings():
+    # Tasks created afterwards inherit the context, so their spans land here too
+    timings = RequestTimings()
+    request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def span(stage):
+    """Times a block into STAGE_SECONDS and the current request's timings, if any."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
@@ -0,0 +1,178 @@
+import os
+import json
+import mmap
+from array import array
+
+import numpy as np
+
+# On-disk layout for a store with prefix P:
+#   P.bin           UTF-8 passage text, concatenated
+#   P.ids.npy       int64 chunk ids, ascending
+#   P.offsets.npy   int64 byte offsets into P.bin (len(ids) + 1 entries)
+#   P.sources.npy   int32 index into P.sources.json per passage
+#   P.sources.json  interned source names
+#   P.locations.npy int64 (page, start, end) per passage, -1 when unknown
+#   P.verses.npy    S32 verse label or range per passage, empty when unknown
+# Everything is memory-mapped on open, so startup cost does not grow with
+# the corpus and the pages are shared between worker processes. Nothing is
+# unpickled. Stores written before chunks carried locations lack the last
+# two files and still open.
+SUFFIXES = ('.bin', '.ids.npy', '.offsets.npy', '.sources.npy', '.sources.json')
+OPTIONAL_SUFFIXES = ('.locations.npy', '.verses.npy')
+LOCATION_FIELDS = ('page', 'start', 'end')
+VERSE_WIDTH = 32
+
+
+def store_exists(prefix):
+    return all(os.path.exists(prefix + suffix) for suffix in SUFFIXES)
+
+
+def load_array(path):
+    # np.load cannot memory-map a zero-length array
+    array_ = np.load(path, mmap_mode='r', allow_pickle=False)
+    return array_ if array_.size else np.load(path, allow_pickle=False)
+
+
+class PassageStore:
+    def __init__(self, ids, offsets, source_ids, sources, blob, blob_file=None, locations=None, verses=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.source_ids = source_ids
+        self.sources = sources
+        self.blob = blob
+        self.blob_file = blob_file
+        self.locations = locations
+        self.verses = verses
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype='int64'), np.zeros(1, dtype='int64'),
+                   np.empty(0, dtype='int32'), [], b'')
+
+    @classmethod
+    def open(cls, prefix):
+        ids = load_array(prefix + '.ids.npy')
+        offsets = load_array(prefix + '.offsets.npy')
+        source_ids = load_array(prefix + '.sources.npy')
+        with open(prefix + '.sources.json', 'r', encoding='utf-8') as f:
+            sources = json.load(f)
+        locations = verses = None
+        if all(os.path.exists(prefix + suffix) for suffix in OPTIONAL_SUFFIXES):
+            locations = load_array(prefix + '.locations.npy')
+            verses = load_array(prefix + '.verses.npy')
+        blob_file = open(prefix + '.bin', 'rb')
+        if os.fstat(blob_file.fileno()).st_size:
+            blob = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            blob = b''
+        return cls(ids, offsets, source_ids, sources, blob, blob_file, locations, verses)
+
+    def close(self):
+        # Release the mappings (needed before the files can be replaced on Windows)
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+        if self.blob_file is not None:
+            self.blob_file.close()
+        empty = PassageStore.empty()
+        self.ids, self.offsets, self.source_ids, self.sources = empty.ids, empty.offsets, empty.source_ids, []
+        self.blob, self.blob_file = b'', None
+        self.locations = self.verses = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, chunk_id):
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row >= len(self.ids) or self.ids[row] != chunk_id:
+            raise KeyError(chunk_id)
+        return row
+
+    def __contains__(self, chunk_id):
+        try:
+            self.row(chunk_id)
+            return True
+        except KeyError:
+            return False
+
+    def get(self, chunk_id):
+        # Decodes only this passage; returns (text, metadata)
+        row = self.row(chunk_id)
+        text = self.blob[int(self.offsets[row]):int(self.offsets[row + 1])].decode('utf-8')
+        return text, self.metadata(row)
+
+    def metadata(self, row):
+        # source, plus page / start / end / verse where the chunker found them
+        metadata = {'source': self.sources[int(self.source_ids[row])]}
+        if self.locations is not None:
+            for field, value in zip(LOCATION_FIELDS, self.locations[row].tolist()):
+                if value >= 0:
+                    metadata[field] = value
+            if self.verses[row]:
+                metadata['verse'] = self.verses[row].decode('ascii')
+        return metadata
+
+    def iter_raw(self):
+        # (chunk_id, utf-8 bytes, metadata) for every passage, in id order
+        for row in range(len(self.ids)):
+            data = self.blob[int(self.offsets[row]):int(self.offsets[row + 1])]
+            yield int(self.ids[row]), data, self.metadata(row)
+
+
+class PassageStoreWriter:
+    """
+    Streams passages to temp files next to the target; commit() renames them
+    into place. Chunk ids must be added in ascending order.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.tmp_prefix = prefix + '.tmp'
+        self.blob = open(self.tmp_prefix + '.bin', 'wb')
+        self.ids = array('q')
+        self.offsets = array('q', [0])
+        self.source_ids = array('i')
+        self.sources = []
+        self.source_index = {}
+        self.locations = array('q')
+        self.verses = bytearray()
+        self.size = 0
+
+    def add_raw(self, chunk_id, data, metadata):
+        if self.ids and chunk_id <= self.ids[-1]:
+            raise ValueError(f"Chunk ids must be ascending ({chunk_id} after {self.ids[-1]})")
+        source = metadata['source']
+        if source not in self.source_index:
+            self.source_index[source] = len(self.sources)
+            self.sources.append(source)
+        self.blob.write(data)
+        self.size += len(data)
+        self.ids.append(chunk_id)
+        self.offsets.append(self.size)
+        self.source_ids.append(self.source_index[source])
+        self.locations.extend(-1 if metadata.get(field) is None else metadata[field] for field in LOCATION_FIELDS)
+        verse = (metadata.get('verse') or '').encode('ascii', 'replace')[:VERSE_WIDTH]
+        self.verses += verse.ljust(VERSE_WIDTH, b'\0')
+
+    def add(self, chunk_id, text, metadata):
+        self.add_raw(chunk_id, text.encode('utf-8'), metadata)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def commit(self):
+        self.blob.close()
+        np.save(self.tmp_prefix + '.ids.npy', np.frombuffer(self.ids, dtype='int64'))
+        np.save(self.tmp_prefix + '.offsets.npy', np.frombuffer(self.offsets, dtype='int64'))
+        np.save(self.tmp_prefix + '.sources.npy', np.frombuffer(self.source_ids, dtype='int32'))
+        with open(self.tmp_prefix + '.sources.json', 'w', encoding='utf-8') as f:
+            json.dump(self.sources, f, ensure_ascii=False)
+        np.save(self.tmp_prefix + '.locations.npy', np.frombuffer(self.locations, dtype='int64').reshape(-1, 3))
+        np.save(self.tmp_prefix + '.verses.npy', np.frombuffer(bytes(self.verses), dtype=f'S{VERSE_WIDTH}'))
+        for suffix in SUFFIXES + OPTIONAL_SUFFIXES:
+            os.replace(self.tmp_prefix + suffix, self.prefix + suffix)
+
+    def abort(self):
+        self.blob.close()
+        for suffix in SUFFIXES + OPTIONAL_SUFFIXES:
+            if os.path.exists(self.tmp_prefix + suffix):
+                os.remove(self.tmp_prefix + suffix)
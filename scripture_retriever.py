@@ -1,137 +1,734 @@
-import os
-import faiss
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import re
-import pickle
-
-class ScriptureRetriever:
-    def __init__(self):
-        self.CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
-        self.FAISS_INDEX_FILE = os.path.join(os.path.dirname(__file__), 'faiss_index.idx')
-        self.DATA_FILE = os.path.join(os.path.dirname(__file__), 'data.pkl')
-        self.MODEL_NAME = 'all-MiniLM-L6-v2'
-        
-        # Initialize embedding model
-        self.embedder = SentenceTransformer(self.MODEL_NAME)
-        
-        # Initialize FAISS index
-        self.dimension = self.embedder.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
-        
-        # Data storage
-        self.documents = []
-        self.metadatas = []
-        
-        # Load existing index if available
-        self.load_index()
-
-    def preprocess_text(self, text):
-        # Remove page markers and unnecessary whitespace
-        text = re.sub(r'--- Page \d+ ---', '', text)
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
-
-    def chunk_text(self, text, min_length=100):
-        # Split into meaningful chunks (verses/paragraphs)
-        chunks = []
-        current_chunk = []
-        
-        for line in text.split('\n'):
-            line = line.strip()
-            if not line:
-                if current_chunk and len(' '.join(current_chunk)) >= min_length:
-                    chunks.append(' '.join(current_chunk))
-                current_chunk = []
-            else:
-                current_chunk.append(line)
-        
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
-        
-        return chunks
-
-    def load_index(self):
-        if os.path.exists(self.FAISS_INDEX_FILE) and os.path.exists(self.DATA_FILE):
-            self.index = faiss.read_index(self.FAISS_INDEX_FILE)
-            with open(self.DATA_FILE, 'rb') as f:
-                self.documents, self.metadatas = pickle.load(f)
-            print("Loaded existing FAISS index and data.")
-
-    def save_index(self):
-        faiss.write_index(self.index, self.FAISS_INDEX_FILE)
-        with open(self.DATA_FILE, 'wb') as f:
-            pickle.dump((self.documents, self.metadatas), f)
-        print("FAISS index and data saved to disk.")
-
-    def index_corpus(self):
-        total_chunks = 0
-        for filename in os.listdir(self.CORPUS_DIR):
-            if filename.endswith('.txt'):
-                file_path = os.path.join(self.CORPUS_DIR, filename)
-                source_name = filename.replace('_text.txt', '').replace('.txt', '')
-                
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-                
-                # Preprocess the text
-                text = self.preprocess_text(text)
-                
-                # Split into chunks
-                chunks = self.chunk_text(text)
-                
-                if not chunks:
-                    continue
-
-                # Create embeddings for chunks
-                embeddings = self.embedder.encode(chunks)
-                
-                # Normalize embeddings for cosine similarity
-                embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-                
-                # Add to FAISS index
-                self.index.add(embeddings.astype('float32'))
-                
-                # Store documents and metadatas
-                self.documents.extend(chunks)
-                self.metadatas.extend([{"source": source_name} for _ in chunks])
-                
-                total_chunks += len(chunks)
-                print(f"Indexed {len(chunks)} chunks from {source_name}")
-        
-        print(f"\nTotal chunks indexed: {total_chunks}")
-
-        # Persist the index and data to disk
-        self.save_index()
-        print("Index and data persisted to disk successfully!")
-
-    def retrieve(self, query, top_k=3):
-        if self.index.ntotal == 0:
-            return []
-        
-        # Encode and normalize query
-        query_embedding = self.embedder.encode([query])
-        query_embedding = query_embedding / np.linalg.norm(query_embedding, axis=1, keepdims=True)
-        query_embedding = query_embedding.astype('float32')
-        
-        # Search FAISS index
-        distances, indices = self.index.search(query_embedding, top_k)
-        
-        passages = []
-        for dist, idx in zip(distances[0], indices[0]):
-            if idx != -1:  # Valid index
-                relevance = float(dist)  # Inner product is similarity
-                if relevance > 0.3:  # Threshold for relevance
-                    passages.append({
-                        'text': self.documents[idx],
-                        'source': self.metadatas[idx]['source'],
-                        'relevance': relevance
-                    })
-        
-        return passages
-
-if __name__ == "__main__":
-    retriever = ScriptureRetriever()
-    print("Starting indexing of sacred texts...")
-    retriever.index_corpus()
+import os
+import json
+import hashlib
+import tempfile
+import faiss
+import numpy as np
+import re
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from cache import LRUCache, normalize_query
+from passage_store import PassageStore, PassageStoreWriter, store_exists
+from lexical_index import LexicalIndex, LexicalIndexWriter, lexical_index_exists
+from embedders import load_embedder
+from metrics import RequestTimings, request_timings, span
+from chunker import CHUNK_OVERLAP, CHUNK_TOKENS, iter_chunks
+from index_factory import (
+    IndexFeeder, apply_search_params, create_index, make_index_config,
+    parse_index_spec, read_index_meta, supports_removal
+)
+
+# dense:   cosine similarity over the FAISS index (the original behaviour)
+# lexical: BM25 only; skips the embedder, for exact-term lookups
+# hybrid:  reciprocal rank fusion of both candidate lists
+RETRIEVAL_MODES = ('dense', 'lexical', 'hybrid')
+RELEVANCE_THRESHOLD = 0.3     # minimum cosine similarity for a dense hit
+MIN_LEXICAL_COVERAGE = 0.5    # minimum fraction of query terms for a lexical hit
+HYBRID_CANDIDATES = 20        # candidates taken from each side before fusion
+RRF_K = 60
+COMPATIBILITY_PROBES = 8      # stored passages re-embedded on load to check the index
+MIN_SELF_MATCH = 0.75         # fraction of probes that must find their own vector...
+MIN_PROBE_SIMILARITY = 0.8    # ...with at least this similarity
+RETRIEVE_BATCH_SIZE = 256     # queries per encode call / FAISS search in retrieve_batch
+
+def preprocess_text(text):
+    # Remove page markers and unnecessary whitespace
+    text = re.sub(r'--- Page \d+ ---', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP):
+    # Verse/paragraph-aware chunks of at most max_tokens (see chunker.py).
+    # Works on the raw text: boundaries are lost once whitespace is collapsed.
+    return [chunk['text'] for chunk in iter_chunks(text.splitlines(keepends=True), max_tokens, overlap_tokens)]
+
+class PendingQuery:
+    def __init__(self, query, top_k):
+        self.query = query
+        self.top_k = top_k
+        self.future = Future()
+        # The submitting request's timings; the batch's spans are copied there
+        self.timings = request_timings.get()
+
+class QueryBatcher:
+    """
+    Collects queries submitted from concurrent threads and runs them through
+    search_fn as one batch. A batch is dispatched once max_batch_size queries
+    are waiting or max_wait_ms has passed since the first one arrived.
+    submit_future() returns without waiting, so async callers can queue more
+    queries than there are threads to wait on them.
+    """
+
+    def __init__(self, search_fn, max_batch_size=32, max_wait_ms=2.0):
+        self.search_fn = search_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.batched_queries = 0
+        self.worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self.worker.start()
+
+    def submit_future(self, query, top_k):
+        # concurrent.futures.Future, resolved by the batcher thread
+        request = PendingQuery(query, top_k)
+        self.queue.put(request)
+        return request.future
+
+    def submit(self, query, top_k):
+        return self.submit_future(query, top_k).result()
+
+    def close(self):
+        self.queue.put(None)
+        self.worker.join()
+
+    def _collect(self, first):
+        # Queries whose caller gave up (cancelled future) are dropped here;
+        # the rest are marked running and can no longer be cancelled
+        batch = [first] if first.future.set_running_or_notify_cancel() else []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Take whatever is already queued, then wait out the window
+                request = self.queue.get_nowait() if remaining <= 0 else self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            if request.future.set_running_or_notify_cancel():
+                batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            if not batch:
+                continue
+            # The search's spans are collected here, then copied to each request
+            timings = RequestTimings()
+            token = request_timings.set(timings)
+            try:
+                results = self.search_fn([r.query for r in batch], [r.top_k for r in batch])
+            except Exception as e:
+                results, error = None, e
+            finally:
+                request_timings.reset(token)
+            self.record_spans(batch, timings)
+            for n, request in enumerate(batch):
+                if results is None:
+                    request.future.set_exception(error)
+                else:
+                    request.future.set_result(results[n])
+            self.batches += 1
+            self.batched_queries += len(batch)
+
+    def record_spans(self, batch, timings):
+        # Every query waited for the whole batch, so each request is charged
+        # its full embed / index_search time
+        for request in batch:
+            if request.timings is not None:
+                for stage, seconds in timings.spans:
+                    request.timings.add(stage, seconds)
+
+    def info(self):
+        return {
+            'batches': self.batches,
+            'queries': self.batched_queries,
+            'mean_batch_size': self.batched_queries / self.batches if self.batches else 0.0,
+            'queue_depth': self.queue.qsize(),
+        }
+
+class ScriptureRetriever:
+    def __init__(self, batch_queries=False, max_batch_size=32, max_batch_wait_ms=2.0,
+                 index_config=None, search_params=None, retrieval_mode='hybrid',
+                 embedding_backend='torch', embedding_threads=None, data_dir=None,
+                 chunk_tokens=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP):
+        # data_dir holds corpus/ and the index files (default: next to this module)
+        data_dir = data_dir or os.path.dirname(os.path.abspath(__file__))
+        self.CORPUS_DIR = os.path.join(data_dir, 'corpus')
+        self.FAISS_INDEX_FILE = os.path.join(data_dir, 'faiss_index.idx')
+        self.DATA_FILE = os.path.join(data_dir, 'data.pkl')  # legacy, see --migrate-legacy
+        self.PASSAGE_STORE = os.path.join(data_dir, 'passages')
+        self.MANIFEST_FILE = os.path.join(data_dir, 'index_manifest.json')
+        self.INDEX_META_FILE = os.path.join(data_dir, 'faiss_index.meta.json')
+        self.LEXICAL_INDEX = os.path.join(data_dir, 'lexical')
+        self.MODEL_NAME = 'all-MiniLM-L6-v2'
+        
+        # Initialize embedding model. The backend (torch, int8, onnx,
+        # onnx_int8; see embedders.py) only changes how vectors are computed,
+        # and is loaded lazily so importing this module doesn't pull in torch.
+        self.embedding_backend = embedding_backend
+        self.embedding_threads = embedding_threads
+        self.embedder = load_embedder(self.MODEL_NAME, embedding_backend, embedding_threads)
+        
+        # Initialize FAISS index. index_config picks the type built by
+        # index_corpus (see index_factory.py); the type of a loaded index comes
+        # from its metadata file. search_params (nprobe / ef_search) override
+        # the saved search settings at runtime.
+        self.dimension = self.embedder.get_sentence_embedding_dimension()
+        self.index_config = make_index_config(index_config)
+        self.search_params = {k: v for k, v in (search_params or {}).items() if v is not None}
+        self.index_meta = None
+        self.compatibility = None
+        self.index = self.new_index()
+
+        # Chunk size and overlap used by index_corpus; changing them rebuilds the index
+        self.chunking = {'tokens': chunk_tokens, 'overlap': chunk_overlap}
+        
+        # Memory-mapped passage text and metadata, keyed by chunk id (the FAISS vector id)
+        self.passages = PassageStore.empty()
+
+        # BM25 index over the same chunk ids. Sanskrit names and transliterations
+        # often score below the cosine threshold but match exactly on terms.
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}', expected one of {', '.join(RETRIEVAL_MODES)}")
+        self.retrieval_mode = retrieval_mode
+        self.lexical = LexicalIndex.empty()
+
+        # Query caches: normalized query -> embedding, (query, top_k) -> passages.
+        # index_version is bumped whenever the index changes so that callers
+        # holding derived caches (e.g. answers) know to drop them.
+        self.embedding_cache = LRUCache(max_entries=4096, max_bytes=32 * 1024 * 1024)
+        self.retrieval_cache = LRUCache(max_entries=2048, max_bytes=16 * 1024 * 1024)
+        self.index_version = 0
+
+        # Optional micro-batching of concurrent retrieve() calls
+        self.batcher = None
+        if batch_queries:
+            self.batcher = QueryBatcher(self.search_batch, max_batch_size, max_batch_wait_ms)
+        
+        # Load existing index if available
+        self.load_index()
+
+    def preprocess_text(self, text):
+        return preprocess_text(text)
+
+    def chunk_text(self, text):
+        return chunk_text(text, self.chunking['tokens'], self.chunking['overlap'])
+
+    def new_index(self):
+        # Inner product for cosine similarity; vectors are added under chunk
+        # ids so a single file's vectors can be dropped when it changes
+        return create_index(self.index_config, self.dimension)
+
+    def load_index(self):
+        if not os.path.exists(self.FAISS_INDEX_FILE):
+            return
+        if not store_exists(self.PASSAGE_STORE) and os.path.exists(self.DATA_FILE):
+            # Never unpickled here: the server must not load pickles at startup
+            print(f"Found legacy {self.DATA_FILE} but no passage store; run "
+                  "'python scripture_retriever.py --migrate-legacy' or re-index. Starting without an index.")
+            return
+        if store_exists(self.PASSAGE_STORE):
+            self.index = faiss.read_index(self.FAISS_INDEX_FILE)
+            if os.path.exists(self.INDEX_META_FILE):
+                self.index_meta = read_index_meta(self.INDEX_META_FILE)
+            else:
+                # Indexes written before index types were configurable are flat
+                self.index_meta = None
+            self.set_search_params()
+            self.passages.close()
+            self.passages = PassageStore.open(self.PASSAGE_STORE)
+            self.lexical.close()
+            if lexical_index_exists(self.LEXICAL_INDEX):
+                self.lexical = LexicalIndex.open(self.LEXICAL_INDEX)
+            else:
+                print("No lexical index found; run indexing to build it. Using dense retrieval only.")
+            self.check_index_compatibility()
+            self.invalidate_caches()
+            print("Loaded existing FAISS index and data.")
+
+    def migrate_legacy_data(self):
+        # One-time, offline conversion of the pickled (documents, metadatas)
+        # written by older versions (--migrate-legacy). Only run it on a
+        # data.pkl you trust: unpickling can execute arbitrary code.
+        import pickle
+        print(f"Converting {self.DATA_FILE} to the memory-mapped passage store...")
+        with open(self.DATA_FILE, 'rb') as f:
+            documents, metadatas = pickle.load(f)
+        if isinstance(documents, list):
+            # Older data files store chunks by position
+            documents = dict(enumerate(documents))
+            metadatas = dict(enumerate(metadatas))
+        writer = PassageStoreWriter(self.PASSAGE_STORE)
+        try:
+            for chunk_id in sorted(documents):
+                writer.add(chunk_id, documents[chunk_id], metadatas[chunk_id])
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def check_index_compatibility(self):
+        # An index is only usable if its vectors live in the same space as
+        # the query embedder's. Beyond matching model and dimension, a few
+        # stored passages are re-embedded with the current backend and must
+        # find their own vectors; this catches a different model or a
+        # quantized backend that drifted too far from the one that built it.
+        meta = self.index_meta or {}
+        report = {
+            'embedding_backend': self.embedding_backend,
+            'index_backend': meta.get('embedding_backend', 'torch'),
+            'self_match': None,
+            'mean_similarity': None,
+        }
+        reason = None
+        if self.index.d != self.dimension:
+            reason = f"index dimension {self.index.d} != embedding dimension {self.dimension}"
+        elif meta.get('model', self.MODEL_NAME) != self.MODEL_NAME:
+            reason = f"index was built with {meta['model']}, not {self.MODEL_NAME}"
+        elif self.index.ntotal and len(self.passages):
+            rows = np.unique(np.linspace(0, len(self.passages) - 1, COMPATIBILITY_PROBES).astype('int64'))
+            ids = [int(self.passages.ids[row]) for row in rows]
+            vectors = self.embedder.encode([self.passages.get(chunk_id)[0] for chunk_id in ids])
+            vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype('float32')
+            scores, found = self.index.search(vectors, 5)
+            similarities = [float(s[list(f).index(i)]) if i in f else 0.0 for i, s, f in zip(ids, scores, found)]
+            matched = sum(similarity >= MIN_PROBE_SIMILARITY for similarity in similarities)
+            report['self_match'] = matched / len(ids)
+            report['mean_similarity'] = float(np.mean(similarities))
+            if report['self_match'] < MIN_SELF_MATCH:
+                reason = (f"only {matched} of {len(ids)} re-embedded passages found their own vectors "
+                          f"with the {self.embedding_backend} backend")
+        self.compatibility = dict(report, compatible=reason is None, reindex_required=reason is not None, reason=reason)
+        if reason is not None:
+            print(f"WARNING: the FAISS index is not compatible with the query embedder ({reason}). "
+                  f"Re-index with: python scripture_retriever.py --full")
+        return self.compatibility
+
+    def set_search_params(self, **params):
+        # Runtime-tunable nprobe (IVF) / ef_search (HNSW)
+        self.search_params.update({k: v for k, v in params.items() if v is not None})
+        config = make_index_config(self.index_meta or {'type': 'flat'}, **self.search_params)
+        apply_search_params(self.index, config)
+        self.retrieval_cache.clear()
+
+    def index_info(self):
+        return {
+            'type': (self.index_meta or {'type': 'flat'})['type'],
+            'ntotal': self.index.ntotal,
+            'search_params': dict(self.search_params),
+            'retrieval_mode': self.retrieval_mode,
+            'compatibility': self.compatibility,
+            'lexical_chunks': len(self.lexical),
+            'lexical_terms': len(self.lexical.terms),
+        }
+
+    def invalidate_caches(self):
+        self.retrieval_cache.clear()
+        self.index_version += 1
+
+    def cache_info(self):
+        return {
+            'embedding': self.embedding_cache.info(),
+            'retrieval': self.retrieval_cache.info(),
+            'batching': self.batcher.info() if self.batcher is not None else None,
+            'index_version': self.index_version,
+        }
+
+    def load_manifest(self):
+        # The manifest is only trusted if it describes the index we actually
+        # loaded, and that index is of the type we are asked to build
+        if not os.path.exists(self.MANIFEST_FILE) or self.index_meta is None:
+            return None
+        if self.compatibility is not None and self.compatibility['reindex_required']:
+            print("Index is not compatible with the embedder, rebuilding.")
+            return None
+        if self.index_meta['type'] != self.index_config['type']:
+            print(f"Index type changed ({self.index_meta['type']} -> {self.index_config['type']}), rebuilding.")
+            return None
+        with open(self.MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if (manifest.get('model') != self.MODEL_NAME or manifest.get('ntotal') != self.index.ntotal
+                or len(self.passages) != self.index.ntotal):
+            print("Index manifest does not match the loaded index, rebuilding.")
+            return None
+        if manifest.get('chunking') != self.chunking:
+            print("Chunking settings changed, rebuilding.")
+            return None
+        return manifest
+
+    def write_atomic(self, path, write):
+        # Write to a temp file in the same directory, then rename over the target
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def dump_json(self, data, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+    def save_index(self, manifest=None):
+        self.write_atomic(self.FAISS_INDEX_FILE, lambda path: faiss.write_index(self.index, path))
+        if self.index_meta is not None:
+            meta = dict(self.index_meta, dimension=self.dimension, model=self.MODEL_NAME,
+                        embedding_backend=self.embedding_backend)
+            self.write_atomic(self.INDEX_META_FILE, lambda path: self.dump_json(meta, path))
+        if manifest is not None:
+            # Written last: a crash before this point leaves a manifest whose
+            # ntotal no longer matches, which forces a clean rebuild
+            self.save_manifest(manifest)
+        print("FAISS index and data saved to disk.")
+
+    def save_manifest(self, manifest):
+        manifest['ntotal'] = self.index.ntotal
+        self.write_atomic(self.MANIFEST_FILE, lambda path: self.dump_json(manifest, path))
+
+    def file_digest(self, file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def remove_file(self, filename, manifest):
+        # Drops the file's vectors; its passages are left out when the store is rewritten
+        start, end = manifest['files'].pop(filename)['ids']
+        if end > start:
+            self.index.remove_ids(np.arange(start, end, dtype='int64'))
+        print(f"Removed {end - start} chunks from {filename}")
+        return start, end
+
+    def plan_corpus_changes(self, manifest, filenames):
+        # Returns (deleted, changed, to_index): files gone from the corpus,
+        # files whose content changed, and (filename, path, digest, stat) for
+        # every file that needs embedding
+        deleted = [f for f in manifest['files'] if f not in filenames]
+        changed = []
+        to_index = []
+        for filename in filenames:
+            file_path = os.path.join(self.CORPUS_DIR, filename)
+            stat = os.stat(file_path)
+            entry = manifest['files'].get(filename)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+
+            digest = self.file_digest(file_path)
+            if entry and entry['sha256'] == digest:
+                # Touched but unchanged
+                entry['mtime'] = stat.st_mtime
+                continue
+            if entry:
+                changed.append(filename)
+            to_index.append((filename, file_path, digest, stat))
+        return deleted, changed, to_index
+
+    def embed_files(self, files, manifest, feeder, writer, lexical_writer, workers, batch_size):
+        # Stream the changed files through the (parallel) embedding pipeline.
+        # Results arrive in file order, so each file gets a contiguous id range.
+        # The feeder trains IVF/PQ indexes on the first batches before adding.
+        from index_builder import IndexBuilder
+
+        builder = IndexBuilder(self.MODEL_NAME, embedder=self.embedder, workers=workers, batch_size=batch_size,
+                               backend=self.embedding_backend, chunk_tokens=self.chunking['tokens'],
+                               chunk_overlap=self.chunking['overlap'])
+        total_chunks = 0
+        current_file = None
+        for filename, source_name, chunks, embeddings in builder.embed_files(files):
+            entry = manifest['files'][filename]
+            start = manifest['next_id']
+            if filename != current_file:
+                current_file = filename
+                entry['ids'] = [start, start]
+            if chunks:
+                ids = np.arange(start, start + len(chunks), dtype='int64')
+                feeder.add(embeddings, ids)
+                for chunk_id, chunk in zip(ids.tolist(), chunks):
+                    writer.add(chunk_id, chunk['text'], dict(chunk, source=source_name))
+                    lexical_writer.add(chunk_id, chunk['text'])
+                manifest['next_id'] = start + len(chunks)
+                entry['ids'][1] = manifest['next_id']
+                total_chunks += len(chunks)
+        return total_chunks
+
+    def index_corpus(self, full_rebuild=False, workers=None, batch_size=64):
+        # Incremental: only new or changed files are embedded, and the vectors
+        # of changed or deleted files are removed from the index
+        filenames = sorted(f for f in os.listdir(self.CORPUS_DIR) if f.endswith('.txt'))
+        manifest = None if full_rebuild else self.load_manifest()
+        if manifest is not None:
+            deleted, changed, to_index = self.plan_corpus_changes(manifest, filenames)
+            if (deleted or changed) and not supports_removal(self.index_meta):
+                print(f"{self.index_meta['type']} indexes cannot remove vectors, rebuilding.")
+                manifest = None
+        if manifest is None:
+            self.index = None
+            self.index_meta = None
+            self.passages.close()
+            self.passages = PassageStore.empty()
+            self.lexical.close()
+            manifest = {'model': self.MODEL_NAME, 'chunking': self.chunking, 'next_id': 0, 'files': {}}
+            deleted, changed, to_index = self.plan_corpus_changes(manifest, filenames)
+
+        # Indexes built before the lexical index existed get one from the stored passages
+        rebuild_lexical = not lexical_index_exists(self.LEXICAL_INDEX) or len(self.lexical) != len(self.passages)
+
+        if not (deleted or to_index or rebuild_lexical):
+            print("Corpus unchanged, nothing to index.")
+            self.save_manifest(manifest)
+            return
+
+        removed = [self.remove_file(filename, manifest) for filename in deleted + changed]
+
+        # The passage store is rewritten: surviving passages are copied over
+        # first (all new chunk ids are larger), then new chunks are streamed
+        # in as they are embedded, so chunk text is never held in memory.
+        # The lexical index keeps its surviving postings and appends new chunks.
+        writer = PassageStoreWriter(self.PASSAGE_STORE)
+        lexical_writer = LexicalIndexWriter(base=None if rebuild_lexical else self.lexical, removed=removed)
+        for chunk_id, data, metadata in self.passages.iter_raw():
+            if not any(start <= chunk_id < end for start, end in removed):
+                writer.add_raw(chunk_id, data, metadata)
+                if rebuild_lexical:
+                    lexical_writer.add(chunk_id, data.decode('utf-8'))
+        self.passages.close()
+        self.lexical.close()
+
+        for filename, _, digest, stat in to_index:
+            manifest['files'][filename] = {
+                'sha256': digest,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'ids': [manifest['next_id'], manifest['next_id']],
+            }
+
+        files = [(filename, file_path, filename.replace('_text.txt', '').replace('.txt', ''))
+                 for filename, file_path, _, _ in to_index]
+        feeder = IndexFeeder(self.index_meta or self.index_config, self.dimension, self.index)
+        try:
+            total_chunks = self.embed_files(files, manifest, feeder, writer, lexical_writer, workers, batch_size)
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+        lexical_writer.commit(self.LEXICAL_INDEX)
+        self.index = feeder.finish()
+        self.index_meta = dict(feeder.config)
+        self.set_search_params()
+        self.passages = PassageStore.open(self.PASSAGE_STORE)
+        self.lexical = LexicalIndex.open(self.LEXICAL_INDEX)
+        print(f"Lexical index holds {len(self.lexical)} chunks, {len(self.lexical.terms)} terms")
+        self.check_index_compatibility()
+
+        for filename, _, _ in files:
+            start, end = manifest['files'][filename]['ids']
+            print(f"Indexed {end - start} chunks from {filename}")
+
+        print(f"\nTotal chunks indexed: {total_chunks} (index now holds {self.index.ntotal})")
+        self.invalidate_caches()
+
+        # Persist the index, data and manifest to disk
+        self.save_index(manifest)
+        print("Index and data persisted to disk successfully!")
+
+    def warm_up(self):
+        # One search end to end, so the first real query doesn't pay for
+        # lazy kernel initialization and cold index / passage pages
+        if self.index.ntotal:
+            self.search_batch(['dharma'], [1])
+        else:
+            self.embed_query('dharma')
+
+    def embed_queries(self, queries):
+        # Encode and normalize queries as one batch, reusing cached vectors for repeated questions
+        keys = [normalize_query(q) for q in queries]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, emb in zip(keys, embeddings) if emb is None))
+        if missing:
+            encoded = self.embedder.encode(missing)
+            encoded = encoded / np.linalg.norm(encoded, axis=1, keepdims=True)
+            encoded = dict(zip(missing, encoded.astype('float32')))
+            for key, embedding in encoded.items():
+                self.embedding_cache.set(key, embedding)
+            embeddings = [encoded[key] if emb is None else emb for key, emb in zip(keys, embeddings)]
+        return np.vstack(embeddings).astype('float32')
+
+    def embed_query(self, query):
+        return self.embed_queries([query])[0]
+
+    def passage(self, chunk_id, **scores):
+        # source, plus verse / page / start / end when the store has them
+        text, metadata = self.passages.get(int(chunk_id))
+        return dict({'text': text}, **metadata, **scores)
+
+    def search_batch(self, queries, top_ks, mode=None):
+        # One encode call and one FAISS search for the whole batch; each row
+        # is then cut down to its own top_k (or fused with BM25 in hybrid mode)
+        mode = mode or self.retrieval_mode
+        if mode == 'lexical':
+            return [self.search_lexical(query, top_k) for query, top_k in zip(queries, top_ks)]
+        hybrid = mode == 'hybrid' and len(self.lexical) > 0
+        with span('embed'):
+            query_embeddings = self.embed_queries(queries)
+        depth = max(max(top_ks), HYBRID_CANDIDATES) if hybrid else max(top_ks)
+        with span('index_search'):
+            distances, indices = self.index.search(query_embeddings, depth)
+
+        if hybrid:
+            return [self.fuse(query, distances[row], indices[row], top_k)
+                    for row, (query, top_k) in enumerate(zip(queries, top_ks))]
+
+        # Dense: rank, validity and threshold checks for the whole batch at
+        # once (inner product is the cosine similarity)
+        within_top_k = np.arange(depth)[None, :] < np.asarray(top_ks)[:, None]
+        keep = within_top_k & (indices != -1) & (distances > RELEVANCE_THRESHOLD)
+        return [
+            [self.passage(idx, relevance=float(dist)) for dist, idx in zip(distances[row][keep[row]], indices[row][keep[row]])]
+            for row in range(len(queries))
+        ]
+
+    def search_lexical(self, query, top_k):
+        with span('lexical_search'):
+            ids, scores, coverage = self.lexical.search(query, top_k)
+        return [
+            self.passage(chunk_id, relevance=0.0, lexical_score=float(score), score=float(score))
+            for chunk_id, score, covered in zip(ids, scores, coverage)
+            if covered >= MIN_LEXICAL_COVERAGE
+        ]
+
+    def fuse(self, query, distances, indices, top_k):
+        # Reciprocal rank fusion: score = sum of 1 / (RRF_K + rank) over the
+        # dense and BM25 lists. A passage is kept if either side is confident
+        # about it, so exact-name matches survive a low cosine score.
+        dense = {int(idx): float(dist) for dist, idx in zip(distances, indices) if idx != -1}
+        with span('lexical_search'):
+            ids, scores, coverage = self.lexical.search(query, HYBRID_CANDIDATES)
+        lexical = {int(idx): (float(score), float(covered)) for idx, score, covered in zip(ids, scores, coverage)}
+
+        fused = {}
+        for ranking in (dense, lexical):
+            for rank, chunk_id in enumerate(ranking, 1):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+
+        passages = []
+        for chunk_id in sorted(fused, key=fused.get, reverse=True):
+            relevance = dense.get(chunk_id, 0.0)
+            lexical_score, covered = lexical.get(chunk_id, (0.0, 0.0))
+            if relevance > RELEVANCE_THRESHOLD or covered >= MIN_LEXICAL_COVERAGE:
+                passages.append(self.passage(chunk_id, relevance=relevance,
+                                             lexical_score=lexical_score, score=fused[chunk_id]))
+                if len(passages) == top_k:
+                    break
+        return passages
+
+    def retrieve(self, query, top_k=3, mode=None):
+        if self.index.ntotal == 0:
+            return []
+
+        mode = mode or self.retrieval_mode
+        cache_key = (normalize_query(query), top_k, mode)
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            return [dict(p) for p in cached]
+
+        if mode == 'lexical':
+            # No embedding needed
+            passages = self.search_lexical(query, top_k)
+        elif self.batcher is not None and mode == self.retrieval_mode:
+            passages = self.batcher.submit(query, top_k)
+        else:
+            passages = self.search_batch([query], [top_k], mode)[0]
+
+        self.retrieval_cache.set(cache_key, [dict(p) for p in passages])
+        return passages
+
+    def retrieve_future(self, query, top_k=3):
+        # retrieve() without blocking the caller while the query waits for
+        # its batch: returns a concurrent.futures.Future resolved by the
+        # batcher thread (needs batch_queries=True)
+        cache_key = (normalize_query(query), top_k, self.retrieval_mode)
+        cached = [] if self.index.ntotal == 0 else self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            future = Future()
+            future.set_result([dict(p) for p in cached])
+            return future
+
+        def cache_result(future):
+            if not future.cancelled() and future.exception() is None:
+                self.retrieval_cache.set(cache_key, [dict(p) for p in future.result()])
+
+        future = self.batcher.submit_future(query, top_k)
+        future.add_done_callback(cache_result)
+        return future
+
+    def retrieve_batch(self, queries, top_k=3, mode=None):
+        # retrieve() for many queries: cached and repeated queries are looked
+        # up once, the rest go through search_batch RETRIEVE_BATCH_SIZE at a
+        # time (one encode call and one FAISS search each). Returns one
+        # passage list per query, in order.
+        if self.index.ntotal == 0:
+            return [[] for _ in queries]
+
+        mode = mode or self.retrieval_mode
+        keys = [(normalize_query(query), top_k, mode) for query in queries]
+        found = {}
+        missing = {}
+        for key, query in zip(keys, queries):
+            if key in found or key in missing:
+                continue
+            cached = self.retrieval_cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                missing[key] = query
+
+        missing = list(missing.items())
+        for start in range(0, len(missing), RETRIEVE_BATCH_SIZE):
+            batch = missing[start:start + RETRIEVE_BATCH_SIZE]
+            results = self.search_batch([query for _, query in batch], [top_k] * len(batch), mode)
+            for (key, _), passages in zip(batch, results):
+                self.retrieval_cache.set(key, [dict(p) for p in passages])
+                found[key] = passages
+        return [[dict(p) for p in found[key]] for key in keys]
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Index the scripture corpus")
+    parser.add_argument('--full', action='store_true', help="rebuild from scratch instead of incrementally")
+    parser.add_argument('--workers', type=int, default=None, help="embedding processes (default: CPU count, 1 = in-process)")
+    parser.add_argument('--batch-size', type=int, default=64, help="chunks per encode batch")
+    parser.add_argument('--index-type', default='flat',
+                        help="flat, ivf_flat, ivf_pq, opq_ivf_pq or hnsw, optionally with parameters, "
+                             "e.g. 'ivf_pq:nlist=4096,pq_m=48,nprobe=32'")
+    parser.add_argument('--embedding-backend', default='torch', help="torch, int8, onnx or onnx_int8")
+    parser.add_argument('--embedding-threads', type=int, default=None, help="threads per embedding process")
+    parser.add_argument('--chunk-tokens', type=int, default=CHUNK_TOKENS, help="maximum tokens per chunk")
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP,
+                        help="tokens of the previous chunk repeated at the start of the next")
+    parser.add_argument('--migrate-legacy', action='store_true',
+                        help="convert a trusted legacy data.pkl to the passage store and exit")
+    parser.add_argument('--data-dir', default=None, help="directory holding corpus/ and the index (default: this directory)")
+    args = parser.parse_args()
+
+    retriever = ScriptureRetriever(index_config=parse_index_spec(args.index_type),
+                                   embedding_backend=args.embedding_backend,
+                                   embedding_threads=args.embedding_threads,
+                                   data_dir=args.data_dir,
+                                   chunk_tokens=args.chunk_tokens,
+                                   chunk_overlap=args.chunk_overlap)
+    if args.migrate_legacy:
+        if store_exists(retriever.PASSAGE_STORE):
+            print("Passage store already exists; nothing to migrate.")
+        elif not os.path.exists(retriever.DATA_FILE):
+            print(f"No legacy {retriever.DATA_FILE} found.")
+        else:
+            retriever.migrate_legacy_data()
+            retriever.load_index()
+            print("Migration complete.")
+        raise SystemExit(0)
+    print("Starting indexing of sacred texts...")
+    retriever.index_corpus(full_rebuild=args.full, workers=args.workers, batch_size=args.batch_size)
     print("Indexing complete! The system is ready for queries.")
\ No newline at end of file
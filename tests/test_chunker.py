@@ -0,0 +1,44 @@
+from chunker import iter_chunks
+from tokens import estimate_tokens
+
+GITA = (
+    "--- Page 12 ---\n"
+    "2.47 karmaṇy evādhikāras te mā phaleṣu kadācana\n"
+    "mā karma-phala-hetur bhūr mā te saṅgo 'stv akarmaṇi ॥ 47 ॥\n"
+    "\n"
+    "You have a right to perform your prescribed duty, but not to the fruits of action.\n"
+    "\n"
+    "yoga-sthaḥ kuru karmāṇi saṅgaṁ tyaktvā dhanañjaya ॥ ४८ ॥\n"
+)
+
+
+def chunks_of(text, max_tokens=160, overlap_tokens=32):
+    return list(iter_chunks(text.splitlines(keepends=True), max_tokens, overlap_tokens))
+
+
+def test_verses_pages_and_offsets():
+    chunks = chunks_of(GITA, max_tokens=30, overlap_tokens=0)
+    assert [c['verse'] for c in chunks] == ['2.47', None, '48']
+    assert all(c['page'] == 12 for c in chunks)
+    for chunk in chunks:
+        assert ' '.join(GITA[chunk['start']:chunk['end']].split()) == ' '.join(chunk['text'].split())
+
+
+def test_unbroken_runs_stay_within_max_tokens():
+    for text in ('x' * 5000 + ' tail words here\n', 'word ' * 3000 + '\n'):
+        chunks = chunks_of(text)
+        assert len(chunks) > 1
+        assert max(estimate_tokens(c['text']) for c in chunks) <= 160
+
+
+def test_overlap_with_sentences_longer_than_the_overlap():
+    # ~190-character sentences, one paragraph: no sentence fits in 32 tokens
+    sentence = "The sage spoke of dharma and karma to the king beside the river, and of the fire of truth that burns in every devoted heart, until the night fell on the forest."
+    prose = '\n'.join([sentence] * 40) + '\n'
+    for text in (prose, 'word ' * 3000 + '\n'):
+        chunks = chunks_of(text)
+        pairs = list(zip(chunks, chunks[1:]))
+        assert pairs and all(b['start'] < a['end'] for a, b in pairs)
+        assert max(estimate_tokens(c['text']) for c in chunks) <= 160
+        for a, b in pairs:
+            assert estimate_tokens(text[b['start']:a['end']]) <= 32 + 1
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+
+from fallback_generator import BatchStreamer, FallbackGenerator, FallbackRequest
+
+EOS = 0
+
+
+class FakeTokenizer:
+    pad_token = None
+    eos_token = '<eos>'
+    eos_token_id = EOS
+    pad_token_id = EOS
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return ''.join(chr(token) for token in tokens)
+
+
+class ScriptedGenerator(FallbackGenerator):
+    """Streams each prompt back through BatchStreamer instead of running a model."""
+
+    def __init__(self, **kwargs):
+        super().__init__(SimpleNamespace(config=SimpleNamespace(n_positions=1024)), FakeTokenizer(), **kwargs)
+
+    def generate_batch(self, batch):
+        streamer = BatchStreamer(self.tokenizer, batch, EOS)
+        width = max(len(request.prompt) for request in batch)
+        streamer.put(np.zeros((len(batch), width)))
+        for step in range(width + 1):
+            streamer.put(np.array([[ord(r.prompt[step]) if step < len(r.prompt) else EOS] for r in batch]))
+
+
+def closed_loop_request(prompt):
+    loop = asyncio.new_event_loop()
+    loop.close()
+    return FallbackRequest(prompt, loop)
+
+
+def test_closed_loop_does_not_take_down_the_batch_or_the_worker():
+    generator = ScriptedGenerator(max_batch_size=4, max_wait_ms=200.0)
+    try:
+        generator.queue.put(closed_loop_request("gone"))
+
+        async def run():
+            first = await asyncio.wait_for(generator.generate("dharma"), 5.0)
+            # The worker survived and still serves later batches
+            second = await asyncio.wait_for(generator.generate("karma"), 5.0)
+            return first, second
+
+        assert asyncio.run(run()) == ("dharma", "karma")
+        assert generator.worker.is_alive()
+        assert generator.batches == 2
+    finally:
+        generator.close()
+
+
+def test_failing_collect_keeps_the_worker_alive():
+    generator = ScriptedGenerator(max_wait_ms=1.0)
+    try:
+        collect = generator._collect
+
+        def broken_collect(first):
+            generator._collect = collect
+            raise RuntimeError("broken")
+
+        generator._collect = broken_collect
+
+        async def run():
+            try:
+                await asyncio.wait_for(generator.generate("first"), 5.0)
+            except RuntimeError as e:
+                failed = str(e)
+            return failed, await asyncio.wait_for(generator.generate("second"), 5.0)
+
+        assert asyncio.run(run()) == ("broken", "second")
+        assert generator.worker.is_alive()
+    finally:
+        generator.close()
+
+
+def test_emitting_to_a_closed_loop_marks_the_request_cancelled():
+    request = closed_loop_request("gone")
+    streamer = BatchStreamer(FakeTokenizer(), [request], EOS)
+    streamer.put(np.zeros((1, 1)))
+    streamer.put(np.array([[ord('a')]]))
+    assert request.cancelled
+    assert streamer.finished == [True]
@@ -0,0 +1,212 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_client import (
+    CircuitBreaker, CircuitOpenError, FakeGenerativeModel, FakeRateLimitError, GeminiClient,
+    RateLimitedError, TokenBucket
+)
+
+
+class ScriptedModel(FakeGenerativeModel):
+    """FakeGenerativeModel that raises the given errors on its first calls."""
+
+    def __init__(self, errors, **kwargs):
+        super().__init__(latency=0.01, **kwargs)
+        self.errors = list(errors)
+
+    async def generate_content_async(self, prompt, stream=False):
+        if self.errors:
+            self.calls += 1
+            raise self.errors.pop(0)
+        return await super().generate_content_async(prompt, stream)
+
+
+def make_client(model, **kwargs):
+    kwargs.setdefault('breaker', CircuitBreaker(failure_threshold=3, reset_timeout=0.05))
+    return GeminiClient(model, timeout=5.0, **kwargs)
+
+
+async def collect(stream):
+    return ''.join([text async for text in stream])
+
+
+def test_concurrent_identical_prompts_share_one_call():
+    model = FakeGenerativeModel(latency=0.05)
+    client = make_client(model)
+
+    async def run():
+        return await asyncio.gather(*[client.generate("What is dharma?") for _ in range(10)])
+
+    answers = asyncio.run(run())
+    assert model.calls == 1
+    assert len(set(answers)) == 1
+    assert client.coalesced == 9
+    assert client.inflight == {}
+
+
+def test_failed_call_is_not_kept_in_flight():
+    model = ScriptedModel([RuntimeError("boom")])
+    client = make_client(model)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await client.generate("karma")
+        assert client.inflight == {}
+        return await client.generate("karma")
+
+    assert asyncio.run(run())
+    assert model.calls == 2
+
+
+def test_consecutive_failures_open_the_breaker():
+    model = FakeGenerativeModel(latency=0.01, fail_rate=1.0)
+    client = make_client(model)
+
+    async def run():
+        for n in range(3):
+            with pytest.raises(RuntimeError):
+                await client.generate(f"question {n}")
+        with pytest.raises(CircuitOpenError):
+            await client.generate("question 3")
+
+    asyncio.run(run())
+    assert model.calls == 3
+    assert client.breaker.state == 'open'
+    assert client.short_circuited == 1
+
+
+def test_half_open_trial_closes_or_reopens():
+    model = FakeGenerativeModel(latency=0.01, fail_rate=1.0)
+    client = make_client(model)
+
+    async def run():
+        for n in range(3):
+            with pytest.raises(RuntimeError):
+                await client.generate(f"question {n}")
+        await asyncio.sleep(0.06)
+        # After reset_timeout one trial goes through; it fails, so the circuit re-opens
+        with pytest.raises(RuntimeError):
+            await client.generate("trial 1")
+        assert client.breaker.state == 'open'
+        await asyncio.sleep(0.06)
+        model.fail_rate = 0.0
+        return await client.generate("trial 2")
+
+    assert asyncio.run(run())
+    assert client.breaker.state == 'closed'
+    assert client.breaker.failures == 0
+
+
+def test_half_open_lets_one_trial_through_at_a_time():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+
+
+def test_refused_call_gives_its_rate_limit_token_back():
+    limiter = TokenBucket(rate=0.001, capacity=1)
+    client = make_client(FakeGenerativeModel(latency=0.01), limiter=limiter)
+    # A trial is already running, so the breaker refuses after the limiter admitted us
+    client.breaker.state = 'half_open'
+    client.breaker.trial_started = time.monotonic()
+
+    async def run():
+        with pytest.raises(CircuitOpenError):
+            await client.generate("karma")
+
+    asyncio.run(run())
+    assert limiter.tokens == pytest.approx(1.0, abs=0.01)
+
+
+def test_token_limit_rejection_releases_request_token_and_trial():
+    limiter = TokenBucket(rate=0.001, capacity=1)
+    token_limiter = TokenBucket(rate=0.001, capacity=1000)
+    token_limiter.tokens = 0
+    model = FakeGenerativeModel(latency=0.01)
+    client = make_client(model, limiter=limiter, token_limiter=token_limiter)
+    # The circuit is ready for a half-open trial
+    client.breaker.state = 'open'
+    client.breaker.opened_at = time.monotonic() - 1.0
+
+    async def run():
+        with pytest.raises(RateLimitedError):
+            await client.generate("karma")
+
+    asyncio.run(run())
+    assert model.calls == 0
+    assert limiter.tokens == pytest.approx(1.0, abs=0.01)
+    assert token_limiter.rejections == 1
+    # The trial was not claimed, so the next admitted call can take it
+    assert client.breaker.state == 'open'
+    assert client.breaker.allow()
+
+
+def test_limiter_rejects_instead_of_queueing_too_long():
+    limiter = TokenBucket(rate=1.0, capacity=1)
+
+    async def run():
+        await limiter.acquire(1)
+        with pytest.raises(RateLimitedError):
+            await limiter.acquire(1, max_wait=0.1)
+
+    asyncio.run(run())
+    assert limiter.rejections == 1
+
+
+def test_short_rate_limit_delays_are_retried():
+    model = ScriptedModel([FakeRateLimitError(0.01)])
+    client = make_client(model, max_retry_delay=2.0)
+    assert asyncio.run(client.generate("moksha"))
+    assert model.calls == 2
+    assert client.rate_limited == 1
+
+
+def test_long_rate_limit_delays_go_to_the_fallback():
+    # The error reaches the caller (which answers with the fallback) without waiting
+    model = ScriptedModel([FakeRateLimitError(30)])
+    client = make_client(model, max_retry_delay=2.0)
+    started = time.monotonic()
+    with pytest.raises(FakeRateLimitError):
+        asyncio.run(client.generate("moksha"))
+    assert time.monotonic() - started < 1.0
+    assert model.calls == 1
+
+
+def test_late_stream_subscriber_replays_missed_chunks():
+    model = FakeGenerativeModel(latency=0.1, chunks=8)
+    client = make_client(model)
+
+    async def late():
+        await asyncio.sleep(0.05)
+        return await collect(client.stream("Who was Prahlada?"))
+
+    async def run():
+        return await asyncio.gather(collect(client.stream("Who was Prahlada?")), late())
+
+    first, second = asyncio.run(run())
+    assert first == second == model.answer("Who was Prahlada?")
+    assert model.calls == 1
+    assert client.coalesced == 1
+    assert client.streams == {}
+
+
+def test_stream_is_cancelled_when_every_subscriber_leaves():
+    model = FakeGenerativeModel(latency=1.0, chunks=10)
+    client = make_client(model)
+
+    async def run():
+        stream = client.stream("What is om?")
+        assert await stream.__anext__()
+        producer = client.streams["What is om?"].producer
+        await stream.aclose()
+        await asyncio.wait([producer], timeout=1.0)
+        assert producer.cancelled()
+        assert client.streams == {}
+
+    asyncio.run(run())
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+from scripture_retriever import QueryBatcher
+
+
+def echo_search(sizes, delay=0.01):
+    def search(queries, top_ks):
+        sizes.append(len(queries))
+        time.sleep(delay)
+        return [[{'text': query, 'top_k': top_k}] for query, top_k in zip(queries, top_ks)]
+    return search
+
+
+def test_async_submissions_batch_past_thread_count():
+    # Awaiting futures ties up no threads, so a batch can hold every query
+    # that arrived while the previous one ran
+    sizes = []
+    batcher = QueryBatcher(echo_search(sizes), max_batch_size=32, max_wait_ms=2.0)
+
+    async def run():
+        return await asyncio.gather(*[asyncio.wrap_future(batcher.submit_future(f"q{i}", 3)) for i in range(64)])
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        batcher.close()
+    assert [r[0]['text'] for r in results] == [f"q{i}" for i in range(64)]
+    assert sum(sizes) == 64
+    assert max(sizes) > 4
+
+
+def test_submit_blocks_for_its_result():
+    batcher = QueryBatcher(echo_search([]), max_batch_size=4, max_wait_ms=1.0)
+    try:
+        assert batcher.submit("dharma", 2) == [{'text': 'dharma', 'top_k': 2}]
+    finally:
+        batcher.close()
+
+
+def test_errors_reach_every_query_in_the_batch():
+    def failing(queries, top_ks):
+        raise RuntimeError("index gone")
+
+    batcher = QueryBatcher(failing, max_batch_size=8, max_wait_ms=5.0)
+    try:
+        futures = [batcher.submit_future(f"q{i}", 1) for i in range(3)]
+        for future in futures:
+            assert isinstance(future.exception(timeout=5), RuntimeError)
+    finally:
+        batcher.close()
+
+
+def test_cancelled_queries_are_not_searched():
+    sizes = []
+    release = threading.Event()
+
+    def slow(queries, top_ks):
+        sizes.append(len(queries))
+        release.wait(5)
+        return [[] for _ in queries]
+
+    batcher = QueryBatcher(slow, max_batch_size=8, max_wait_ms=1.0)
+    try:
+        first = batcher.submit_future("busy", 1)
+        time.sleep(0.05)  # the batcher is now inside slow()
+        cancelled = batcher.submit_future("gone", 1)
+        kept = batcher.submit_future("kept", 1)
+        assert cancelled.cancel()
+        release.set()
+        assert first.result(timeout=5) == [] and kept.result(timeout=5) == []
+    finally:
+        batcher.close()
+    assert sizes == [1, 1]
+
+
+def test_batch_spans_are_reported_with_each_request():
+    from metrics import span, start_request_timings
+
+    def search(queries, top_ks):
+        with span('embed'):
+            time.sleep(0.01)
+        return [[] for _ in queries]
+
+    batcher = QueryBatcher(search, max_batch_size=8, max_wait_ms=20.0)
+
+    async def one_request(query):
+        timings = start_request_timings()
+        await asyncio.wrap_future(batcher.submit_future(query, 1))
+        return timings.as_dict()
+
+    async def run():
+        return await asyncio.gather(one_request("karma"), one_request("dharma"))
+
+    try:
+        reports = asyncio.run(run())
+    finally:
+        batcher.close()
+    for report in reports:
+        assert report['embed'] >= 10.0
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from web_search import WebSearcher
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        body = ''.join(f'<li class="b_algo"><h2><a href="https://example.org/{n}">Result {n} for {query}</a></h2>'
+                       f'<p>Snippet {n}</p></li>' for n in range(3))
+        data = f'<html><body><ol id="b_results">{body}</ol></body></html>'.encode('utf-8')
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out first
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.latency = 0.0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/search"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_with(searcher, coro):
+    async def run():
+        try:
+            return await coro
+        finally:
+            await searcher.close()
+    return asyncio.run(run())
+
+
+def test_repeated_query_is_served_from_cache(stub):
+    searcher = WebSearcher(base_url=stub.url)
+
+    async def search_twice():
+        first = await searcher.search("What is dharma?")
+        second = await searcher.search("what is  DHARMA")
+        return first, second
+
+    first, second = run_with(searcher, search_twice())
+    assert [r['title'] for r in first] == [f"Result {n} for What is dharma?" for n in range(3)]
+    assert second == first
+    assert stub.requests == 1
+    assert searcher.cache.info()['hits'] == 1
+
+
+def test_concurrent_searches_share_one_request(stub):
+    stub.latency = 0.1
+    searcher = WebSearcher(base_url=stub.url)
+
+    async def search_together():
+        return await asyncio.gather(*[searcher.search("Who was Prahlada?") for _ in range(5)])
+
+    results = run_with(searcher, search_together())
+    assert stub.requests == 1
+    assert all(r == results[0] and r for r in results)
+    assert searcher.inflight == {}
+
+
+def test_timeout_returns_no_results_and_is_not_cached(stub):
+    stub.latency = 0.5
+    searcher = WebSearcher(base_url=stub.url, read_timeout=0.1)
+
+    async def search_slow():
+        started = time.monotonic()
+        results = await searcher.search("karma")
+        return results, time.monotonic() - started
+
+    results, elapsed = run_with(searcher, search_slow())
+    assert results == []
+    assert elapsed < 0.45
+    assert searcher.errors == 1
+    assert searcher.cache.get("karma") is None
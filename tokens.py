@@ -0,0 +1,5 @@
+def estimate_tokens(text):
+    # Close enough for quota accounting, prompt budgets and chunk sizing
+    # (~4 characters per token). Kept dependency-free so the indexing
+    # pipeline can use it without importing the LLM client.
+    return max(1, len(text) // 4)
@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+
+from cache import LRUCache, normalize_query
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+BING_SEARCH_URL = "https://www.bing.com/search"
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+# Only the organic result items are turned into a tree; the rest of the page
+# (scripts, ads, navigation) is skipped by the tokenizer
+RESULT_ITEMS = SoupStrainer('li', class_='b_algo')
+
+
+def parse_web_results(html, max_results=5):
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=RESULT_ITEMS)
+    results = []
+    for result in soup.find_all('li', class_='b_algo', limit=max_results):
+        title = result.find('h2')
+        link = result.find('a', href=True)
+        snippet = result.find('p')
+        results.append({
+            'title': title.get_text() if title else '',
+            'link': link['href'] if link else '',
+            'snippet': snippet.get_text() if snippet else '',
+        })
+    return results
+
+
+class WebSearcher:
+    """
+    Web search over one pooled keep-alive HTTP client with separate connect
+    and read timeouts. Parsed results are cached by normalized query, and
+    concurrent searches for the same query share one request. base_url can
+    point at a local stub server that serves Bing-shaped HTML.
+    """
+
+    def __init__(self, base_url=BING_SEARCH_URL, connect_timeout=1.0, read_timeout=3.0,
+                 max_connections=20, cache_size=1024, cache_ttl=900.0, max_results=5, headers=None):
+        self.base_url = base_url
+        self.max_results = max_results
+        self.client = httpx.AsyncClient(
+            headers=headers or DEFAULT_HEADERS,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+        )
+        self.cache = LRUCache(max_entries=cache_size, max_bytes=8 * 1024 * 1024, ttl=cache_ttl)
+        self.inflight = {}
+        self.requests = 0
+        self.errors = 0
+        self.skipped = 0
+
+    async def search(self, query):
+        key = normalize_query(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return [dict(r) for r in cached]
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.fetch(query, key))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # Shielded so a caller that times out doesn't cancel the request for
+        # the others; a late response still lands in the cache
+        return [dict(r) for r in await asyncio.shield(task)]
+
+    async def fetch(self, query, key):
+        self.requests += 1
+        try:
+            response = await self.client.get(self.base_url, params={'q': query})
+            if response.status_code != 200:
+                self.errors += 1
+                print(f"Web search returned HTTP {response.status_code}")
+                return []
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(None, parse_web_results, response.text, self.max_results)
+        except Exception as e:
+            self.errors += 1
+            print(f"Web search error: {e!r}")
+            return []
+        self.cache.set(key, results)
+        return results
+
+    def info(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'inflight': len(self.inflight),
+            'parser': HTML_PARSER,
+            'cache': self.cache.info(),
+        }
+
+    async def close(self):
+        await self.client.aclose()